@@ -11,6 +11,7 @@ Using locally running LLMs via Ollama or LM Studio.
 
 from .nodes import (
     WanPromptCrafterNode,
+    WanPromptCrafterBatchNode,
     InspireMeNode,
     VideoSequenceNode,
     PromptHistoryLoadNode,
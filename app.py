@@ -1,9 +1,105 @@
 import customtkinter as ctk
 import backend
 import threading
+import time
 import clipboard
+from task_executor import TaskExecutor
 from tkinter import messagebox
 from datetime import datetime
+from collections import OrderedDict
+
+# How often streamed tokens are flushed into the output box (ms)
+STREAM_REFRESH_MS = 50
+
+# Typing an idea re-checks that the selected model is still loaded at most this often (seconds)
+WARM_RECHECK_S = 60
+
+# Virtualized history list: fixed-height rows, fetched from the store a page at a time
+HISTORY_ROW_HEIGHT = 230
+HISTORY_PAGE_SIZE = 50
+HISTORY_CACHED_PAGES = 20
+HISTORY_WHEEL_STEP = 60  # pixels per mouse wheel notch
+
+
+class HistoryRow:
+    """One row widget of the virtualized history list; re-bound to new entries while scrolling."""
+
+    def __init__(self, app, parent):
+        self.app = app
+        self.entry = None
+
+        # Item container - fixed height so rows can be positioned without measuring
+        self.frame = ctk.CTkFrame(parent, height=HISTORY_ROW_HEIGHT - 16)
+        self.frame.pack_propagate(False)
+
+        # Header with timestamp and delete button
+        header_frame = ctk.CTkFrame(self.frame, fg_color="transparent", height=25)
+        header_frame.pack(fill="x", padx=10, pady=(10,5))
+        header_frame.grid_columnconfigure(0, weight=1)
+
+        self.timestamp_label = ctk.CTkLabel(header_frame, text="", font=ctk.CTkFont(size=11, weight="bold"))
+        self.timestamp_label.grid(row=0, column=0, sticky="w")
+
+        delete_btn = ctk.CTkButton(header_frame, text="❌", width=25, height=25, font=ctk.CTkFont(size=10),
+                                   command=lambda: self.app.delete_history_item(self.entry))
+        delete_btn.grid(row=0, column=1, sticky="e")
+
+        # Model and creativity info
+        self.info_label = ctk.CTkLabel(self.frame, text="", font=ctk.CTkFont(size=10), text_color="gray")
+        self.info_label.pack(anchor="w", padx=10, pady=(0,5))
+
+        # User idea (truncated)
+        self.user_label = ctk.CTkLabel(self.frame, text="", font=ctk.CTkFont(size=11, weight="bold"),
+                                       wraplength=280, justify="left")
+        self.user_label.pack(anchor="w", padx=10, pady=(0,5))
+
+        # Generated prompt preview (3-4 lines worth)
+        prompt_frame = ctk.CTkFrame(self.frame, fg_color="transparent")
+        prompt_frame.pack(fill="x", padx=10, pady=(0,10))
+        prompt_frame.grid_columnconfigure(0, weight=1)
+
+        self.prompt_label = ctk.CTkLabel(prompt_frame, text="", font=ctk.CTkFont(size=10),
+                                         wraplength=280, justify="left", height=60)  # Fixed height for 3-4 lines
+        self.prompt_label.grid(row=0, column=0, sticky="w")
+
+        # "..." expand button, only shown when the prompt is truncated
+        self.expand_btn = ctk.CTkButton(prompt_frame, text="...", width=30, height=20, font=ctk.CTkFont(size=12, weight="bold"),
+                                        command=lambda: self.app.show_full_prompt_at_cursor(self.entry, None))
+
+        # Button frame for actions
+        button_frame = ctk.CTkFrame(self.frame, fg_color="transparent")
+        button_frame.pack(fill="x", padx=10, pady=(0,10))
+        button_frame.grid_columnconfigure(0, weight=1)
+
+        use_btn = ctk.CTkButton(button_frame, text="Use This Prompt", font=ctk.CTkFont(size=10), height=30,
+                                command=lambda: self.app.use_history_item(self.entry))
+        use_btn.pack(side="left")
+
+        for widget in (self.frame, header_frame, self.timestamp_label, self.info_label, self.user_label,
+                       prompt_frame, self.prompt_label, button_frame):
+            self.app.bind_history_wheel(widget)
+
+    def show(self, entry):
+        """Point this row at another history entry (no widgets are created)."""
+        if self.entry is not None and entry is not None and self.entry.get('id') == entry.get('id'):
+            return
+        self.entry = entry
+
+        timestamp = datetime.fromisoformat(entry['timestamp'])
+        self.timestamp_label.configure(text=f"🕒 {timestamp.strftime('%m/%d %H:%M')}")
+        self.info_label.configure(text=f"{entry['service']} • {entry['model']} • {entry['creativity_level']}")
+
+        user_idea = entry['user_idea'][:80] + "..." if len(entry['user_idea']) > 80 else entry['user_idea']
+        self.user_label.configure(text=f"💭 {user_idea}")
+
+        prompt = entry['generated_prompt']
+        prompt_preview = prompt[:280] + "..." if len(prompt) > 280 else prompt
+        self.prompt_label.configure(text=f"🎬 {prompt_preview}")
+        if len(prompt) > 280:
+            self.expand_btn.grid(row=0, column=1, sticky="e", padx=(5,0))
+        else:
+            self.expand_btn.grid_remove()
+
 
 class Wan2PromptApp(ctk.CTk):
     def __init__(self):
@@ -24,6 +120,18 @@ class Wan2PromptApp(ctk.CTk):
         self.grid_columnconfigure(1, weight=0)  # History panel - fixed width, no expansion
         self.grid_rowconfigure(0, weight=1)
 
+        # Background work: one live task per slot ("generate", "models", "pull");
+        # starting a new one cancels the previous task and drops its late result
+        self.tasks = TaskExecutor(dispatch=lambda fn: self.after(0, fn))
+        # Warm-ups get their own worker: a superseded one may still be waiting for the server
+        # to load its model, and must not hold a thread the "generate" slot needs
+        self.warm_tasks = TaskExecutor(max_workers=1, dispatch=lambda fn: self.after(0, fn))
+        self.closing = False
+        # Last model warm-up: (service, api_url, model) and when it started
+        self._warm_key = None
+        self._warm_started = 0.0
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         # --- Default Negative Prompt ---
         self.DEFAULT_NEGATIVE_PROMPT = "bright colors, overexposed, static, blurred details, subtitles, style, artwork, painting, picture, still, overall gray, worst quality, low quality, JPEG compression residue, ugly, incomplete, extra fingers, poorly drawn hands, poorly drawn faces, deformed, disfigured, malformed limbs, fused fingers, still picture, cluttered background, three legs, many people in the background, walking backwards"
 
@@ -40,6 +148,8 @@ class Wan2PromptApp(ctk.CTk):
         self.create_widgets()
         self.update_ui_for_service() # Set initial state
         self.load_history() # Load initial history
+        # Build the history search index off the UI thread so the first search is instant
+        threading.Thread(target=backend.get_search_index, daemon=True).start()
         
         # History panel starts collapsed - no need to toggle it
 
@@ -64,7 +174,8 @@ class Wan2PromptApp(ctk.CTk):
         # Row 1: Model Selector and Refresh Button
         ctk.CTkLabel(config_frame, text="Model:", font=ctk.CTkFont(weight="bold")).grid(row=1, column=0, padx=2, pady=6, sticky="w")
         self.model_var = ctk.StringVar(value="Loading...")
-        self.model_menu = ctk.CTkOptionMenu(config_frame, variable=self.model_var, values=[""], state="disabled")
+        self.model_menu = ctk.CTkOptionMenu(config_frame, variable=self.model_var, values=[""], state="disabled",
+                                            command=self.on_model_selected)
         self.model_menu.grid(row=1, column=1, padx=2, pady=6, sticky="ew")
         
         self.refresh_button = ctk.CTkButton(config_frame, text="⟳ Refresh", width=80, command=self.refresh_models)
@@ -81,6 +192,10 @@ class Wan2PromptApp(ctk.CTk):
         self.creativity_var = ctk.StringVar(value="High Freedom")
         self.creativity_switch = ctk.CTkSegmentedButton(config_frame, values=["Moderate Freedom", "High Freedom"], variable=self.creativity_var)
         self.creativity_switch.grid(row=2, column=1, columnspan=4, padx=10, pady=6, sticky="ew")
+
+        # Row 4: Model load status (the selected model is loaded in the background)
+        self.model_status_label = ctk.CTkLabel(config_frame, text="", font=ctk.CTkFont(size=11), text_color="gray")
+        self.model_status_label.grid(row=3, column=1, columnspan=4, padx=10, pady=(0, 6), sticky="w")
         
         # --- User Input Frame ---
         input_frame = ctk.CTkFrame(self.main_frame)
@@ -93,6 +208,7 @@ class Wan2PromptApp(ctk.CTk):
         ctk.CTkLabel(input_frame, text="Your Idea or Basic Prompt", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, padx=10, pady=(10,5), sticky="w")
         self.user_input_textbox = ctk.CTkTextbox(input_frame, height=160, wrap="word")
         self.user_input_textbox.grid(row=1, column=0, padx=10, pady=(0,10), sticky="nsew")
+        self.user_input_textbox.bind("<KeyRelease>", self.on_idea_typed)
 
         self.inspire_button = ctk.CTkButton(input_frame, text="✨ Inspire Me", command=self.run_inspiration)
         self.inspire_button.grid(row=0, column=1, padx=10, pady=(10,5), sticky="e")
@@ -197,9 +313,21 @@ class Wan2PromptApp(ctk.CTk):
         self.history_creativity_filter = ctk.CTkOptionMenu(filter_frame, values=["All", "Moderate Freedom", "High Freedom"], command=self.on_filter_change)
         self.history_creativity_filter.grid(row=2, column=2, sticky="ew", pady=(0,5))
 
-        # History listbox with scrollbar - use full available space
-        self.history_listbox = ctk.CTkScrollableFrame(self.history_content_frame)
-        self.history_listbox.grid(row=2, column=0, padx=10, pady=5, sticky="nsew")
+        # History list with scrollbar - virtualized: only the visible rows exist as widgets
+        history_list_frame = ctk.CTkFrame(self.history_content_frame)
+        history_list_frame.grid(row=2, column=0, padx=10, pady=5, sticky="nsew")
+        history_list_frame.grid_columnconfigure(0, weight=1)
+        history_list_frame.grid_rowconfigure(0, weight=1)
+
+        self.history_viewport = ctk.CTkFrame(history_list_frame, fg_color="transparent")
+        self.history_viewport.grid(row=0, column=0, sticky="nsew")
+        self.history_viewport.bind("<Configure>", self.on_history_viewport_resize)
+        self.bind_history_wheel(self.history_viewport)
+
+        self.history_scrollbar = ctk.CTkScrollbar(history_list_frame, command=self.on_history_scrollbar)
+        self.history_scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.history_empty_label = ctk.CTkLabel(self.history_viewport, text="No prompts in history", text_color="gray")
 
         # History management buttons
         button_frame = ctk.CTkFrame(self.history_content_frame, fg_color="transparent")
@@ -217,17 +345,32 @@ class Wan2PromptApp(ctk.CTk):
         self.history_model_filter.set("All")
         self.history_creativity_filter.set("All")
 
-        # History data
-        self.history_data = []
-        self.filtered_history = []
+        # History view state: the current result set is either a filtered window onto the
+        # store (history_ids is None) or an ordered list of search-result ids
+        self.history_total = 0
+        self.history_ids = None
+        self.history_filters = {}
+        self.history_pages = OrderedDict()
+        # Store reads run on the "history" task slot; no pages are fetched while a query is pending
+        self.history_loading = False
+        self.history_scroll_px = 0
+        self.history_rows = []
 
     # --- UI Logic and Callbacks ---
     
-    def set_ui_loading(self, is_loading):
-        """Disables/Enables buttons during generation."""
+    def set_ui_loading(self, is_loading, allow_restart=False):
+        """
+        Disables/Enables buttons during generation.
+        With allow_restart, Generate / Inspire stay clickable: a new click supersedes the running request.
+        """
         state = "disabled" if is_loading else "normal"
-        self.generate_button.configure(state=state, text="Generating..." if is_loading else "Generate Wan 2.2 Prompt")
-        self.inspire_button.configure(state=state)
+        action_state = "normal" if allow_restart else state
+        if is_loading:
+            generate_text = "Generating... (click to restart)" if allow_restart else "Generating..."
+        else:
+            generate_text = "Generate Wan 2.2 Prompt"
+        self.generate_button.configure(state=action_state, text=generate_text)
+        self.inspire_button.configure(state=action_state)
         self.refresh_button.configure(state=state)
         self.ollama_pull_button.configure(state=state)
         self.service_switch.configure(state=state)
@@ -257,6 +400,50 @@ class Wan2PromptApp(ctk.CTk):
         self.output_textbox.insert("1.0", text)
         self.output_textbox.configure(state="disabled")
 
+    # --- Streaming Output ---
+
+    def begin_stream_output(self, prefix="", owner=None):
+        """
+        Prepare the output box for a new token stream (main thread).
+        Only tokens queued by `owner` are shown; a superseded stream's stragglers are dropped.
+        """
+        self._stream_lock = threading.Lock()
+        self._stream_buffer = []
+        self._stream_flush_pending = False
+        self._stream_started = False
+        self._stream_prefix = prefix
+        self._stream_owner = owner
+
+    def queue_stream_text(self, token, owner=None):
+        """Buffer a streamed token (worker thread); flushes are coalesced to STREAM_REFRESH_MS."""
+        with self._stream_lock:
+            if owner is not self._stream_owner:
+                return
+            self._stream_buffer.append(token)
+            if self._stream_flush_pending:
+                return
+            self._stream_flush_pending = True
+        self.after(STREAM_REFRESH_MS, self.flush_stream_text)
+
+    def flush_stream_text(self):
+        """Append buffered tokens to the output box (main thread)."""
+        with self._stream_lock:
+            text = "".join(self._stream_buffer)
+            self._stream_buffer = []
+            self._stream_flush_pending = False
+        if not text:
+            return
+
+        self.output_textbox.configure(state="normal")
+        if not self._stream_started:
+            # Replace the "crafting..." placeholder on the first token
+            self._stream_started = True
+            self.output_textbox.delete("1.0", "end")
+            text = self._stream_prefix + text
+        self.output_textbox.insert("end", text)
+        self.output_textbox.see("end")
+        self.output_textbox.configure(state="disabled")
+
     def toggle_neg_prompt_edit(self):
         is_checked = self.edit_neg_prompt_check.get()
         self.neg_prompt_textbox.configure(state="normal" if is_checked else "disabled")
@@ -269,31 +456,77 @@ class Wan2PromptApp(ctk.CTk):
         else:
             messagebox.showwarning("Empty!", "There is no prompt to copy.")
             
-    # --- Threaded Backend Calls ---
+    # --- Background Backend Calls ---
+
+    def on_close(self):
+        """Abort running requests (so the server stops generating) before closing the window."""
+        self.closing = True
+        self.tasks.shutdown()
+        self.warm_tasks.shutdown()
+        self.destroy()
     
     def refresh_models(self):
         self.model_menu.configure(state="disabled")
         self.model_var.set("Fetching...")
-        threading.Thread(target=self._refresh_models_thread, daemon=True).start()
+        self.model_status_label.configure(text="")
+        # A newer refresh (e.g. after switching service) supersedes this one
+        self.tasks.submit("models", self._refresh_models_thread, self.service_var.get(), self.api_url_entry.get(),
+                          on_done=self.show_models)
 
-    def _refresh_models_thread(self):
-        service = self.service_var.get()
-        api_url = self.api_url_entry.get()
-        
+    def _refresh_models_thread(self, service, api_url, cancel_token=None):
         if service == "LM Studio":
-            models = backend.get_lm_studio_models(api_url)
+            return backend.get_lm_studio_models(api_url)
+        return backend.get_ollama_models(api_url)
+
+    def show_models(self, models):
+        if models:
+            self.model_menu.configure(values=models, state="normal")
+            self.model_var.set(models[0])
+            self.prewarm_model()
         else:
-            models = backend.get_ollama_models(api_url)
-            
-        def update_gui():
-            if models:
-                self.model_menu.configure(values=models, state="normal")
-                self.model_var.set(models[0])
-            else:
-                self.model_menu.configure(values=["No models found"], state="disabled")
-                self.model_var.set("No models found")
-        
-        self.after(0, update_gui)
+            self.model_menu.configure(values=["No models found"], state="disabled")
+            self.model_var.set("No models found")
+
+    # --- Model Pre-warming ---
+
+    def on_model_selected(self, value):
+        self.prewarm_model()
+
+    def on_idea_typed(self, event=None):
+        # Typing means a generation is coming: make sure the model is (still) loaded
+        self.prewarm_model(recheck_after=WARM_RECHECK_S)
+
+    def prewarm_model(self, recheck_after=0):
+        """
+        Load the selected model in the background so the first generation does not pay the load time.
+        Skipped if the same model's warm-up started less than recheck_after seconds ago.
+        """
+        model = self.model_var.get()
+        if model in ["Loading...", "Fetching...", "No models found", ""]:
+            return
+        key = (self.service_var.get(), self.api_url_entry.get(), model)
+        now = time.monotonic()
+        if key == self._warm_key and now - self._warm_started < recheck_after:
+            return
+        self._warm_key, self._warm_started = key, now
+        self.model_status_label.configure(text=f"⏳ Loading {model}...")
+        # A newer selection supersedes this warm-up
+        self.warm_tasks.submit("warm", self._warm_model_thread, *key, on_done=self.show_model_warm,
+                          on_error=lambda error: self.show_model_warm_error(model, error))
+
+    def _warm_model_thread(self, service, api_url, model, cancel_token=None):
+        return backend.warm_model(service, api_url, model, cancel_token=cancel_token)
+
+    def show_model_warm(self, result):
+        if result["loaded"]:
+            self.model_status_label.configure(text=f"✅ {result['model']} ready (loaded in {result['seconds']:.1f}s)")
+        else:
+            self.model_status_label.configure(text=f"✅ {result['model']} ready")
+
+    def show_model_warm_error(self, model, error):
+        # Not fatal: the first generation just loads the model itself (and reports a real failure)
+        print(f"Could not preload {model}: {error}")
+        self.model_status_label.configure(text=f"⚠️ Could not preload {model}")
 
     def pull_model(self):
         model_name = self.ollama_pull_entry.get()
@@ -303,11 +536,10 @@ class Wan2PromptApp(ctk.CTk):
         
         self.set_ui_loading(True)
         self.update_output_text(f"Pulling model: {model_name}...\nThis can take a while. See console for progress.")
-        threading.Thread(target=self._pull_model_thread, args=(model_name,), daemon=True).start()
+        self.tasks.submit("pull", self._pull_model_thread, model_name, self.api_url_entry.get(),
+                          on_done=self.finish_pull)
 
-    def _pull_model_thread(self, model_name):
-        api_url = self.api_url_entry.get()
-        
+    def _pull_model_thread(self, model_name, api_url, cancel_token=None):
         def progress_update(data):
             # Simple progress print to console, can be made more elaborate in GUI
             status = data.get('status', '')
@@ -317,16 +549,16 @@ class Wan2PromptApp(ctk.CTk):
             else:
                 print(f"\rPulling {model_name}: {status}", end="")
 
-        success, message = backend.pull_ollama_model(model_name, api_url, progress_update)
+        result = backend.pull_ollama_model(model_name, api_url, progress_update, cancel_token=cancel_token)
         print() # Newline after progress bar
-        
-        def update_gui():
-            self.set_ui_loading(False)
-            self.update_output_text(message)
-            if success:
-                self.refresh_models() # Refresh list to include new model
-        
-        self.after(0, update_gui)
+        return result
+
+    def finish_pull(self, result):
+        success, message = result
+        self.set_ui_loading(False)
+        self.update_output_text(message)
+        if success:
+            self.refresh_models() # Refresh list to include new model
 
 
     def run_generation(self):
@@ -337,7 +569,7 @@ class Wan2PromptApp(ctk.CTk):
             messagebox.showerror("Error", "The input idea cannot be empty.")
             return
 
-        self.set_ui_loading(True)
+        self.set_ui_loading(True, allow_restart=True)
         self.update_output_text("The LLM is crafting your prompt...")
 
         params = {
@@ -347,32 +579,45 @@ class Wan2PromptApp(ctk.CTk):
             "creativity_level": self.creativity_var.get(),
             "user_idea": self.user_input_textbox.get("1.0", "end-1c")
         }
-        
-        threading.Thread(target=self._run_generation_thread, args=(params,), daemon=True).start()
-
-    def _run_generation_thread(self, params):
-        result = backend.generate_prompt(**params)
-        def update_gui():
-            self.update_output_text(result)
-            self.set_ui_loading(False)
-
-            # Save to history if generation was successful (not an error message)
-            if result and not result.startswith("API Error:") and not result.startswith("Invalid service"):
-                try:
-                    backend.add_to_history(
-                        user_idea=params['user_idea'],
-                        generated_prompt=result,
-                        service=params['service'],
-                        model=params['model'],
-                        creativity_level=params['creativity_level'],
-                        api_url=params.get('api_url', '')
-                    )
-                    # Reload history display
-                    self.load_history()
-                except Exception as e:
-                    print(f"Error saving to history: {e}")
-
-        self.after(0, update_gui)
+        self.begin_stream_output(owner=params)
+
+        # Supersedes (and aborts) a generation or inspiration that is still running
+        self.tasks.submit("generate", self._run_generation_thread, params,
+                          on_done=lambda result: self.finish_generation(params, result),
+                          on_error=self.show_generation_error)
+
+    def _run_generation_thread(self, params, cancel_token=None):
+        chunks = []
+        for token in backend.stream_prompt(**params, cancel_token=cancel_token):
+            chunks.append(token)
+            self.queue_stream_text(token, owner=params)
+        return "".join(chunks).strip()
+
+    def finish_generation(self, params, result):
+        self.flush_stream_text()
+        self.update_output_text(result)
+        self.set_ui_loading(False)
+
+        # Failures arrive at show_generation_error instead, so any text here is a real prompt.
+        # The write happens on the background history writer; the panel reloads once it lands.
+        if result:
+            try:
+                backend.queue_history_entry(
+                    user_idea=params['user_idea'],
+                    generated_prompt=result,
+                    service=params['service'],
+                    model=params['model'],
+                    creativity_level=params['creativity_level'],
+                    api_url=params.get('api_url', ''),
+                    on_saved=self.on_history_saved
+                )
+            except Exception as e:
+                print(f"Error saving to history: {e}")
+
+    def on_history_saved(self, entry):
+        """Called on the history writer thread once an entry is stored, deleted or the history cleared."""
+        if not self.closing:
+            self.after(0, self.load_history)
         
 
     def run_inspiration(self):
@@ -384,7 +629,7 @@ class Wan2PromptApp(ctk.CTk):
             user_idea = "a single leaf" # Default if empty
             self.user_input_textbox.insert("1.0", user_idea)
 
-        self.set_ui_loading(True)
+        self.set_ui_loading(True, allow_restart=True)
         self.update_output_text("Asking the LLM for inspiration...")
 
         params = {
@@ -393,15 +638,36 @@ class Wan2PromptApp(ctk.CTk):
             "model": self.model_var.get(),
             "user_idea": user_idea
         }
-
-        threading.Thread(target=self._run_inspiration_thread, args=(params,), daemon=True).start()
-
-    def _run_inspiration_thread(self, params):
-        result = backend.get_inspiration(**params)
-        def update_gui():
-            self.update_output_text(f"Here are a few ideas based on '{params['user_idea']}':\n\n{result}\n\nCopy one of these into the 'Your Idea' box to expand on it!")
-            self.set_ui_loading(False)
-        self.after(0, update_gui)
+        self.begin_stream_output(prefix=f"Here are a few ideas based on '{user_idea}':\n\n", owner=params)
+
+        # Shares the "generate" slot: both write to the output box
+        self.tasks.submit("generate", self._run_inspiration_thread, params,
+                          on_done=lambda result: self.finish_inspiration(params, result),
+                          on_error=self.show_generation_error)
+
+    def _run_inspiration_thread(self, params, cancel_token=None):
+        chunks = []
+        for token in backend.stream_inspiration(**params, cancel_token=cancel_token):
+            chunks.append(token)
+            self.queue_stream_text(token, owner=params)
+        return "".join(chunks).strip()
+
+    def finish_inspiration(self, params, result):
+        self.flush_stream_text()
+        self.update_output_text(f"Here are a few ideas based on '{params['user_idea']}':\n\n{result}\n\nCopy one of these into the 'Your Idea' box to expand on it!")
+        self.set_ui_loading(False)
+
+    def show_generation_error(self, error):
+        """Show a failed generation / inspiration (an LLMError from backend); nothing is saved to history."""
+        self.flush_stream_text()
+        if self._stream_started:
+            # Keep the text that already streamed in and put the error below it
+            self.output_textbox.configure(state="normal")
+            self.output_textbox.insert("end", f"\n\nAPI Error: {error}")
+            self.output_textbox.configure(state="disabled")
+        else:
+            self.update_output_text(f"API Error: {error}")
+        self.set_ui_loading(False)
 
     # --- History Panel Methods ---
 
@@ -440,94 +706,134 @@ class Wan2PromptApp(ctk.CTk):
                 self.geometry(f"{new_width}x850")
 
     def load_history(self):
-        """Load and display history from file"""
-        self.history_data = backend.load_history()
-        self.filtered_history = self.history_data.copy()
-        self.update_history_display()
-        self.update_model_filter()
-
-    def update_history_display(self):
-        """Update the history list display"""
-        # Clear existing history items
-        for widget in self.history_listbox.winfo_children():
-            widget.destroy()
-
-        if not self.filtered_history:
-            no_history_label = ctk.CTkLabel(self.history_listbox, text="No prompts in history", text_color="gray")
-            no_history_label.pack(pady=20)
-            return
-
-        # Display history items
-        for i, entry in enumerate(self.filtered_history):
-            self.create_history_item(i, entry)
-
-    def create_history_item(self, index, entry):
-        """Create a single history item widget"""
-        # Item container - larger height for better readability
-        item_frame = ctk.CTkFrame(self.history_listbox)
-        item_frame.pack(fill="x", padx=5, pady=8)  # Increased padding
-
-        # Timestamp
-        timestamp = datetime.fromisoformat(entry['timestamp'])
-        time_str = timestamp.strftime("%m/%d %H:%M")
+        """Reload history from the store, keeping the current filters and scroll position"""
+        self.apply_filters(keep_scroll=True, with_models=True)
+
+    # --- Virtualized History List ---
+
+    def bind_history_wheel(self, widget):
+        """Route mouse wheel events on a widget to the history list"""
+        widget.bind("<MouseWheel>", self.on_history_wheel)  # Windows / macOS
+        widget.bind("<Button-4>", self.on_history_wheel)    # Linux scroll up
+        widget.bind("<Button-5>", self.on_history_wheel)    # Linux scroll down
+
+    def get_history_entry(self, index):
+        """Entry at a position in the current result set, or None if its page is not loaded yet"""
+        page_no = index // HISTORY_PAGE_SIZE
+        page = self.history_pages.get(page_no)
+        if page is None:
+            return None
+        self.history_pages.move_to_end(page_no)
+        position = index - page_no * HISTORY_PAGE_SIZE
+        return page[position] if position < len(page) else None
+
+    @staticmethod
+    def visible_history_pages(first_index, rows, total):
+        """Numbers of the pages holding `rows` rows from first_index on"""
+        last_index = min(first_index + rows, total) - 1
+        return list(range(first_index // HISTORY_PAGE_SIZE, last_index // HISTORY_PAGE_SIZE + 1))
+
+    @staticmethod
+    def _fetch_history_pages(ids, filters, page_numbers):
+        """Load result-set pages from the store (runs off the UI thread)"""
+        pages = {}
+        for page_no in page_numbers:
+            offset = page_no * HISTORY_PAGE_SIZE
+            if ids is not None:
+                pages[page_no] = backend.get_history_entries(ids[offset:offset + HISTORY_PAGE_SIZE])
+            else:
+                pages[page_no] = backend.history_page(offset, HISTORY_PAGE_SIZE, **filters)
+        return pages
 
-        # Header with timestamp and delete button
-        header_frame = ctk.CTkFrame(item_frame, fg_color="transparent", height=25)
-        header_frame.pack(fill="x", padx=10, pady=(10,5))
-        header_frame.grid_columnconfigure(0, weight=1)
+    def _load_history_pages_thread(self, ids, filters, page_numbers, cancel_token=None):
+        return self._fetch_history_pages(ids, filters, page_numbers)
 
-        timestamp_label = ctk.CTkLabel(header_frame, text=f"🕒 {time_str}", font=ctk.CTkFont(size=11, weight="bold"))
-        timestamp_label.grid(row=0, column=0, sticky="w")
+    def store_history_pages(self, pages):
+        for page_no, page in pages.items():
+            self.history_pages[page_no] = page
+            self.history_pages.move_to_end(page_no)
+        while len(self.history_pages) > HISTORY_CACHED_PAGES:
+            self.history_pages.popitem(last=False)
 
-        delete_btn = ctk.CTkButton(header_frame, text="❌", width=25, height=25, font=ctk.CTkFont(size=10), command=lambda: self.delete_history_item(index))
-        delete_btn.grid(row=0, column=1, sticky="e")
+    def show_history_pages(self, pages):
+        self.store_history_pages(pages)
+        self.update_history_display()
 
-        # Model and creativity info
-        info_label = ctk.CTkLabel(item_frame, text=f"{entry['service']} • {entry['model']} • {entry['creativity_level']}",
-                                 font=ctk.CTkFont(size=10), text_color="gray")
-        info_label.pack(anchor="w", padx=10, pady=(0,5))
+    def update_history_display(self):
+        """Position the pooled rows for the current scroll offset and bind them to entries"""
+        viewport_height = max(self.history_viewport.winfo_height(), 1)
+
+        # Grow the row pool to cover the viewport (rows are never destroyed, only reused)
+        needed_rows = viewport_height // HISTORY_ROW_HEIGHT + 2
+        while len(self.history_rows) < needed_rows:
+            self.history_rows.append(HistoryRow(self, self.history_viewport))
+
+        content_height = self.history_total * HISTORY_ROW_HEIGHT
+        max_scroll = max(0, content_height - viewport_height)
+        self.history_scroll_px = min(max(0, self.history_scroll_px), max_scroll)
+        first_index = self.history_scroll_px // HISTORY_ROW_HEIGHT
+        shift = self.history_scroll_px % HISTORY_ROW_HEIGHT
+
+        missing_pages = set()
+        for slot, row in enumerate(self.history_rows):
+            entry = None
+            if slot < needed_rows and first_index + slot < self.history_total:
+                entry = self.get_history_entry(first_index + slot)
+                if entry is None:
+                    missing_pages.add((first_index + slot) // HISTORY_PAGE_SIZE)
+            if entry is None:
+                row.frame.place_forget()
+                continue
+            row.show(entry)
+            row.frame.place(x=0, y=slot * HISTORY_ROW_HEIGHT - shift + 8, relwidth=1.0)
+
+        if missing_pages and not self.history_loading:
+            # Rows fill in once their pages are read; a newer scroll position supersedes this load
+            self.tasks.submit("history", self._load_history_pages_thread, self.history_ids, dict(self.history_filters),
+                              sorted(missing_pages), on_done=self.show_history_pages)
+
+        if self.history_total == 0:
+            self.history_empty_label.place(relx=0.5, y=20, anchor="n")
+            self.history_scrollbar.set(0.0, 1.0)
+        else:
+            self.history_empty_label.place_forget()
+            self.history_scrollbar.set(self.history_scroll_px / content_height,
+                                       min(1.0, (self.history_scroll_px + viewport_height) / content_height))
 
-        # User idea (truncated)
-        user_idea = entry['user_idea'][:80] + "..." if len(entry['user_idea']) > 80 else entry['user_idea']
-        user_label = ctk.CTkLabel(item_frame, text=f"💭 {user_idea}", font=ctk.CTkFont(size=11, weight="bold"),
-                                 wraplength=280, justify="left")
-        user_label.pack(anchor="w", padx=10, pady=(0,5))
+    def scroll_history(self, delta_px):
+        self.history_scroll_px += int(delta_px)
+        self.update_history_display()
 
-        # Generated prompt preview (3-4 lines worth)
-        prompt_preview = entry['generated_prompt'][:280] + "..." if len(entry['generated_prompt']) > 280 else entry['generated_prompt']
-        
-        prompt_frame = ctk.CTkFrame(item_frame, fg_color="transparent")
-        prompt_frame.pack(fill="x", padx=10, pady=(0,10))
-        prompt_frame.grid_columnconfigure(0, weight=1)
-        
-        prompt_label = ctk.CTkLabel(prompt_frame, text=f"🎬 {prompt_preview}", font=ctk.CTkFont(size=10),
-                                   wraplength=280, justify="left", height=60)  # Fixed height for 3-4 lines
-        prompt_label.grid(row=0, column=0, sticky="w")
-        
-        # "..." expand button if text is truncated
-        if len(entry['generated_prompt']) > 280:
-            expand_btn = ctk.CTkButton(prompt_frame, text="...", width=30, height=20, font=ctk.CTkFont(size=12, weight="bold"),
-                                     command=lambda e=entry, btn=None: self.show_full_prompt_at_cursor(e, btn))
-            expand_btn.grid(row=0, column=1, sticky="e", padx=(5,0))
+    def on_history_wheel(self, event):
+        if getattr(event, "num", None) == 4:
+            notches = 1
+        elif getattr(event, "num", None) == 5:
+            notches = -1
+        else:
+            # Windows reports multiples of 120, macOS small deltas
+            notches = event.delta / 120 if abs(event.delta) >= 120 else event.delta
+        self.scroll_history(-notches * HISTORY_WHEEL_STEP)
+
+    def on_history_scrollbar(self, action, amount, unit=None):
+        content_height = self.history_total * HISTORY_ROW_HEIGHT
+        if action == "moveto":
+            self.history_scroll_px = int(float(amount) * content_height)
+            self.update_history_display()
+        elif action == "scroll":
+            # CTkScrollbar reports about 3 units per wheel notch
+            step = self.history_viewport.winfo_height() if unit == "pages" else HISTORY_WHEEL_STEP / 3
+            self.scroll_history(float(amount) * step)
 
-        # Button frame for actions
-        button_frame = ctk.CTkFrame(item_frame, fg_color="transparent")
-        button_frame.pack(fill="x", padx=10, pady=(0,10))
-        button_frame.grid_columnconfigure(0, weight=1)
-        
-        use_btn = ctk.CTkButton(button_frame, text="Use This Prompt", font=ctk.CTkFont(size=10), height=30,
-                               command=lambda: self.use_history_item(entry))
-        use_btn.pack(side="left")
+    def on_history_viewport_resize(self, event=None):
+        self.update_history_display()
 
-    def delete_history_item(self, index):
+    def delete_history_item(self, entry):
         """Delete a specific history item"""
+        if entry is None:
+            return
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this prompt from history?"):
-            # Convert filtered index to actual index in history_data
-            if index < len(self.filtered_history):
-                actual_index = self.history_data.index(self.filtered_history[index])
-                self.history_data = backend.delete_from_history(actual_index)
-                self.filtered_history = self.history_data.copy()
-                self.apply_filters()
+            # Queued behind pending writes; the list reloads once the writer has deleted it
+            backend.queue_history_delete(entry['id'], on_done=self.on_history_saved)
 
     def show_full_prompt_at_cursor(self, entry, button_widget):
         """Show the full prompt in a popup window positioned near the cursor"""
@@ -679,6 +985,7 @@ class Wan2PromptApp(ctk.CTk):
 
         if entry.get('model'):
             self.model_var.set(entry['model'])
+            self.prewarm_model(recheck_after=WARM_RECHECK_S)
 
         if entry.get('creativity_level'):
             self.creativity_var.set(entry['creativity_level'])
@@ -691,71 +998,104 @@ class Wan2PromptApp(ctk.CTk):
         """Handle filter changes"""
         self.apply_filters()
 
-    def apply_filters(self):
-        """Apply search and filter criteria"""
+    def apply_filters(self, keep_scroll=False, with_models=False):
+        """
+        Apply search and filter criteria. The store is queried on the "history" task slot
+        (a newer query supersedes it); with_models also refreshes the model filter choices.
+        """
         query = self.history_search_var.get().strip()
         service_filter = self.history_service_filter.get()
         model_filter = self.history_model_filter.get()
         creativity_filter = self.history_creativity_filter.get()
 
-        # Start with all history
-        filtered = self.history_data.copy()
+        self.history_filters = {
+            "service": service_filter if service_filter != "All" else None,
+            "model": model_filter if model_filter != "All" else None,
+            "creativity_level": creativity_filter if creativity_filter != "All" else None,
+        }
 
-        # Apply search
+        if not keep_scroll:
+            self.history_scroll_px = 0
+        self.history_loading = True
+        rows = max(self.history_viewport.winfo_height(), 1) // HISTORY_ROW_HEIGHT + 2
+        self.tasks.submit("history", self._query_history_thread, query, dict(self.history_filters),
+                          self.history_scroll_px // HISTORY_ROW_HEIGHT, rows, with_models,
+                          on_done=self.show_history_query,
+                          on_error=lambda error: self.show_history_query_error(error))
+
+    def _query_history_thread(self, query, filters, first_index, rows, with_models, cancel_token=None):
+        """The result set for a search / filter, with the pages of the rows that will be visible"""
+        result = {"models": backend.get_history_models() if with_models else None}
         if query:
-            filtered = backend.search_history(query, filtered)
-
-        # Apply service filter
-        if service_filter != "All":
-            filtered = [item for item in filtered if item.get('service') == service_filter]
-
-        # Apply model filter
-        if model_filter != "All":
-            filtered = [item for item in filtered if item.get('model') == model_filter]
-
-        # Apply creativity filter
-        if creativity_filter != "All":
-            filtered = [item for item in filtered if item.get('creativity_level') == creativity_filter]
-
-        self.filtered_history = filtered
+            # Search runs on the in-memory index; only the visible pages are fetched from the store
+            ids = backend.search_history_ids(query)
+            if any(filters.values()):
+                ids = backend.filter_history_ids(ids, **filters)
+            result["ids"], result["total"] = ids, len(ids)
+        else:
+            result["ids"], result["total"] = None, backend.count_history(**filters)
+        first_index = min(first_index, max(result["total"] - 1, 0))
+        result["pages"] = self._fetch_history_pages(result["ids"], filters,
+                                                    self.visible_history_pages(first_index, rows, result["total"]))
+        return result
+
+    def show_history_query(self, result):
+        self.history_loading = False
+        if result["models"] is not None and self.update_model_filter(result["models"]):
+            # The selected model is gone from history: query again without it
+            self.apply_filters(keep_scroll=True)
+            return
+        self.history_ids = result["ids"]
+        self.history_total = result["total"]
+        self.history_pages.clear()
+        self.store_history_pages(result["pages"])
+        for row in self.history_rows:
+            row.entry = None
         self.update_history_display()
 
-    def update_model_filter(self):
-        """Update the model filter dropdown with available models from history"""
-        models = set()
-        for entry in self.history_data:
-            if entry.get('model'):
-                models.add(entry['model'])
+    def show_history_query_error(self, error):
+        self.history_loading = False
+        print(f"Error loading history: {error}")
 
-        model_list = ["All"] + sorted(list(models))
+    def update_model_filter(self, models):
+        """
+        Update the model filter dropdown with the models present in history.
+        Returns True if the selected model was reset to "All".
+        """
+        model_list = ["All"] + models
         self.history_model_filter.configure(values=model_list)
         if self.history_model_filter.get() not in model_list:
             self.history_model_filter.set("All")
+            return True
+        return False
 
     def clear_history(self):
         """Clear all history"""
         if messagebox.askyesno("Confirm Clear", "Are you sure you want to clear all prompt history? This cannot be undone."):
-            self.history_data = backend.clear_history()
-            self.filtered_history = []
-            self.update_history_display()
-            self.update_model_filter()
+            backend.queue_history_clear(on_done=self.on_history_saved)
 
     def export_history(self):
         """Export history to file"""
-        if not self.history_data:
-            messagebox.showinfo("No Data", "No history data to export.")
-            return
-
         # Ask user for format
         format_choice = self.ask_export_format()
         if not format_choice:
             return
 
-        try:
-            filename = backend.export_history(format_choice)
+        # Reading the store and writing the file happen in the background
+        self.tasks.submit("export", self._export_history_thread, format_choice, on_done=self.show_export_done,
+                          on_error=lambda error: messagebox.showerror("Export Error",
+                                                                      f"Failed to export history: {error}"))
+
+    def _export_history_thread(self, format_choice, cancel_token=None):
+        if backend.count_history() == 0:
+            return None
+        return backend.export_history(format_choice)
+
+    def show_export_done(self, filename):
+        if filename is None:
+            messagebox.showinfo("No Data", "No history data to export.")
+        else:
             messagebox.showinfo("Export Complete", f"History exported to: {filename}")
-        except Exception as e:
-            messagebox.showerror("Export Error", f"Failed to export history: {e}")
 
     def ask_export_format(self):
         """Ask user for export format"""
@@ -791,4 +1131,7 @@ if __name__ == "__main__":
         except Exception:
             pass
 
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+
+    # Window closed: make sure queued history writes reach the database
+    backend.close_history_writer()
\ No newline at end of file
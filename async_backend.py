@@ -0,0 +1,408 @@
+"""
+asyncio counterparts of the backend generation functions.
+
+Same prompts, payloads, endpoint pools, circuit breakers, retries and typed
+errors (llm_errors.py) as backend.py, but driven from an event loop: hundreds
+of generations can be in flight at once without one OS thread per request.
+
+- Every call accepts `timeout` (seconds, for the whole call) and `client`
+  (the transport; defaults to a pooled async_http.AsyncHTTPClient per loop).
+- Cancelling the task aborts the request and closes its connection.
+"""
+
+import asyncio
+import inspect
+import json
+import time
+import weakref
+
+try:
+    from . import backend, cassette, endpoint_pool, http_client, metrics, resilience
+    from .async_http import AsyncHTTPClient, ConnectError, HTTPStatusError
+    from .llm_errors import (InvalidServiceError, LLMConnectionError, LLMError, LLMResponseError, LLMTimeoutError,
+                             StreamInterruptedError)
+except ImportError:
+    import backend
+    import cassette
+    import endpoint_pool
+    import http_client
+    import metrics
+    import resilience
+    from async_http import AsyncHTTPClient, ConnectError, HTTPStatusError
+    from llm_errors import (InvalidServiceError, LLMConnectionError, LLMError, LLMResponseError, LLMTimeoutError,
+                            StreamInterruptedError)
+
+# Connections belong to the loop that opened them, so each loop gets its own client
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """The default pooled client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncHTTPClient()
+    return client
+
+
+async def close_client():
+    """Close the running loop's pooled connections (e.g. before the loop exits)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def to_llm_error(exc, url):
+    """Translate a transport exception into the matching LLMError (unknown exceptions are returned as-is)."""
+    if isinstance(exc, LLMError):
+        return exc
+    if isinstance(exc, HTTPStatusError):
+        return LLMResponseError(f"The server at {url} returned {exc.status}: {exc.body[:500]}", url,
+                                status=exc.status, body=exc.body)
+    if isinstance(exc, ConnectError):
+        return LLMConnectionError(
+            f"Could not connect to the server at {url}. Please ensure it is running and the URL is correct.\n\nDetails: {exc}",
+            url, phase="connect",
+        )
+    if isinstance(exc, asyncio.TimeoutError):
+        return LLMTimeoutError(f"The server at {url} stopped responding (read timeout).", url, phase="read")
+    if isinstance(exc, (OSError, asyncio.IncompleteReadError)):
+        return LLMConnectionError(f"The connection to {url} failed.\n\nDetails: {exc}", url, phase="read")
+    if isinstance(exc, (ValueError, KeyError, IndexError, TypeError)):
+        return LLMResponseError(f"Received an unexpected response from the server.\n\nDetails: {exc}", url)
+    return exc
+
+
+def _read_timeout(deadline):
+    remaining = deadline.remaining()
+    read = http_client.read_timeout()
+    return read if remaining is None else max(0.001, min(read, remaining))
+
+
+async def _guarded(url, fn):
+    """Await fn() through the endpoint's circuit breaker, raising LLMErrors."""
+    breaker = resilience.get_breaker(url)
+    breaker.before_call()
+    try:
+        result = await fn()
+    except Exception as e:
+        error = to_llm_error(e, url)
+        breaker.record_result(error)
+        if error is e:
+            raise
+        raise error from e
+    breaker.record_result()
+    return result
+
+
+async def _with_retries(fn, deadline, idempotent=True):
+    """Async call_with_retries: retry retryable LLMErrors with jittered backoff."""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except LLMError as e:
+            delay = resilience.retry_delay(e, attempt, idempotent, resilience.MAX_RETRIES, deadline)
+            if delay is None:
+                raise
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def _post_json(client, url, payload, deadline):
+    response = await client.request("POST", url, json=payload, timeout=_read_timeout(deadline))
+    try:
+        await response.raise_for_status()
+        return await response.json()
+    finally:
+        await response.aclose()
+
+
+async def _post_chat(service, api_url, model, chat_url, payload, client, deadline):
+    """POST a chat request to the least busy endpoint serving the model, failing over on errors."""
+    pool = backend.get_endpoint_pool(service, api_url)
+    last_error = None
+    for endpoint in pool.candidates(model):
+        deadline.check(api_url)
+        url = backend._on_endpoint(chat_url, endpoint.url)
+        with pool.lease(endpoint):
+            try:
+                data = await _guarded(url, lambda: _post_json(client, url, payload, deadline))
+            except LLMError as e:
+                if not endpoint_pool.is_failover_error(e):
+                    raise
+                pool.mark_failed(endpoint, e)
+                last_error = e
+                continue
+        pool.mark_ok(endpoint)
+        return data, url
+    raise last_error
+
+
+async def _complete(service, api_url, model, system_prompt, user_prompt, temperature, timeout, client):
+    request = backend.build_chat_request(service, api_url, model, system_prompt, temperature, user_prompt=user_prompt)
+    if request is None:
+        raise InvalidServiceError(f"Invalid service selected: {service}")
+    chat_url, payload = request
+
+    tape = cassette.get_active()
+    if tape is not None:
+        tape_key = tape.key(service, model, system_prompt, user_prompt, temperature)
+        recorded = tape.lookup(tape_key, model)
+        if recorded is not None:
+            return recorded
+
+    timeout = timeout or http_client.deadline()
+    deadline = resilience.Deadline(timeout)
+    client = client or get_client()
+    started = time.perf_counter()
+    try:
+        try:
+            data, url = await asyncio.wait_for(
+                _with_retries(lambda: _post_chat(service, api_url, model, chat_url, payload, client, deadline),
+                              deadline),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            # Anything that timed out inside was already translated; this is the total deadline
+            raise LLMTimeoutError(f"The server at {api_url} did not respond within {timeout:g} seconds.",
+                                  api_url, phase="total") from None
+        try:
+            content = backend._extract_content(service, data)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(
+                "Received an unexpected response from the server. The model may not be compatible with the "
+                f"chat/completion API.\n\nDetails: {e}", url, body=data,
+            ) from e
+    except LLMError as e:
+        backend.record_llm_call(service, model, started, error=e)
+        raise
+    backend.record_llm_call(service, model, started, **metrics.response_stats(data))
+    if tape is not None and content:
+        tape.record(tape_key, content, service, model, system_prompt, user_prompt, temperature)
+    return content
+
+
+async def generate_prompt(service, api_url, model, creativity_level, user_idea, timeout=None, client=None):
+    """Async generate_prompt: returns the Wan 2.2 prompt (raises an LLMError on failure)."""
+    return await _complete(
+        service, api_url, model,
+        backend.get_system_prompt(creativity_level), backend.get_user_prompt(creativity_level, user_idea), 0.7,
+        timeout, client,
+    )
+
+
+async def get_inspiration(service, api_url, model, user_idea, timeout=None, client=None):
+    """Async get_inspiration: returns three scene ideas as a numbered list."""
+    return await _complete(
+        service, api_url, model,
+        backend.get_inspiration_prompt(), backend.get_inspiration_user_prompt(user_idea), 0.9,
+        timeout, client,
+    )
+
+
+async def _read_stream(service, url, response, deadline, stats):
+    lines = response.iter_lines()
+    try:
+        async for line in lines:
+            token, done = backend.parse_stream_line(service, line, stats)
+            if token:
+                deadline.check(url)
+                yield token
+            if done:
+                await _drain(lines)
+                break
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        # A server that stalls or drops mid-stream counts against its breaker
+        resilience.get_breaker(url).record_failure()
+        raise StreamInterruptedError(f"The stream from {url} was interrupted.\n\nDetails: {e}", url) from e
+    except (ValueError, KeyError, IndexError) as e:
+        raise LLMResponseError(f"Received an unexpected streaming response from the server.\n\nDetails: {e}",
+                               url) from e
+    finally:
+        await response.aclose()
+
+
+async def _drain(lines):
+    """
+    Read what is left of a finished stream (the chunked terminator), so the
+    response hands its connection back to the pool instead of aclose() closing it.
+    """
+    try:
+        async for _ in lines:
+            pass
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+        pass  # aclose() drops the connection as before
+
+
+async def _stream_from_pool(service, pool, model, chat_url, payload, client, deadline, stats):
+    last_error = None
+    for endpoint in pool.candidates(model):
+        url = backend._on_endpoint(chat_url, endpoint.url)
+        with pool.lease(endpoint):
+            # Fail over only while connecting; a stream that already produced tokens is not restarted
+            try:
+                response = await _guarded(url, lambda: _open_stream(client, url, payload, deadline))
+            except LLMError as e:
+                if not endpoint_pool.is_failover_error(e):
+                    raise
+                pool.mark_failed(endpoint, e)
+                last_error = e
+                continue
+            pool.mark_ok(endpoint)
+            async for token in _read_stream(service, url, response, deadline, stats):
+                yield token
+        return
+    raise last_error
+
+
+async def _open_stream(client, url, payload, deadline):
+    response = await client.request("POST", url, json=payload, timeout=_read_timeout(deadline))
+    try:
+        await response.raise_for_status()
+    except BaseException:
+        await response.aclose()
+        raise
+    return response
+
+
+async def _stream_chat(service, api_url, model, system_prompt, user_prompt, temperature, client, timeout=None):
+    request = backend.build_chat_request(service, api_url, model, system_prompt, temperature, stream=True,
+                                         user_prompt=user_prompt)
+    if request is None:
+        raise InvalidServiceError(f"Invalid service selected: {service}")
+    chat_url, payload = request
+
+    tape = cassette.get_active()
+    if tape is not None:
+        tape_key = tape.key(service, model, system_prompt, user_prompt, temperature)
+        recorded = tape.lookup(tape_key, model)
+        if recorded is not None:
+            yield recorded
+            return
+        tokens = []
+
+    client = client or get_client()
+    deadline = resilience.Deadline(timeout or http_client.deadline())
+    pool = backend.get_endpoint_pool(service, api_url)
+    started = time.perf_counter()
+    stats = {}
+    received_any = False
+    attempt = 0
+    while True:
+        try:
+            async for token in _stream_from_pool(service, pool, model, chat_url, payload, client, deadline, stats):
+                if not received_any:
+                    received_any = True
+                    stats["ttft"] = time.perf_counter() - started
+                if tape is not None:
+                    tokens.append(token)
+                yield token
+            backend.record_llm_call(service, model, started, **stats)
+            if tape is not None and "".join(tokens).strip():
+                tape.record(tape_key, "".join(tokens).strip(), service, model, system_prompt, user_prompt,
+                            temperature)
+            return
+        except LLMError as e:
+            delay = None if received_any else resilience.retry_delay(e, attempt, True, resilience.MAX_RETRIES,
+                                                                      deadline)
+            if delay is None:
+                backend.record_llm_call(service, model, started, error=e)
+                raise
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def stream_prompt(service, api_url, model, creativity_level, user_idea, client=None, timeout=None):
+    """Async generator of prompt tokens (raises an LLMError on failure)."""
+    return _stream_chat(service, api_url, model, backend.get_system_prompt(creativity_level),
+                        backend.get_user_prompt(creativity_level, user_idea), 0.7, client, timeout)
+
+
+def stream_inspiration(service, api_url, model, user_idea, client=None, timeout=None):
+    """Async generator of inspiration tokens."""
+    return _stream_chat(service, api_url, model, backend.get_inspiration_prompt(),
+                        backend.get_inspiration_user_prompt(user_idea), 0.9, client, timeout)
+
+
+async def _list_endpoint_models(service, url, client):
+    if service == endpoint_pool.OLLAMA:
+        response = await client.request("GET", f"{url}/api/tags")
+        await response.raise_for_status()
+        return [m['name'] for m in (await response.json()).get('models', []) if m.get('name')]
+    response = await client.request("GET", f"{url}/v1/models")
+    await response.raise_for_status()
+    return [m['id'] for m in (await response.json()).get('data', []) if m.get('id')]
+
+
+async def _get_models(service, api_url, timeout, client):
+    """Union of the models of every endpoint in the pool, probed concurrently."""
+    client = client or get_client()
+    pool = backend.get_endpoint_pool(service, api_url)
+
+    async def probe(endpoint):
+        def fetch():
+            return asyncio.wait_for(_list_endpoint_models(pool.service, endpoint.url, client), timeout)
+
+        try:
+            models = await _guarded(endpoint.url, fetch)
+        except LLMError as e:
+            pool.mark_failed(endpoint, e)
+            return None
+        pool.record_models(endpoint, models)
+        return models
+
+    results = await asyncio.gather(*(probe(endpoint) for endpoint in pool.endpoints))
+    if all(models is None for models in results):
+        print(f"Error fetching {service} models: no endpoint reachable")
+        return []
+    union = []
+    for models in results:
+        union.extend(m for m in models or () if m not in union)
+    return union
+
+
+async def get_ollama_models(api_url, timeout=http_client.MODEL_LIST_TIMEOUT, client=None):
+    """Async get_ollama_models."""
+    return await _get_models("Ollama", api_url, timeout, client)
+
+
+async def get_lm_studio_models(api_url, timeout=http_client.MODEL_LIST_TIMEOUT, client=None):
+    """Async get_lm_studio_models."""
+    return await _get_models("LM Studio", api_url, timeout, client)
+
+
+async def pull_ollama_model(model_name, api_url, progress_callback=None, timeout=None, client=None):
+    """
+    Async pull_ollama_model. progress_callback may be a plain function or a
+    coroutine function. `timeout` bounds the whole pull (None: no limit).
+    """
+    client = client or get_client()
+
+    async def pull():
+        response = await client.request("POST", f"{api_url}/api/pull", json={"name": model_name, "stream": True})
+        try:
+            await response.raise_for_status()
+            async for line in response.iter_lines():
+                if line:
+                    data = json.loads(line)
+                    if progress_callback:
+                        result = progress_callback(data)
+                        if inspect.isawaitable(result):
+                            await result
+        finally:
+            await response.aclose()
+
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(pull(), timeout)
+        return True, "Model pulled successfully!"
+    except asyncio.TimeoutError:
+        if timeout is not None and time.monotonic() - started >= timeout:
+            return False, f"Error pulling model: timed out after {timeout:g} seconds"
+        # The client's read timeout: the server stopped sending progress
+        read_timeout = getattr(client, "read_timeout", None)
+        waited = f" for {read_timeout:g} seconds" if read_timeout else ""
+        return False, f"Error pulling model: no response from the server{waited} (read timeout)"
+    except (OSError, HTTPStatusError, asyncio.IncompleteReadError, ValueError) as e:
+        return False, f"Error pulling model: {e}"
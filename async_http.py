@@ -0,0 +1,257 @@
+"""
+Minimal asyncio HTTP/1.1 client for the Ollama / LM Studio APIs.
+
+Built on stdlib asyncio streams so async_backend needs no extra dependency.
+It covers what those APIs use: JSON request bodies, Content-Length and
+chunked responses (streamed NDJSON / SSE), and keep-alive connections pooled
+per endpoint like http_client does for the synchronous side.
+
+AsyncHTTPClient is the default transport. Anything with the same
+request(method, url, json=None, timeout=None) coroutine returning an object
+with status / raise_for_status() / json() / iter_lines() / aclose() can be
+passed to async_backend instead (e.g. an aiohttp adapter).
+"""
+
+import asyncio
+import json as jsonlib
+import ssl
+from urllib.parse import urlsplit
+
+try:
+    from . import http_client
+except ImportError:
+    import http_client
+
+
+class HTTPStatusError(Exception):
+    """Non-2xx response (mirrors requests.HTTPError for the async side)."""
+
+    def __init__(self, status, reason, body, url):
+        super().__init__(f"{status} {reason} for url: {url}")
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.url = url
+
+
+class ConnectError(ConnectionError):
+    """The connection could not be established (refused, unresolvable, timed out); nothing was sent."""
+
+
+class AsyncHTTPResponse:
+    """A response whose body is read lazily from the connection."""
+
+    def __init__(self, client, key, reader, writer, status, reason, headers, url, method):
+        self._client = client
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.url = url
+        self._read_timeout = client.read_timeout
+        self._done = method == "HEAD" or status in (204, 304) or 100 <= status < 200
+        self._content = b"" if self._done else None
+
+    @property
+    def keep_alive(self):
+        return self.headers.get("connection", "").lower() != "close"
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self._read_timeout)
+
+    async def iter_chunks(self):
+        """Yield the body as it arrives (decoding chunked transfer encoding)."""
+        if self._done:
+            return
+        reader = self._reader
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await self._read(reader.readline())
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while (await self._read(reader.readline())).strip():
+                        pass
+                    break
+                data = await self._read(reader.readexactly(size))
+                await self._read(reader.readexactly(2))
+                yield data
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining > 0:
+                data = await self._read(reader.read(min(remaining, 65536)))
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(data)
+                yield data
+        else:
+            # Body runs until the server closes the connection
+            self.headers["connection"] = "close"
+            while True:
+                data = await self._read(reader.read(65536))
+                if not data:
+                    break
+                yield data
+        self._finish()
+
+    async def iter_lines(self):
+        """Yield complete lines of the body (for NDJSON / SSE streams)."""
+        buffer = b""
+        async for chunk in self.iter_chunks():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if buffer:
+            yield buffer.rstrip(b"\r")
+
+    async def read(self):
+        if self._content is None:
+            self._content = b"".join([chunk async for chunk in self.iter_chunks()])
+        return self._content
+
+    async def text(self):
+        return (await self.read()).decode("utf-8", errors="replace")
+
+    async def json(self):
+        return jsonlib.loads(await self.read())
+
+    async def raise_for_status(self):
+        if self.status >= 400:
+            # A body that was already streamed away can not be read again
+            body = await self.text() if not self._done or self._content is not None else ""
+            raise HTTPStatusError(self.status, self.reason, body, self.url)
+
+    def _finish(self):
+        """Body fully read: hand the connection back to the pool."""
+        self._done = True
+        if self._writer is not None:
+            if self.keep_alive:
+                self._client._release(self._key, self._reader, self._writer)
+            else:
+                self._writer.close()
+            self._reader = self._writer = None
+
+    async def aclose(self):
+        """Release the connection; one abandoned mid-body can not be reused and is closed."""
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+        self._done = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+class AsyncHTTPClient:
+    """Keep-alive connection pool per endpoint (scheme://host:port)."""
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        self.pool_size = pool_size or http_client.pool_size()
+        self.connect_timeout = connect_timeout or http_client.connect_timeout()
+        self.read_timeout = read_timeout or http_client.read_timeout()
+        self._idle = {}  # endpoint key -> [(reader, writer), ...]
+
+    async def _connect(self, parts):
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        ssl_context = ssl.create_default_context() if parts.scheme == "https" else None
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(parts.hostname, port, ssl=ssl_context), self.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConnectError(f"Could not connect to {parts.netloc}: {e or type(e).__name__}") from e
+
+    def _release(self, key, reader, writer):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.pool_size and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def _acquire_idle(self, key):
+        idle = self._idle.get(key) or []
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def request(self, method, url, json=None, timeout=None):
+        """Send a request and return once the status line and headers are in."""
+        parts = urlsplit(url)
+        key = http_client.endpoint_key(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        body = b"" if json is None else jsonlib.dumps(json).encode("utf-8")
+        head = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}", "Accept: */*", "Connection: keep-alive"]
+        if json is not None:
+            head.append("Content-Type: application/json")
+        if body or method in ("POST", "PUT"):
+            head.append(f"Content-Length: {len(body)}")
+        payload = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+        read_timeout = timeout or self.read_timeout
+        pooled = self._acquire_idle(key)
+        for attempt in (0, 1):
+            if pooled is not None:
+                reader, writer = pooled
+            else:
+                reader, writer = await self._connect(parts)
+            try:
+                writer.write(payload)
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+                if not status_line:
+                    raise ConnectionResetError("Server closed the connection")
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # An idle pooled connection may have been closed by the server; retry once on a fresh one
+                if pooled is not None and attempt == 0:
+                    pooled = None
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        try:
+            _, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), read_timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+        except BaseException:
+            writer.close()
+            raise
+
+        response = AsyncHTTPResponse(self, key, reader, writer, int(status), reason[0] if reason else "",
+                                     headers, url, method)
+        response._read_timeout = read_timeout
+        if response._done:
+            response._finish()
+        return response
+
+    async def get(self, url, timeout=None):
+        return await self.request("GET", url, timeout=timeout)
+
+    async def post(self, url, json=None, timeout=None):
+        return await self.request("POST", url, json=json, timeout=timeout)
+
+    async def aclose(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
@@ -1,19 +1,65 @@
 import requests
+import atexit
 import json
 import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import urlsplit
+
+# Relative imports when loaded as part of the ComfyUI package (async_backend uses this module)
+try:
+    from . import (cassette, endpoint_pool, http_client, metrics, residency, resilience, response_cache, scheduler,
+                   singleflight, tracing)
+    from .history_store import HistoryStore
+    from .llm_errors import (InvalidServiceError, LLMError, LLMResponseError, StreamInterruptedError,
+                             from_requests_error)
+    from .search_index import SearchIndex
+    from .write_behind import WriteBehindQueue
+except ImportError:
+    import cassette
+    import endpoint_pool
+    import http_client
+    import metrics
+    import residency
+    import resilience
+    import response_cache
+    import scheduler
+    import singleflight
+    import tracing
+    from history_store import HistoryStore
+    from llm_errors import InvalidServiceError, LLMError, LLMResponseError, StreamInterruptedError, from_requests_error
+    from search_index import SearchIndex
+    from write_behind import WriteBehindQueue
 
 # --- Default API Endpoints ---
 DEFAULT_LM_STUDIO_URL = "http://localhost:1234/v1/chat/completions"
 DEFAULT_OLLAMA_URL = "http://localhost:11434"
 
-# --- History Management ---
-HISTORY_FILE = "wan2_prompt_history.json"
-MAX_HISTORY_ENTRIES = 100
+# Endpoint pools (extra servers come from WAN_OLLAMA_URLS / WAN_LMSTUDIO_URLS)
+SERVICE_POOLS = {"LM Studio": endpoint_pool.LMSTUDIO, "Ollama": endpoint_pool.OLLAMA}
 
-def get_history_file_path():
-    """Get the path to the history file in %APPDATA%"""
+# --- History Management ---
+HISTORY_FILE = "wan2_prompt_history.json"  # Legacy JSON history, migrated into HISTORY_DB_FILE
+HISTORY_DB_FILE = "wan2_prompt_history.db"
+MAX_HISTORY_ENTRIES = None  # No cap; set an int to keep only the newest N entries
+
+_history_store = None
+_history_store_lock = threading.Lock()
+_search_index = SearchIndex()
+_search_index_ready = False
+_search_index_lock = threading.Lock()
+_deleted_during_build = set()
+_history_writer = None
+_history_writer_lock = threading.Lock()
+_metrics_export_set = False
+
+def get_history_dir():
+    """Get the history directory in %APPDATA%"""
     appdata = os.environ.get('APPDATA')
     if not appdata:
         # Fallback to user's home directory if APPDATA is not available
@@ -21,35 +67,99 @@ def get_history_file_path():
 
     history_dir = Path(appdata) / "Wan2PromptGenerator"
     history_dir.mkdir(exist_ok=True)
-    return history_dir / HISTORY_FILE
-
-def load_history():
-    """Load prompt history from file"""
-    history_file = get_history_file_path()
-    if history_file.exists():
-        try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error loading history: {e}")
-            return []
-    return []
+    return history_dir
 
-def save_history(history):
-    """Save prompt history to file"""
-    history_file = get_history_file_path()
+def get_history_file_path():
+    """Get the path to the legacy JSON history file in %APPDATA%"""
+    return get_history_dir() / HISTORY_FILE
+
+def get_history_db_path():
+    """Get the path to the SQLite history database in %APPDATA%"""
+    return get_history_dir() / HISTORY_DB_FILE
+
+def get_history_store():
+    """Open (once) the SQLite history store, migrating the legacy JSON file on first use"""
+    global _history_store
+    if _history_store is None:
+        with _history_store_lock:
+            if _history_store is None:
+                _history_store = HistoryStore(get_history_db_path(), legacy_json_path=get_history_file_path())
+    return _history_store
+
+def get_search_index():
+    """
+    Fill the history search index from the store once (safe to call from a
+    background thread at startup); afterwards add/delete/clear keep it in sync.
+    """
+    global _search_index_ready
+    if not _search_index_ready:
+        with _search_index_lock:
+            if not _search_index_ready:
+                for entry_id, user_idea, generated_prompt in get_history_store().iter_search_fields():
+                    # Entries added while building are already indexed; deleted ones must stay out
+                    if entry_id not in _search_index and entry_id not in _deleted_during_build:
+                        _search_index.add(entry_id, user_idea, generated_prompt)
+                _search_index_ready = True
+                _deleted_during_build.clear()
+    return _search_index
+
+@tracing.traced("history.load")
+def load_history(limit=None, offset=0):
+    """Load prompt history (newest first), optionally one page at a time"""
     try:
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
-    except IOError as e:
-        print(f"Error saving history: {e}")
+        return get_history_store().query(limit=limit, offset=offset)
+    except sqlite3.Error as e:
+        print(f"Error loading history: {e}")
+        return []
 
-def add_to_history(user_idea, generated_prompt, service, model, creativity_level, api_url=""):
-    """Add a new entry to the prompt history"""
-    history = load_history()
+@tracing.traced("history.page")
+def history_page(offset=0, limit=50, service=None, model=None, creativity_level=None, start_date=None, end_date=None):
+    """Load one newest-first page of history matching the given filters"""
+    return get_history_store().query(limit=limit, offset=offset, service=service, model=model,
+                                     creativity_level=creativity_level, start_date=start_date, end_date=end_date)
+
+def count_history(service=None, model=None, creativity_level=None, start_date=None, end_date=None):
+    """Count history entries matching the given filters"""
+    return get_history_store().count(service=service, model=model, creativity_level=creativity_level,
+                                     start_date=start_date, end_date=end_date)
+
+def get_history_entries(entry_ids):
+    """Fetch history entries by id, in the given order"""
+    return get_history_store().get_many(entry_ids)
 
-    # Create new history entry
-    entry = {
+def filter_history_ids(entry_ids, service=None, model=None, creativity_level=None, start_date=None, end_date=None):
+    """Narrow a list of entry ids (e.g. search results) by metadata/date filters, keeping their order"""
+    return get_history_store().filter_ids(entry_ids, service=service, model=model, creativity_level=creativity_level,
+                                          start_date=start_date, end_date=end_date)
+
+def get_history_models():
+    """Distinct model names present in history"""
+    return get_history_store().distinct("model")
+
+def save_history(history):
+    """
+    Replace the whole history with the given newest-first list.
+    Runs on the history writer after everything queued before it; blocks until
+    done, so never call it from the UI thread.
+    """
+    get_history_writer().put(("replace", history, None))
+    flush_history()
+
+def _replace_history(history):
+    global _search_index_ready
+    store = get_history_store()
+    with _search_index_lock:
+        try:
+            store.clear()
+            store.add_many(list(reversed(history)))
+        except sqlite3.Error as e:
+            print(f"Error saving history: {e}")
+        # Ids were reassigned, so the index has to start over
+        _search_index.clear()
+        _search_index_ready = False
+
+def _make_history_entry(user_idea, generated_prompt, service, model, creativity_level, api_url=""):
+    return {
         "timestamp": datetime.now().isoformat(),
         "user_idea": user_idea,
         "generated_prompt": generated_prompt,
@@ -59,53 +169,165 @@ def add_to_history(user_idea, generated_prompt, service, model, creativity_level
         "api_url": api_url
     }
 
-    # Add to beginning of list (most recent first)
-    history.insert(0, entry)
-
+def _trim_history(store):
     # Keep only the most recent entries
-    if len(history) > MAX_HISTORY_ENTRIES:
-        history = history[:MAX_HISTORY_ENTRIES]
+    if MAX_HISTORY_ENTRIES:
+        for stale_id in store.trim(MAX_HISTORY_ENTRIES):
+            _remove_from_search_index(stale_id)
+
+def add_to_history(user_idea, generated_prompt, service, model, creativity_level, api_url=""):
+    """Add a new entry to the prompt history and return it (with its id)"""
+    entry = _make_history_entry(user_idea, generated_prompt, service, model, creativity_level, api_url)
+
+    store = get_history_store()
+    entry["id"] = store.add(entry)
+    _search_index.add(entry["id"], user_idea, generated_prompt)
+    _trim_history(store)
+
+    return entry
+
+def get_history_writer():
+    """The background history writer (started on first use, flushed at interpreter exit)"""
+    global _history_writer
+    if _history_writer is None:
+        with _history_writer_lock:
+            if _history_writer is None:
+                _history_writer = WriteBehindQueue(_write_history_batch, name="history-writer")
+                atexit.register(close_history_writer)
+    return _history_writer
+
+def _write_history_batch(items):
+    """
+    Apply a batch of queued (operation, payload, callback) items in the order they
+    were queued: each run of new entries is inserted in one transaction, deletes /
+    clears / replaces happen between them. Callbacks run once the batch is written.
+    """
+    store = get_history_store()
+    done = []
+    with tracing.span("history.write_batch", cat="io", items=len(items)):
+        i = 0
+        while i < len(items):
+            operation = items[i][0]
+            if operation == "add":
+                run = []
+                while i < len(items) and items[i][0] == "add":
+                    run.append(items[i])
+                    i += 1
+                entries = [entry for _, entry, _ in run]
+                for entry, entry_id in zip(entries, store.add_many(entries)):
+                    entry["id"] = entry_id
+                    _search_index.add(entry_id, entry["user_idea"], entry["generated_prompt"])
+                _trim_history(store)
+                done.extend((on_done, entry) for _, entry, on_done in run)
+                continue
+
+            _, payload, on_done = items[i]
+            i += 1
+            try:
+                if operation == "delete":
+                    store.delete(payload)
+                    _remove_from_search_index(payload)
+                elif operation == "clear":
+                    with _search_index_lock:
+                        store.clear()
+                        _search_index.clear()
+                elif operation == "replace":
+                    _replace_history(payload)
+            except sqlite3.Error as e:
+                print(f"Error applying history {operation}: {e}")
+                continue
+            done.append((on_done, payload))
+
+    for on_done, result in done:
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception as e:
+                print(f"Error in history saved callback: {e}")
+
+def queue_history_entry(user_idea, generated_prompt, service, model, creativity_level, api_url="", on_saved=None):
+    """
+    Queue a new history entry for the background writer and return immediately.
+    on_saved(entry) is called on the writer thread once the entry (now with its id) is stored.
+    """
+    entry = _make_history_entry(user_idea, generated_prompt, service, model, creativity_level, api_url)
+    get_history_writer().put(("add", entry, on_saved))
+    return entry
+
+def queue_history_delete(entry_id, on_done=None):
+    """
+    Queue deleting an entry (after any entries queued before it) and return immediately.
+    on_done(entry_id) is called on the writer thread once it is deleted.
+    """
+    get_history_writer().put(("delete", entry_id, on_done))
 
-    save_history(history)
-    return history
+def queue_history_clear(on_done=None):
+    """
+    Queue clearing the history and return immediately. Entries queued before
+    it are written first, so they are cleared too. on_done(None) is called on
+    the writer thread once the history is empty.
+    """
+    get_history_writer().put(("clear", None, on_done))
+
+def flush_history(timeout=None):
+    """Wait until every queued history entry is written. Returns False on timeout."""
+    if _history_writer is None:
+        return True
+    return _history_writer.flush(timeout)
+
+def close_history_writer(timeout=10):
+    """Flush queued history entries and stop the writer (call on shutdown)"""
+    global _history_writer
+    with _history_writer_lock:
+        writer, _history_writer = _history_writer, None
+    if writer is not None:
+        writer.close(timeout)
+
+def delete_history_entry(entry_id):
+    """Delete an entry from history by its id (blocks until written; the UI uses queue_history_delete)"""
+    queue_history_delete(entry_id)
+    flush_history()
+
+def _remove_from_search_index(entry_id):
+    _search_index.remove(entry_id)
+    if not _search_index_ready:
+        _deleted_during_build.add(entry_id)
 
 def delete_from_history(index):
-    """Delete an entry from history by index"""
-    history = load_history()
-    if 0 <= index < len(history):
-        history.pop(index)
-        save_history(history)
-    return history
+    """Delete an entry from history by (newest-first) index"""
+    store = get_history_store()
+    entry_id = store.id_at(index) if index >= 0 else None
+    if entry_id is not None:
+        delete_history_entry(entry_id)
+    return load_history()
 
 def clear_history():
-    """Clear all history"""
-    save_history([])
+    """Clear all history (blocks until written; the UI uses queue_history_clear)"""
+    queue_history_clear()
+    flush_history()
     return []
 
+@tracing.traced("history.search")
+def search_history_ids(query):
+    """Ids of entries matching the query (substring, or typo-tolerant if nothing matches exactly), newest first"""
+    return get_search_index().search(query)
+
 def search_history(query, history=None):
     """Search history by keywords in user_idea or generated_prompt"""
-    if history is None:
-        history = load_history()
-
     if not query.strip():
-        return history
+        return load_history() if history is None else history
 
-    query_lower = query.lower()
-    filtered = []
-
-    for entry in history:
-        user_idea = entry.get('user_idea', '').lower()
-        generated_prompt = entry.get('generated_prompt', '').lower()
-
-        if query_lower in user_idea or query_lower in generated_prompt:
-            filtered.append(entry)
+    matching_ids = search_history_ids(query)
+    if history is None:
+        return get_history_store().get_many(matching_ids)
 
-    return filtered
+    matching_ids = set(matching_ids)
+    return [entry for entry in history if entry.get('id') in matching_ids]
 
 def filter_history_by_date(start_date=None, end_date=None, history=None):
     """Filter history by date range"""
     if history is None:
-        history = load_history()
+        return get_history_store().query(start_date=start_date, end_date=end_date)
 
     if not start_date and not end_date:
         return history
@@ -130,7 +352,7 @@ def filter_history_by_date(start_date=None, end_date=None, history=None):
 def filter_history_by_metadata(service=None, model=None, creativity_level=None, history=None):
     """Filter history by metadata (service, model, creativity_level)"""
     if history is None:
-        history = load_history()
+        return get_history_store().query(service=service, model=model, creativity_level=creativity_level)
 
     filtered = []
 
@@ -173,10 +395,17 @@ def export_history(format_type="json"):
 
 # This is the core instruction set for the LLM. It's designed to be flawless.
 # It internalizes the Wan 2.2 rules and the user's creativity choice.
-
-def get_system_prompt(creativity_level, user_idea):
+#
+# The system prompts below never contain the user's idea: they are identical
+# for every request with the same creativity level, so Ollama / LM Studio can
+# reuse the already-computed KV cache for that prefix and only prefill the
+# short user message. The idea is sent separately (see get_user_prompt).
+
+@tracing.traced("get_system_prompt")
+@lru_cache(maxsize=None)
+def get_system_prompt(creativity_level):
     """
-    Dynamically generates the system prompt based on the chosen creativity level.
+    Generates the (constant, memoized) system prompt for the chosen creativity level.
     """
     
     # Common framework rules for both creativity levels
@@ -193,33 +422,45 @@ def get_system_prompt(creativity_level, user_idea):
     """
 
     if creativity_level == "Moderate Freedom":
-        specific_instructions = f"""
+        specific_instructions = """
         **Creativity Mode: Moderate Freedom**
         Your task is to take the user's core idea and build upon it directly. Adhere closely to the subject provided by the user, but enrich it with essential cinematic details. Your goal is to enhance, not replace, the user's original concept.
-
-        User's Idea: "{user_idea}"
         """
     else: # High Freedom
-        specific_instructions = f"""
+        specific_instructions = """
         **Creativity Mode: High Freedom**
         Your task is to use the user's idea as a seed for a completely new, highly creative scene. Invent a compelling narrative and a strong visual mood. You have full creative license to interpret the user's concept into a unique and breathtaking cinematic moment.
-
-        User's Idea Seed: "{user_idea}"
         """
         
     return framework_rules + specific_instructions
 
-def get_inspiration_prompt(user_idea):
+def get_user_prompt(creativity_level, user_idea):
+    """
+    The user message carrying the idea (the only part that changes between requests).
+    """
+    if creativity_level == "Moderate Freedom":
+        return f'User\'s Idea: "{user_idea}"'
+    return f'User\'s Idea Seed: "{user_idea}"'
+
+@tracing.traced("get_inspiration_prompt")
+@lru_cache(maxsize=None)
+def get_inspiration_prompt():
     """
-    Generates a system prompt for the 'Inspire Me' feature.
+    Generates the (constant, memoized) system prompt for the 'Inspire Me' feature.
     """
-    return f"""
+    return """
     You are a creative assistant for a film director. The director has a basic idea and needs inspiration.
-    Based on the user's idea of '{user_idea}', generate three distinct and visually compelling one-sentence scene concepts.
+    Based on the user's idea, generate three distinct and visually compelling one-sentence scene concepts.
     These concepts should be creative, diverse, and serve as starting points for a full video prompt.
     Format your response as a numbered list (1., 2., 3.). Be concise and inspiring.
     """
 
+def get_inspiration_user_prompt(user_idea):
+    """
+    The user message for 'Inspire Me'.
+    """
+    return f"User's idea: '{user_idea}'"
+
 # --- API Communication Functions ---
 
 def get_lm_studio_models(api_url):
@@ -228,13 +469,9 @@ def get_lm_studio_models(api_url):
     Note: The base URL for model listing is slightly different from chat completions.
     """
     try:
-        # The model list endpoint is typically at /v1/models
-        base_url = api_url.split('/v1/')[0]
-        response = requests.get(f"{base_url}/v1/models")
-        response.raise_for_status()
-        models = response.json().get('data', [])
-        return [model['id'] for model in models]
-    except requests.exceptions.RequestException as e:
+        # Models of every endpoint in the pool (the model list endpoint is at /v1/models)
+        return get_endpoint_pool("LM Studio", api_url).check_all()
+    except (LLMError, ConnectionError) as e:
         print(f"Error fetching LM Studio models: {e}")
         return []
 
@@ -243,124 +480,428 @@ def get_ollama_models(api_url):
     Fetches the list of available models from the Ollama server.
     """
     try:
-        response = requests.get(f"{api_url}/api/tags")
-        response.raise_for_status()
-        models = response.json().get('models', [])
-        return [model['name'] for model in models]
-    except requests.exceptions.RequestException as e:
+        # Models of every endpoint in the pool
+        return get_endpoint_pool("Ollama", api_url).check_all()
+    except (LLMError, ConnectionError) as e:
         print(f"Error fetching Ollama models: {e}")
         return []
 
-def pull_ollama_model(model_name, api_url, progress_callback=None):
+def pull_ollama_model(model_name, api_url, progress_callback=None, cancel_token=None):
     """
     Pulls a model from Ollama, with optional progress streaming.
+    Cancelling cancel_token closes the connection, which stops the pull.
+    A pull has no total deadline; only failed connects are retried.
     """
     try:
         payload = {"name": model_name, "stream": True}
-        response = requests.post(f"{api_url}/api/pull", json=payload, stream=True)
-        response.raise_for_status()
+        url = f"{api_url}/api/pull"
+        response = resilience.call_with_retries(lambda: _send(url, payload, stream=True), idempotent=False,
+                                                cancel_token=cancel_token)
         
-        for line in response.iter_lines():
-            if line:
-                data = json.loads(line)
-                if progress_callback:
-                    progress_callback(data)
+        with _closed_on_cancel(response, cancel_token):
+            for line in response.iter_lines():
+                if line:
+                    data = json.loads(line)
+                    if progress_callback:
+                        progress_callback(data)
         return True, "Model pulled successfully!"
-    except requests.exceptions.RequestException as e:
-        return False, f"Error pulling model: {e}"
+    except Exception as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            return False, "Model pull cancelled."
+        if isinstance(e, (LLMError, requests.exceptions.RequestException)):
+            return False, f"Error pulling model: {e}"
+        raise
+
+def warm_model(service, api_url, model, cancel_token=None):
+    """
+    Load `model` into memory ahead of the first generation, so that request
+    does not pay the load time. Ollama: an empty-prompt /api/generate with
+    keep_alive (skipped if /api/ps shows the model already loaded); LM Studio
+    (which loads models on first use): a one-token completion.
+    Returns {"model", "loaded": True if this call loaded it, "seconds"}; raises LLMError.
+    A request already waiting on the server can not be aborted, so cancel_token
+    only stops the load request from being sent and further retries; callers
+    that cancel warm-ups often should run them on their own worker.
+    """
+    cancelled = lambda: cancel_token is not None and cancel_token.cancelled
+    if service not in SERVICE_POOLS:
+        raise InvalidServiceError(f"Invalid service selected: {service}")
+    pool = get_endpoint_pool(service, api_url)
+    started = time.perf_counter()
+
+    if service == "Ollama":
+        def send(endpoint_url):
+            try:
+                loaded = http_client.get(f"{endpoint_url}/api/ps", timeout=http_client.MODEL_LIST_TIMEOUT)
+                if loaded.ok and any(m.get("name") == model or m.get("model") == model
+                                     for m in loaded.json().get("models", [])):
+                    return False
+            except (requests.exceptions.RequestException, ValueError):
+                pass  # Older server without /api/ps, or down: the load below reports it properly
+            if cancelled():
+                return False
+            _send(f"{endpoint_url}/api/generate", {"model": model, "keep_alive": residency.KEEP_ALIVE})
+            return True
+    else:  # LM Studio
+        def send(endpoint_url):
+            if cancelled():
+                return False
+            _send(_on_endpoint(api_url, endpoint_url),
+                  {"model": model, "messages": [{"role": "user", "content": "Hi"}], "max_tokens": 1})
+            return True
+
+    with tracing.span("warm_model", cat="io", service=service, model=model) as s:
+        loaded = resilience.call_with_retries(lambda: pool.call(model, send), cancel_token=cancel_token)
+        s.set(loaded=loaded)
+    return {"model": model, "loaded": loaded, "seconds": time.perf_counter() - started}
+
+@contextmanager
+def _closed_on_cancel(response, cancel_token):
+    """Close a streaming response (aborting the server-side work) as soon as cancel_token is cancelled."""
+    if cancel_token is None:
+        yield
+        return
+    cancel_token.add_callback(response.close)
+    try:
+        yield
+    finally:
+        cancel_token.remove_callback(response.close)
 
-def generate_prompt(service, api_url, model, creativity_level, user_idea):
+def get_endpoint_pool(service, api_url):
     """
-    The main function to generate the Wan 2.2 prompt by querying the LLM.
+    The endpoint pool for a service: the server behind api_url plus any extra
+    servers configured for load balancing and failover.
     """
-    system_prompt = get_system_prompt(creativity_level, user_idea)
-    
-    headers = {"Content-Type": "application/json"}
-    
-    if service == "LM Studio":
-        payload = {
-            "model": model,
-            "messages": [{"role": "system", "content": system_prompt}],
-            "temperature": 0.7,
-        }
-        chat_url = api_url
-    elif service == "Ollama":
-        payload = {
-            "model": model,
-            "prompt": "", # Will be overridden by messages
-            "system": system_prompt,
-             "stream": False,
-             "options": {
-                 "temperature": 0.7
-             }
-        }
-        # Ollama can use different endpoints for chat vs generation
-        chat_url = f"{api_url}/api/generate" if "generate" not in api_url else api_url
-        # For consistency with OpenAI standard, let's try the chat endpoint first
-        chat_url = f"{api_url}/api/chat"
-        payload = {
-            "model": model,
-            "messages": [{"role": "system", "content": system_prompt}],
-            "stream": False,
-        }
+    return endpoint_pool.get_pool(SERVICE_POOLS[service], api_url)
 
-    else:
-        return "Invalid service selected."
+def _on_endpoint(url, endpoint_url):
+    """Point a chat URL at another endpoint (same path, different server)."""
+    return endpoint_url + urlsplit(url).path
 
-    try:
-        response = requests.post(chat_url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if service == "LM Studio":
-            return data['choices'][0]['message']['content'].strip()
-        elif service == "Ollama":
-            # The structure for Ollama chat response is similar
-            return data['message']['content'].strip()
+def _send(url, payload, deadline=None, stream=False):
+    """
+    POST a JSON payload to one endpoint through its circuit breaker.
+    Timeouts are clamped to the deadline; failures are raised as LLMErrors.
+    """
+    timeout = deadline.timeout(url=url) if deadline is not None else None
 
-    except requests.exceptions.RequestException as e:
-        return f"API Error: Could not connect to the server at {api_url}. Please ensure it is running and the URL is correct.\n\nDetails: {e}"
-    except (KeyError, IndexError) as e:
-        return f"API Error: Received an unexpected response from the server. The model may not be compatible with the chat/completion API.\n\nDetails: {e}\nResponse: {response.text}"
+    def post():
+        try:
+            response = http_client.post(url, headers={"Content-Type": "application/json"}, json=payload,
+                                        stream=stream, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if deadline is not None:
+                deadline.check(url)  # the clamped timeout ran out: report the total deadline
+            raise from_requests_error(e, url) from e
+        return response
+
+    return resilience.get_breaker(url).call(post)
+
+def _post_chat(service, api_url, model, chat_url, payload, deadline):
+    """
+    POST a non-streaming chat request to the least busy endpoint that serves the model,
+    failing over on errors and retrying (with backoff) while the deadline allows.
+    """
+    pool = get_endpoint_pool(service, api_url)
+
+    def send(endpoint_url):
+        return _send(_on_endpoint(chat_url, endpoint_url), payload, deadline)
+
+    # Generation has no side effects on the server, so a failed attempt is safe to repeat
+    return resilience.call_with_retries(lambda: pool.call(model, send), deadline=deadline)
 
+def _extract_content(service, data):
+    if service == "LM Studio":
+        return data['choices'][0]['message']['content'].strip()
+    # The structure for Ollama chat response is similar
+    return data['message']['content'].strip()
 
-def get_inspiration(service, api_url, model, user_idea):
+def _complete(service, api_url, model, system_prompt, user_prompt, temperature, timeout=None):
     """
-    Generates inspirational ideas by querying the LLM.
+    Shared non-streaming request behind generate_prompt and get_inspiration
+    (recorded / replayed by an active cassette). Concurrent identical requests
+    share one call to the server (see singleflight.py).
     """
-    system_prompt = get_inspiration_prompt(user_idea)
-    
-    headers = {"Content-Type": "application/json"}
-    
+    # The same request to another server is a different call
+    key = (api_url, response_cache.make_key(service, model, system_prompt, user_prompt, temperature, 0, None))
+    content, shared = singleflight.do(key, lambda: cassette.call(
+        lambda: _fetch_completion(service, api_url, model, system_prompt, user_prompt, temperature, timeout),
+        service, model, system_prompt, user_prompt, temperature))
+    if shared:
+        metrics.record_coalesced(service, model)
+    return content
+
+def _fetch_completion(service, api_url, model, system_prompt, user_prompt, temperature, timeout):
+    request = build_chat_request(service, api_url, model, system_prompt, temperature, user_prompt=user_prompt)
+    if request is None:
+        raise InvalidServiceError(f"Invalid service selected: {service}")
+    chat_url, payload = request
+
+    deadline = resilience.Deadline(timeout or http_client.deadline())
+    pool = get_endpoint_pool(service, api_url)
+    # Wait for a free slot on the backend (see scheduler.py); the wait counts against the deadline
+    with scheduler.slot(SERVICE_POOLS[service], len(pool.endpoints), timeout=deadline.remaining()):
+        started = time.perf_counter()
+        try:
+            with tracing.span("http", cat="io", service=service, model=model) as s:
+                response = _post_chat(service, api_url, model, chat_url, payload, deadline)
+                s.set(status=response.status_code, bytes=len(response.content))
+            try:
+                with tracing.span("parse_response"):
+                    data = response.json()
+                    content = _extract_content(service, data)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                raise LLMResponseError(
+                    "Received an unexpected response from the server. The model may not be compatible with the "
+                    f"chat/completion API.\n\nDetails: {e}\nResponse: {response.text[:500]}",
+                    response.url, status=response.status_code, body=response.text,
+                ) from e
+        except LLMError as e:
+            record_llm_call(service, model, started, error=e)
+            raise
+    record_llm_call(service, model, started, **metrics.response_stats(data))
+    return content
+
+def record_llm_call(service, model, started, error=None, **stats):
+    """
+    Record a finished LLM call (started = its time.perf_counter() start) in the
+    metrics registry, which is exported to a "metrics" folder next to the history database.
+    """
+    global _metrics_export_set
+    if not _metrics_export_set:
+        _metrics_export_set = True
+        metrics.set_export_dir(os.environ.get("WAN_METRICS_DIR") or get_history_dir() / "metrics")
+    return metrics.record(service, model, time.perf_counter() - started, error=error, **stats)
+
+@tracing.traced("build_chat_request")
+def build_chat_request(service, api_url, model, system_prompt, temperature, stream=False, user_prompt=None):
+    """
+    Builds the (chat_url, payload) pair for a chat request to the given service.
+    The system prompt goes first so it forms a reusable prefix; the user prompt follows.
+    Returns None for an unknown service.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    if user_prompt is not None:
+        messages.append({"role": "user", "content": user_prompt})
+
     if service == "LM Studio":
         payload = {
             "model": model,
-            "messages": [{"role": "system", "content": system_prompt}],
-            "temperature": 0.9,
+            "messages": messages,
+            "temperature": temperature,
         }
-        chat_url = api_url
+        if stream:
+            payload["stream"] = True
+        return api_url, payload
     elif service == "Ollama":
-        chat_url = f"{api_url}/api/chat"
+        # For consistency with OpenAI standard, use the chat endpoint
         payload = {
             "model": model,
-            "messages": [{"role": "system", "content": system_prompt}],
-            "stream": False,
+            "messages": messages,
+            "stream": stream,
         }
-    else:
-        return "Invalid service selected."
-        
+        return f"{api_url}/api/chat", payload
+    return None
+
+def iter_stream_tokens(service, response, stats=None):
+    """
+    Yields content deltas from a streaming chat response.
+    Ollama sends NDJSON chunks; LM Studio sends OpenAI-style SSE `data:` events.
+    Token counts / timings the server reports are added to `stats` (a dict).
+    """
+    lines = response.iter_lines()
+    for line in lines:
+        token, done = parse_stream_line(service, line, stats)
+        if token:
+            yield token
+        if done:
+            _drain(lines)
+            return
+
+def _drain(lines):
+    """
+    Read what is left of a finished stream (the chunked terminator), so the
+    connection goes back to the pool instead of being discarded on close.
+    """
     try:
-        response = requests.post(chat_url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        if service == "LM Studio":
-            return data['choices'][0]['message']['content'].strip()
-        elif service == "Ollama":
-            return data['message']['content'].strip()
-            
+        for _ in lines:
+            pass
+    except (requests.exceptions.RequestException, ValueError):
+        pass  # The response is closed (and its connection dropped) as before
+
+def parse_stream_line(service, line, stats=None):
+    """
+    Parses one line of a streaming chat response into (token, done).
+    If `stats` is a dict, usage figures in the chunk (Ollama's final chunk,
+    an OpenAI-style "usage" event) are merged into it.
+    Shared by the sync stream and async_backend.
+    """
+    if not line:
+        return None, False
+    line = line.decode('utf-8') if isinstance(line, bytes) else line
+
+    if service == "LM Studio":
+        if not line.startswith("data:"):
+            return None, False
+        data_str = line[len("data:"):].strip()
+        if data_str == "[DONE]":
+            return None, True
+        data = json.loads(data_str)
+        if stats is not None and data.get('usage'):
+            stats.update(metrics.response_stats(data))
+        choices = data.get('choices') or [{}]
+        return (choices[0].get('delta') or {}).get('content'), False
+
+    data = json.loads(line)
+    done = bool(data.get('done'))
+    if stats is not None and done:
+        stats.update(metrics.response_stats(data))
+    return data.get('message', {}).get('content'), done
+
+def _read_stream(service, url, response, deadline, cancel_token, stats=None):
+    """Yield tokens from an open streaming response, raising LLMErrors (quietly stopping once cancelled)."""
+    cancelled = lambda: cancel_token is not None and cancel_token.cancelled
+    try:
+        with _closed_on_cancel(response, cancel_token):
+            for token in iter_stream_tokens(service, response, stats):
+                if cancelled():
+                    return
+                deadline.check(url)
+                yield token
+    except LLMError:
+        raise
     except requests.exceptions.RequestException as e:
-        return f"API Error: Could not connect to the server at {api_url}.\n\nDetails: {e}"
-    except (KeyError, IndexError) as e:
-        return f"API Error: Unexpected response from the server.\n\nDetails: {e}\nResponse: {response.text}"
\ No newline at end of file
+        if cancelled():
+            return
+        # A server that stalls or drops mid-stream counts against its breaker
+        resilience.get_breaker(url).record_failure()
+        raise StreamInterruptedError(f"The stream from {url} was interrupted.\n\nDetails: {e}", url) from e
+    except (ValueError, KeyError, IndexError) as e:
+        if cancelled():
+            return
+        raise LLMResponseError(f"Received an unexpected streaming response from the server.\n\nDetails: {e}",
+                               url) from e
+    except Exception:
+        # Closing the response from another thread breaks the read mid-stream
+        if cancelled():
+            return
+        raise
+    finally:
+        response.close()
+
+def _stream_from_pool(service, pool, model, chat_url, payload, deadline, cancel_token, stats=None):
+    """One streaming attempt: open the stream on the best endpoint (failing over while connecting) and read it."""
+    last_error = None
+    for endpoint in pool.candidates(model):
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        with pool.lease(endpoint):
+            # Fail over only while connecting; a stream that already produced tokens is not restarted
+            url = _on_endpoint(chat_url, endpoint.url)
+            try:
+                response = _send(url, payload, deadline, stream=True)
+            except LLMError as e:
+                if not endpoint_pool.is_failover_error(e):
+                    raise
+                pool.mark_failed(endpoint, e)
+                last_error = e
+                continue
+            pool.mark_ok(endpoint)
+            yield from _read_stream(service, url, response, deadline, cancel_token, stats)
+        return
+    raise last_error
+
+def _stream_chat(service, api_url, model, system_prompt, user_prompt, temperature, cancel_token=None, timeout=None):
+    """
+    Shared streaming generator behind stream_prompt and stream_inspiration.
+    Opening the stream is retried with backoff; once tokens have been yielded a
+    failure is raised (StreamInterruptedError) instead of starting over.
+    Cancelling cancel_token closes the response, so the server stops generating;
+    the generator then ends quietly.
+    """
+    request = build_chat_request(service, api_url, model, system_prompt, temperature, stream=True,
+                                 user_prompt=user_prompt)
+    if request is None:
+        raise InvalidServiceError(f"Invalid service selected: {service}")
+    chat_url, payload = request
+
+    # An active cassette replays a recorded answer as a single chunk, or records this one
+    tape = cassette.get_active()
+    if tape is not None:
+        tape_key = tape.key(service, model, system_prompt, user_prompt, temperature)
+        recorded = tape.lookup(tape_key, model)
+        if recorded is not None:
+            yield recorded
+            return
+        tokens = []
+
+    deadline = resilience.Deadline(timeout or http_client.deadline())
+    pool = get_endpoint_pool(service, api_url)
+    # Held until the stream ends (or the generator is closed); the wait counts against the deadline
+    with scheduler.slot(SERVICE_POOLS[service], len(pool.endpoints), timeout=deadline.remaining()), \
+            tracing.span("stream", cat="io", service=service, model=model) as trace_span:
+        started = time.perf_counter()
+        stats = {}
+        received_any = False
+        attempt = 0
+        while True:
+            try:
+                for token in _stream_from_pool(service, pool, model, chat_url, payload, deadline, cancel_token, stats):
+                    if not received_any:
+                        received_any = True
+                        stats["ttft"] = time.perf_counter() - started
+                        trace_span.set(ttft_ms=round(stats["ttft"] * 1000, 1))
+                    if tape is not None:
+                        tokens.append(token)
+                    yield token
+                if not (cancel_token is not None and cancel_token.cancelled):
+                    record_llm_call(service, model, started, **stats)
+                    if tape is not None and "".join(tokens).strip():
+                        tape.record(tape_key, "".join(tokens).strip(), service, model, system_prompt, user_prompt,
+                                    temperature)
+                return
+            except LLMError as e:
+                delay = None if received_any else resilience.retry_delay(e, attempt, True, resilience.MAX_RETRIES,
+                                                                          deadline)
+                if delay is None or (cancel_token is not None and cancel_token.cancelled):
+                    record_llm_call(service, model, started, error=e)
+                    raise
+            attempt += 1
+            trace_span.set(retries=attempt)
+            time.sleep(delay)
+
+def generate_prompt(service, api_url, model, creativity_level, user_idea, timeout=None):
+    """
+    The main function to generate the Wan 2.2 prompt by querying the LLM.
+    `timeout` is the total deadline in seconds (retries and failover included).
+    Raises an LLMError (see llm_errors.py) if no prompt could be generated.
+    """
+    return _complete(service, api_url, model, get_system_prompt(creativity_level),
+                     get_user_prompt(creativity_level, user_idea), 0.7, timeout)
+
+def stream_prompt(service, api_url, model, creativity_level, user_idea, cancel_token=None, timeout=None):
+    """
+    Streaming counterpart of generate_prompt: yields tokens as the LLM produces them.
+    Errors are raised as LLMErrors, like generate_prompt raises them.
+    """
+    system_prompt = get_system_prompt(creativity_level)
+    user_prompt = get_user_prompt(creativity_level, user_idea)
+    yield from _stream_chat(service, api_url, model, system_prompt, user_prompt, 0.7, cancel_token, timeout)
+
+
+def get_inspiration(service, api_url, model, user_idea, timeout=None):
+    """
+    Generates inspirational ideas by querying the LLM.
+    Raises an LLMError on failure.
+    """
+    return _complete(service, api_url, model, get_inspiration_prompt(), get_inspiration_user_prompt(user_idea),
+                     0.9, timeout)
+
+def stream_inspiration(service, api_url, model, user_idea, cancel_token=None, timeout=None):
+    """
+    Streaming counterpart of get_inspiration: yields tokens as they arrive.
+    """
+    system_prompt = get_inspiration_prompt()
+    user_prompt = get_inspiration_user_prompt(user_idea)
+    yield from _stream_chat(service, api_url, model, system_prompt, user_prompt, 0.9, cancel_token, timeout)
@@ -0,0 +1,222 @@
+"""
+Headless batch prompt generation.
+
+Turns a file of ideas into Wan 2.2 prompts without the GUI, using the same
+backend.generate_prompt as the app. Results are appended to a JSONL file as
+they complete; re-running the same command after a crash skips every id that
+already has a successful result.
+
+Input formats (picked by extension):
+- .txt    one idea per line (id = line number)
+- .csv    an "idea" (or "user_idea") column, optional "id" column (first column otherwise)
+- .jsonl  objects with "idea" (or "user_idea") and optional "id"
+
+Usage:
+    python batch.py ideas.txt -o prompts.jsonl --service Ollama --model llama3 --concurrency 2
+    python batch.py ideas.txt -o prompts.jsonl --model llama3 --cassette ideas.cassette.jsonl.gz --cassette-mode replay
+"""
+
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import backend
+import cassette
+import scheduler
+import tracing
+from llm_errors import LLMError
+
+CREATIVITY_LEVELS = ("Moderate Freedom", "High Freedom")
+
+
+def read_ideas(path):
+    """Yield (id, idea) pairs from a .txt, .csv or .jsonl file."""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if suffix == ".csv":
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            columns = [c.strip().lower() for c in header]
+            idea_col = next((columns.index(c) for c in ("idea", "user_idea") if c in columns), None)
+            id_col = columns.index("id") if "id" in columns else None
+            if idea_col is None:
+                # No header row - the first column holds the ideas
+                idea_col = 0
+                rows = [header]
+            else:
+                rows = []
+            for number, row in enumerate(rows + list(reader), start=1):
+                if len(row) > idea_col and row[idea_col].strip():
+                    entry_id = row[id_col] if id_col is not None and len(row) > id_col else str(number)
+                    yield entry_id, row[idea_col].strip()
+        elif suffix == ".jsonl":
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                idea = record.get("idea") or record.get("user_idea") or ""
+                if idea.strip():
+                    yield str(record.get("id", number)), idea.strip()
+        else:
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield str(number), line.strip()
+
+
+def finished_ids(output_path):
+    """Ids that already have a successful result in the output file."""
+    done = set()
+    if not Path(output_path).exists():
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash
+            if not record.get("error"):
+                done.add(str(record.get("id")))
+    return done
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def error_record(args, entry_id, idea, error, latency=0.0):
+    """The output record of an idea that failed."""
+    return {
+        "id": entry_id,
+        "user_idea": idea,
+        "generated_prompt": "",
+        "service": args.service,
+        "model": args.model,
+        "creativity_level": args.creativity,
+        "latency_s": round(latency, 3),
+        "error": str(error),
+        "error_type": type(error).__name__,
+    }
+
+
+def generate_one(args, entry_id, idea):
+    start = time.perf_counter()
+    try:
+        # Batch calls queue behind the app's interactive ones for the same server
+        with scheduler.priority(scheduler.BATCH):
+            result = backend.generate_prompt(args.service, args.api_url, args.model, args.creativity, idea,
+                                             timeout=args.timeout)
+    except LLMError as e:
+        return error_record(args, entry_id, idea, e, time.perf_counter() - start)
+    latency = time.perf_counter() - start
+
+    record = {
+        "id": entry_id,
+        "user_idea": idea,
+        "generated_prompt": result or "",
+        "service": args.service,
+        "model": args.model,
+        "creativity_level": args.creativity,
+        "latency_s": round(latency, 3),
+    }
+    if not result:
+        record["error"] = "Empty response"
+    return record
+
+
+def run_batch(args):
+    output_path = Path(args.output)
+    done = finished_ids(output_path)
+    todo = [(entry_id, idea) for entry_id, idea in read_ideas(args.input) if entry_id not in done]
+    if done:
+        print(f"Resuming: {len(done)} already finished, {len(todo)} to go")
+    if not todo:
+        print("Nothing to do.")
+        return 0
+
+    # Least-outstanding routing spreads the workers evenly, so each endpoint
+    # in the pool sees at most `concurrency` requests at a time
+    endpoints = len(backend.get_endpoint_pool(args.service, args.api_url).endpoints)
+    workers = max(1, args.concurrency * endpoints)
+    # Every call also takes a scheduler slot; without this its per-endpoint limit
+    # (WAN_OLLAMA_CONCURRENCY / WAN_LMSTUDIO_CONCURRENCY) would cap --concurrency
+    scheduler.configure(backend.SERVICE_POOLS[args.service], max(1, args.concurrency))
+    print(f"Generating {len(todo)} prompts with {workers} workers across {endpoints} endpoint(s)")
+
+    write_lock = threading.Lock()
+    latencies, failures = [], 0
+    started = time.perf_counter()
+
+    with open(output_path, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate_one, args, entry_id, idea): (entry_id, idea) for entry_id, idea in todo}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            try:
+                record = future.result()
+            except Exception as e:
+                # An unexpected failure loses this idea (retried on the next run), not the whole batch
+                record = error_record(args, *futures[future], e)
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            if record.get("error"):
+                failures += 1
+            else:
+                latencies.append(record["latency_s"])
+                if args.save_history:
+                    backend.queue_history_entry(record["user_idea"], record["generated_prompt"], args.service,
+                                                args.model, args.creativity, args.api_url)
+            if completed % 10 == 0 or completed == len(futures):
+                print(f"  {completed}/{len(futures)} done ({failures} failed)")
+
+    elapsed = time.perf_counter() - started
+    backend.close_history_writer()
+    latencies.sort()
+    print(f"\nFinished {len(latencies)} prompts in {elapsed:.1f}s ({len(latencies) / elapsed:.2f} prompts/s), {failures} failed")
+    if cassette.get_active() is not None:
+        print(cassette.get_active().summary())
+    if latencies:
+        print(f"Latency p50 {percentile(latencies, 50):.2f}s  p90 {percentile(latencies, 90):.2f}s  "
+              f"p99 {percentile(latencies, 99):.2f}s  max {latencies[-1]:.2f}s")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Ideas file (.txt, .csv or .jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--service", choices=["Ollama", "LM Studio"], default="Ollama")
+    parser.add_argument("--api-url", default=None, help="API URL (defaults to the app's default for the service)")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--creativity", choices=CREATIVITY_LEVELS, default="Moderate Freedom")
+    parser.add_argument("--concurrency", type=int, default=2, help="Requests in flight per endpoint (overrides the scheduler's per-endpoint limit for this run)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Total seconds per prompt, retries included (default: WAN_HTTP_DEADLINE or 300)")
+    parser.add_argument("--save-history", action="store_true", help="Also add successful results to the app's history")
+    parser.add_argument("--trace", metavar="PATH", help="Write a Chrome trace (chrome://tracing / Perfetto) of the run")
+    parser.add_argument("--cassette", metavar="PATH", help="Record / replay LLM calls with this cassette file")
+    parser.add_argument("--cassette-mode", choices=cassette.MODES, default=cassette.AUTO,
+                        help="record: re-record everything; replay: offline, fail on unrecorded ideas; "
+                             "auto: replay what is recorded, record the rest (default)")
+    args = parser.parse_args(argv)
+    if args.trace:
+        tracing.enable(args.trace)
+    if args.cassette:
+        cassette.activate(args.cassette, args.cassette_mode)
+    if args.api_url is None:
+        args.api_url = backend.DEFAULT_OLLAMA_URL if args.service == "Ollama" else backend.DEFAULT_LM_STUDIO_URL
+    return run_batch(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Load / soak harness for the LLM HTTP path.
+
+Drives the real client code at a fixed concurrency and reports throughput,
+latency percentiles (p50 / p95 / p99), time to first token for streams and
+the error rate by error type:
+- generate_prompt: backend.generate_prompt (the app's non-streaming path)
+- stream_prompt:   backend.stream_prompt, read to the end (the app's default path)
+- call_llm:        nodes.call_llm (the ComfyUI nodes' path; Ollama only - the
+                   nodes talk to LM Studio through its SDK, not HTTP)
+
+By default it starts one or more local stub servers (benchmarks/stub_server.py)
+with the given latency / token rate / error injection, so connection pooling,
+retries, failover and scheduling can be evaluated offline. With --servers N the
+extra stubs join the service's endpoint pool. Pass --url to load a real server
+instead.
+
+Usage:
+    python benchmarks/load.py --target generate_prompt --concurrency 8 --requests 400
+    python benchmarks/load.py --target stream_prompt --service "LM Studio" --duration 600   # soak
+    python benchmarks/load.py --target call_llm --servers 3 --error-rate 0.05 --drop-rate 0.01
+    python benchmarks/load.py --target generate_prompt --url http://localhost:11434 --model llama3
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Keep the harness's call metrics out of the real history folder
+os.environ.setdefault("WAN_METRICS_DIR", tempfile.mkdtemp(prefix="wan_load_metrics_"))
+
+import stub_server
+
+TARGETS = ["generate_prompt", "stream_prompt", "call_llm"]
+IDEAS = [
+    "a lighthouse keeper watching a storm roll in",
+    "a fox crossing a frozen river at dawn",
+    "a street market in Marrakech at dusk",
+    "an astronaut repairing a satellite above the aurora",
+]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values), max(1, math.ceil(p / 100 * len(sorted_values)))) - 1
+    return sorted_values[rank]
+
+
+def error_name(error):
+    """Error type for the report; nodes.call_llm wraps failures in a plain Exception, so name the cause too."""
+    name = type(error).__name__
+    if type(error) is Exception and error.__context__ is not None:
+        name += f" ({type(error.__context__).__name__})"
+    return name
+
+
+class Recorder:
+    """Thread-safe collection of per-request outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.ttfts = []
+        self.errors = Counter()
+        self.completed = 0
+
+    def add(self, latency, ttft=None, error=None):
+        with self._lock:
+            self.completed += 1
+            if error is None:
+                self.latencies.append(latency)
+                if ttft is not None:
+                    self.ttfts.append(ttft)
+            else:
+                self.errors[error_name(error)] += 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            ttfts = sorted(self.ttfts)
+            errors = dict(self.errors)
+            completed = self.completed
+        failed = sum(errors.values())
+        result = {
+            "requests": completed,
+            "ok": completed - failed,
+            "errors": failed,
+            "error_rate": failed / completed if completed else 0.0,
+            "errors_by_type": errors,
+            "seconds": elapsed,
+            "throughput_rps": completed / elapsed if elapsed else 0.0,
+            "latency": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        }
+        result["latency"]["max"] = latencies[-1] if latencies else None
+        if ttfts:
+            result["ttft"] = {f"p{p}": percentile(ttfts, p) for p in (50, 95, 99)}
+        return result
+
+
+def make_call(args):
+    """The function one request runs: returns its time to first token (None when not streamed)."""
+    if args.target == "call_llm":
+        import nodes
+
+        nodes.OLLAMA_BASE_URL = args.url
+        system_prompt = nodes.build_system_prompt("wan2.2", "balanced")
+
+        def call(i):
+            nodes.call_llm("ollama", args.model, system_prompt, IDEAS[i % len(IDEAS)], 0.7,
+                           max_tokens=args.tokens)
+            return None
+        return call
+
+    import backend
+
+    api_url = args.url if args.service == "Ollama" else f"{args.url.rstrip('/')}/v1/chat/completions"
+    if args.target == "generate_prompt":
+        def call(i):
+            backend.generate_prompt(args.service, api_url, args.model, "Moderate Freedom", IDEAS[i % len(IDEAS)],
+                                    timeout=args.timeout)
+            return None
+        return call
+
+    def call(i):
+        started = time.perf_counter()
+        ttft = None
+        for _ in backend.stream_prompt(args.service, api_url, args.model, "Moderate Freedom", IDEAS[i % len(IDEAS)],
+                                       timeout=args.timeout):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+        return ttft
+    return call
+
+
+def run_load(call, args, recorder):
+    """Keep `concurrency` requests in flight until --requests are done or --duration is over."""
+    next_index = iter(range(10 ** 12))
+    index_lock = threading.Lock()
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def take():
+        with index_lock:
+            i = next(next_index)
+        if deadline is not None:
+            return i if time.monotonic() < deadline else None
+        return i if i < args.requests else None
+
+    def worker():
+        while True:
+            i = take()
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                ttft = call(i)
+            except Exception as e:
+                recorder.add(time.perf_counter() - started, error=e)
+            else:
+                recorder.add(time.perf_counter() - started, ttft=ttft)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="load") as executor:
+        futures = [executor.submit(worker) for _ in range(args.concurrency)]
+        started = time.monotonic()
+        while not all(f.done() for f in futures):
+            time.sleep(0.2)
+            if args.report_interval and time.monotonic() - started >= args.report_interval:
+                started = time.monotonic()
+                print_progress(recorder)
+        for f in futures:
+            f.result()
+
+
+def print_progress(recorder):
+    snapshot = recorder.summary(1.0)
+    p95 = snapshot["latency"]["p95"]
+    print(f"  ... {snapshot['requests']} requests, {snapshot['errors']} errors"
+          f"{f', p95 {p95 * 1000:.0f} ms' if p95 is not None else ''}", flush=True)
+
+
+def format_ms(seconds):
+    return "      -" if seconds is None else f"{seconds * 1000:7.1f}"
+
+
+def print_report(summary, servers):
+    print(f"\n{summary['requests']} requests in {summary['seconds']:.1f}s: "
+          f"{summary['throughput_rps']:.1f} req/s, error rate {summary['error_rate']:.1%}")
+    latency = summary["latency"]
+    print(f"  latency ms  p50 {format_ms(latency['p50'])}  p95 {format_ms(latency['p95'])}"
+          f"  p99 {format_ms(latency['p99'])}  max {format_ms(latency['max'])}")
+    if "ttft" in summary:
+        ttft = summary["ttft"]
+        print(f"  ttft ms     p50 {format_ms(ttft['p50'])}  p95 {format_ms(ttft['p95'])}  p99 {format_ms(ttft['p99'])}")
+    for name, count in sorted(summary["errors_by_type"].items(), key=lambda item: -item[1]):
+        print(f"  {name}: {count}")
+    for server in servers:
+        stats = server["stats"]
+        print(f"  stub {server['url']}: {stats['requests']} requests over {stats['connections']} connections, "
+              f"peak {stats['max_in_flight']} in flight, {stats['errors_injected']} errors / "
+              f"{stats['drops_injected']} drops injected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=TARGETS, default="generate_prompt")
+    parser.add_argument("--service", choices=["Ollama", "LM Studio"], default="Ollama")
+    parser.add_argument("--url", default=None, help="Load this server (base URL) instead of starting stubs")
+    parser.add_argument("--model", default=None, help="Model name (default: the stub's first model)")
+    parser.add_argument("--servers", type=int, default=1, help="Stub servers to start (extras join the endpoint pool)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="Total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="Run for this many seconds instead (soak)")
+    parser.add_argument("--timeout", type=float, default=None, help="Total deadline per request, in seconds")
+    parser.add_argument("--report-interval", type=float, default=10, help="Seconds between progress lines (0: off)")
+    parser.add_argument("-o", "--output", help="Write the summary as JSON to this file")
+    stub_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.target == "call_llm" and args.service != "Ollama":
+        parser.error("call_llm only supports Ollama over HTTP (the nodes use the LM Studio SDK)")
+
+    import endpoint_pool
+
+    stubs = []
+    if args.url is None:
+        stubs = [stub_server.StubServer(**stub_server.stub_options(args)).start() for _ in range(args.servers)]
+        args.url = stubs[0].url
+        service = endpoint_pool.OLLAMA if args.service == "Ollama" else endpoint_pool.LMSTUDIO
+        endpoint_pool.configure_endpoints(service, [stub.url for stub in stubs[1:]])
+        print(f"Started {len(stubs)} stub server(s): {', '.join(stub.url for stub in stubs)}")
+    args.model = args.model or (stubs[0].models[0] if stubs else None)
+    if not args.model:
+        parser.error("--model is required with --url")
+
+    amount = f"for {args.duration:g}s" if args.duration else f"{args.requests} requests"
+    print(f"{args.target} against {args.service} at {args.url}, model {args.model}: "
+          f"{amount} at concurrency {args.concurrency}")
+
+    recorder = Recorder()
+    call = make_call(args)
+    started = time.perf_counter()
+    try:
+        run_load(call, args, recorder)
+    except KeyboardInterrupt:
+        print("Interrupted")
+    elapsed = time.perf_counter() - started
+
+    summary = recorder.summary(elapsed)
+    summary["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+    servers = [{"url": stub.url, "stats": stub.stats()} for stub in stubs]
+    summary["servers"] = servers
+    for stub in stubs:
+        stub.stop()
+
+    print_report(summary, servers)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSummary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
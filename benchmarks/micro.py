@@ -0,0 +1,385 @@
+"""
+Microbenchmarks for the hot local code paths: history storage and search,
+LLM response parsing and system prompt building.
+
+Suites:
+- history: load_history (full and paged), building the search index,
+  search_history, filter_history_by_date, filter_history_by_metadata,
+  export_history (JSON and CSV) and add_to_history against a synthetic history
+  of each --sizes entries. Every size runs in its own subprocess with APPDATA
+  pointing at a temporary directory, so the real history is never touched.
+- parsing: nodes.parse_ideas / nodes.parse_segments on long model outputs,
+  including outputs without the expected markers (the regex worst case).
+- prompts: backend.get_system_prompt (memoized and uncached) and
+  nodes.build_system_prompt.
+
+Each benchmark reports the min / median / mean seconds per call over --repeat
+rounds. Results can be written as JSON, saved as a baseline and compared
+against one; the comparison exits with status 1 when any benchmark's best
+(min) time got slower than --threshold times the baseline's. The min is the
+least noisy figure for code this fast: slower rounds are other processes.
+
+Usage:
+    python benchmarks/micro.py                              # all suites, 100 / 10k / 1M entries
+    python benchmarks/micro.py --quick                      # 100 / 10k entries, shorter outputs
+    python benchmarks/micro.py --suite parsing --suite prompts
+    python benchmarks/micro.py --save-baseline              # writes benchmarks/micro_baseline.json
+    python benchmarks/micro.py --compare --threshold 1.3    # fails on a >30% slowdown
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+try:
+    import resource  # peak memory of the history workers (not available on Windows)
+except ImportError:
+    resource = None
+
+DEFAULT_SIZES = [100, 10_000, 1_000_000]
+QUICK_SIZES = [100, 10_000]
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "micro_baseline.json"
+SUITES = ["history", "parsing", "prompts"]
+INSERT_CHUNK = 10_000
+SEED = 1234
+
+SERVICES = ["Ollama", "LM Studio"]
+MODELS = ["llama3:8b", "qwen2.5:7b", "mistral:7b", "gemma2:9b", "qwen2.5-7b-instruct", "phi-3-mini"]
+CREATIVITY_LEVELS = ["Moderate Freedom", "High Freedom"]
+SUBJECTS = ["lighthouse keeper", "red fox", "street market", "astronaut", "paper boat", "jazz trio",
+            "hot air balloon", "samurai", "old fisherman", "neon alley", "glacier", "desert caravan"]
+SETTINGS = ["at dawn", "in a storm", "under the aurora", "at dusk", "in heavy rain", "in a bamboo forest",
+            "on a frozen river", "in a smoky basement", "above the clouds", "in Marrakech"]
+CAMERA = ["slow dolly in", "low-angle tracking shot", "aerial pull back", "handheld close-up",
+          "static wide shot", "orbiting crane shot"]
+LIGHTING = ["soft golden hour light", "hard rim lighting", "volumetric fog", "neon reflections",
+            "overcast diffuse light", "flickering candlelight"]
+
+
+# --- Timing ---
+
+def bench(fn, repeat):
+    """Seconds per call of fn(): min / median / mean over `repeat` autoranged rounds."""
+    timer = timeit.Timer(fn)
+    loops, total = timer.autorange()
+    per_call = [total / loops]
+    # A single call of a second or more is already a stable number; don't multiply the wait
+    rounds = repeat - 1 if per_call[0] < 1.0 else 0
+    per_call += [t / loops for t in timer.repeat(repeat=rounds, number=loops)]
+    return {
+        "min": min(per_call),
+        "median": statistics.median(per_call),
+        "mean": statistics.mean(per_call),
+        "loops": loops,
+        "rounds": len(per_call),
+    }
+
+
+def bench_once(fn):
+    """Time one call of a function that can't be repeated (e.g. building a cache)."""
+    timer = timeit.Timer(fn)
+    seconds = timer.timeit(number=1)
+    return {"min": seconds, "median": seconds, "mean": seconds, "loops": 1, "rounds": 1}
+
+
+def format_seconds(seconds):
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:8.1f} ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:8.1f} ms"
+    return f"{seconds:8.2f} s "
+
+
+def progress(message):
+    """Worker status on stderr (stdout carries the results)."""
+    print(f"  ... {message}", file=sys.stderr, flush=True)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def report(results):
+    for name, timing in results.items():
+        print(f"  {name:<52} median {format_seconds(timing['median'])}   min {format_seconds(timing['min'])}"
+              f"   ({timing['rounds']} x {timing['loops']})")
+
+
+# --- History suite ---
+
+def synthetic_entries(count, rng):
+    """Deterministic, realistic-looking history entries (oldest first, spread over 2024-2025)."""
+    prompts = [
+        f"A {rng.choice(CAMERA)} of a {subject} {setting}, {rng.choice(LIGHTING)}, "
+        f"cinematic 35mm film grain, shallow depth of field, the {subject} slowly turns toward the camera "
+        f"as the scene settles, muted teal and amber palette, {rng.randint(2, 9)} second shot."
+        for subject in SUBJECTS for setting in SETTINGS
+    ]
+    start = datetime(2024, 1, 1)
+    span_seconds = 2 * 365 * 24 * 3600
+    step = span_seconds / max(count, 1)
+    for i in range(count):
+        subject = rng.choice(SUBJECTS)
+        yield {
+            "timestamp": (start + timedelta(seconds=i * step)).isoformat(),
+            "user_idea": f"{subject} {rng.choice(SETTINGS)}, {rng.choice(CAMERA)}",
+            "generated_prompt": rng.choice(prompts),
+            "service": rng.choice(SERVICES),
+            "model": rng.choice(MODELS),
+            "creativity_level": rng.choice(CREATIVITY_LEVELS),
+            "api_url": "http://localhost:11434",
+        }
+
+
+def fill_history(store, count):
+    rng = random.Random(SEED)
+    chunk = []
+    for entry in synthetic_entries(count, rng):
+        chunk.append(entry)
+        if len(chunk) >= INSERT_CHUNK:
+            store.add_many(chunk)
+            chunk = []
+    if chunk:
+        store.add_many(chunk)
+
+
+def history_suite(size, repeat):
+    """Run inside a worker process whose APPDATA and cwd are a scratch directory."""
+    import backend
+
+    progress(f"inserting {size:,} entries")
+    store = backend.get_history_store()
+    fill_history(store, size)
+    history = backend.load_history()
+    mid = date(2025, 1, 1)
+
+    results = {}
+
+    def run(name, fn):
+        progress(name)
+        results[f"{name}[{size}]"] = bench(fn, repeat)
+
+    run("load_history", backend.load_history)
+    run("load_history(limit=50, offset=size/2)", lambda: backend.load_history(limit=50, offset=size // 2))
+    progress("building the search index")
+    results[f"search_index.build[{size}]"] = bench_once(backend.get_search_index)
+    run("search_history('lighthouse')", lambda: backend.search_history("lighthouse"))
+    run("search_history('lighthouse dawn')", lambda: backend.search_history("lighthouse dawn"))
+    run("search_history('lighthuose') fuzzy", lambda: backend.search_history("lighthuose"))
+    run("search_history('lighthouse', history=list)", lambda: backend.search_history("lighthouse", history))
+    run("filter_history_by_date", lambda: backend.filter_history_by_date(mid, mid + timedelta(days=30)))
+    run("filter_history_by_date(history=list)",
+        lambda: backend.filter_history_by_date(mid, mid + timedelta(days=30), history))
+    run("filter_history_by_metadata",
+        lambda: backend.filter_history_by_metadata(service="Ollama", model="llama3:8b"))
+    run("filter_history_by_metadata(history=list)",
+        lambda: backend.filter_history_by_metadata(service="Ollama", model="llama3:8b", history=history))
+    del history
+    run("export_history('json')", lambda: backend.export_history("json"))
+    run("export_history('csv')", lambda: backend.export_history("csv"))
+    # Last: it grows the history
+    run("add_to_history", lambda: backend.add_to_history("a red fox at dawn", "A slow dolly in of a red fox.",
+                                                         "Ollama", "llama3:8b", "Moderate Freedom"))
+    return {"results": results, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_history_worker(size, repeat):
+    """
+    Re-run this script for one history size in an isolated scratch directory.
+    Returns {"results": ..., "peak_rss_mb": ...}, or None if the worker failed
+    (e.g. ran out of memory: the search index is held entirely in RAM).
+    """
+    with tempfile.TemporaryDirectory(prefix="wan_bench_") as scratch:
+        env = dict(os.environ, APPDATA=scratch)
+        env.pop("WAN_TRACE", None)
+        proc = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), "--history-worker", str(size), "--repeat", str(repeat)],
+            cwd=scratch, env=env, stdout=subprocess.PIPE, text=True,
+        )
+    if proc.returncode != 0:
+        print(f"  Error: history benchmark for {size:,} entries failed (exit code {proc.returncode})")
+        return None
+    # The backend may print; the results are the last line
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# --- Parsing suite ---
+
+def long_ideas_output(chars, rng):
+    """An InspireMeNode-style answer: preamble, five long numbered ideas, trailing chatter."""
+    per_idea = max(chars // 6, 40)
+    lines = ["Here are five ideas for your next video:", ""]
+    for i in range(1, 6):
+        words = []
+        while sum(len(w) + 1 for w in words) < per_idea:
+            words.append(rng.choice(SUBJECTS + SETTINGS + CAMERA + LIGHTING))
+        lines.append(f"{i}. " + " ".join(words))
+    lines += ["", "Let me know if you want more variations!"]
+    return "\n".join(lines)
+
+
+def long_segments_output(chars, rng, markers=True):
+    """A VideoSequenceNode-style answer with six segments (or, markers=False, none of the expected labels)."""
+    per_segment = max(chars // 6, 40)
+    parts = []
+    for i in range(1, 7):
+        words = []
+        while sum(len(w) + 1 for w in words) < per_segment:
+            words.append(rng.choice(SUBJECTS + SETTINGS + CAMERA + LIGHTING))
+        body = " ".join(words)
+        parts.append(f"SEGMENT {i}: {body}" if markers else body)
+    return "\n\n".join(parts)
+
+
+def parsing_suite(lengths, repeat):
+    import nodes
+
+    rng = random.Random(SEED)
+    results = {}
+    for chars in lengths:
+        ideas = long_ideas_output(chars, rng)
+        segments = long_segments_output(chars, rng)
+        unmarked = long_segments_output(chars, rng, markers=False)
+        results[f"parse_ideas[{chars}]"] = bench(lambda: nodes.parse_ideas(ideas), repeat)
+        results[f"parse_segments[{chars}]"] = bench(lambda: nodes.parse_segments(segments), repeat)
+        results[f"parse_segments(no markers)[{chars}]"] = bench(lambda: nodes.parse_segments(unmarked), repeat)
+    return results
+
+
+# --- Prompts suite ---
+
+def prompts_suite(repeat):
+    import backend
+    import nodes
+
+    # get_system_prompt is traced() on top of lru_cache(); unwrap both for the uncached cost
+    uncached_system_prompt = backend.get_system_prompt.__wrapped__.__wrapped__
+    results = {}
+    for level in CREATIVITY_LEVELS:
+        results[f"get_system_prompt[{level}]"] = bench(lambda: backend.get_system_prompt(level), repeat)
+        results[f"get_system_prompt uncached[{level}]"] = bench(lambda: uncached_system_prompt(level), repeat)
+    results["get_user_prompt"] = bench(lambda: backend.get_user_prompt("Moderate Freedom", "a red fox at dawn"),
+                                       repeat)
+    for target in nodes.VIDEO_MODEL_PROMPTS:
+        for mode in nodes.CREATIVITY_CONFIGS:
+            results[f"build_system_prompt[{target}/{mode}]"] = bench(
+                lambda: nodes.build_system_prompt(target, mode), repeat)
+    return results
+
+
+# --- Baselines ---
+
+def compare(results, baseline, threshold):
+    """Print the min-time ratio of every benchmark in both runs; return the names that regressed."""
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['meta'].get('timestamp', '?')} (threshold {threshold:g}x):")
+    for suite, current in results.items():
+        previous = baseline["results"].get(suite, {})
+        for name, timing in current.items():
+            if name not in previous:
+                continue
+            ratio = timing["min"] / previous[name]["min"] if previous[name]["min"] else float("inf")
+            flag = "  REGRESSION" if ratio > threshold else ""
+            print(f"  {suite}/{name:<52} {ratio:6.2f}x{flag}")
+            if ratio > threshold:
+                regressions.append(f"{suite}/{name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", action="append", choices=SUITES, help="Suite(s) to run (default: all)")
+    parser.add_argument("--sizes", default=None,
+                        help="Comma-separated history sizes (default: 100,10000,1000000; 100,10000 with --quick)")
+    parser.add_argument("--quick", action="store_true", help="Smaller histories and outputs, for a fast check")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds per benchmark")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--save-baseline", nargs="?", const=str(DEFAULT_BASELINE), metavar="PATH",
+                        help=f"Save the results as the baseline (default: {DEFAULT_BASELINE.name})")
+    parser.add_argument("--compare", nargs="?", const=str(DEFAULT_BASELINE), metavar="PATH",
+                        help="Compare against a saved baseline; exit 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Slowdown ratio of the min time that counts as a regression (default: 1.25)")
+    parser.add_argument("--history-worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.history_worker is not None:
+        print(json.dumps(history_suite(args.history_worker, args.repeat)))
+        return 0
+
+    suites = args.suite or SUITES
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(",")]
+    else:
+        sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+    lengths = [2_000, 20_000] if args.quick else [2_000, 20_000, 200_000]
+
+    results = {}
+    memory = {}  # history size -> peak RSS (MB) of its worker
+    if "history" in suites:
+        results["history"] = {}
+        for size in sizes:
+            print(f"\nhistory, {size:,} entries")
+            worker = run_history_worker(size, args.repeat)
+            if worker is None:
+                continue
+            report(worker["results"])
+            results["history"].update(worker["results"])
+            if worker["peak_rss_mb"] is not None:
+                print(f"  peak memory: {worker['peak_rss_mb']:,.0f} MB")
+                memory[str(size)] = worker["peak_rss_mb"]
+    if "parsing" in suites:
+        print("\nparsing")
+        results["parsing"] = parsing_suite(lengths, args.repeat)
+        report(results["parsing"])
+    if "prompts" in suites:
+        print("\nprompts")
+        results["prompts"] = prompts_suite(args.repeat)
+        report(results["prompts"])
+
+    document = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+        "history_peak_rss_mb": memory,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2)
+            print(f"\nResults written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed beyond {args.threshold:g}x")
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Measure how much prefill time the prefix-cache-friendly prompt layout saves.
+
+Sends the same sequence of distinct ideas twice against a running server:
+- legacy layout: the idea embedded inside the system message (old get_system_prompt)
+- current layout: constant system message + idea in a user message
+
+and reports, per request, the time to first token and (for Ollama) the
+number of prompt tokens the server actually had to evaluate. With the current
+layout every request after the first should only prefill the short user
+message, because the system prefix is already in the server's KV cache.
+
+Usage:
+    python benchmarks/prefix_cache.py --service Ollama --url http://localhost:11434 --model llama3
+    python benchmarks/prefix_cache.py --service "LM Studio" --url http://localhost:1234/v1/chat/completions --model qwen2.5-7b-instruct
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import backend
+import http_client
+
+IDEAS = [
+    "a lighthouse keeper watching a storm roll in",
+    "a fox crossing a frozen river at dawn",
+    "a street market in Marrakech at dusk",
+    "an astronaut repairing a satellite above the aurora",
+    "a paper boat drifting down a rain-soaked gutter",
+    "a jazz trio playing in a smoky basement club",
+    "a hot air balloon festival over Cappadocia",
+    "a samurai standing in a bamboo forest in the wind",
+]
+
+
+def legacy_messages(creativity_level, idea):
+    """The old layout: idea interpolated into the system message, no user message."""
+    return backend.get_system_prompt(creativity_level) + f"\n        {backend.get_user_prompt(creativity_level, idea)}\n        ", None
+
+
+def current_messages(creativity_level, idea):
+    return backend.get_system_prompt(creativity_level), backend.get_user_prompt(creativity_level, idea)
+
+
+def measure(service, api_url, model, system_prompt, user_prompt):
+    """Time to first token (ms) and, for Ollama, prompt tokens evaluated."""
+    chat_url, payload = backend.build_chat_request(service, api_url, model, system_prompt, 0.7,
+                                                   stream=True, user_prompt=user_prompt)
+    # Only the prefill matters here; stop as soon as generation starts
+    if service == "Ollama":
+        payload["options"] = {"num_predict": 1}
+    else:
+        payload["max_tokens"] = 1
+
+    start = time.perf_counter()
+    ttft = None
+    prompt_tokens = None
+    response = http_client.post(chat_url, json=payload, stream=True)
+    response.raise_for_status()
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            if ttft is None:
+                ttft = (time.perf_counter() - start) * 1000
+            if service == "Ollama":
+                data = json.loads(line)
+                if data.get("done"):
+                    prompt_tokens = data.get("prompt_eval_count")
+    finally:
+        response.close()
+    return ttft, prompt_tokens
+
+
+def run(label, build, args):
+    print(f"\n{label}")
+    timings = []
+    for i, idea in enumerate(IDEAS[:args.requests]):
+        system_prompt, user_prompt = build(args.creativity, idea)
+        ttft, prompt_tokens = measure(args.service, args.url, args.model, system_prompt, user_prompt)
+        tokens = f"  prompt tokens evaluated: {prompt_tokens}" if prompt_tokens is not None else ""
+        print(f"  request {i + 1}: {ttft:8.1f} ms to first token{tokens}")
+        if i > 0:  # the first request primes the cache in both layouts
+            timings.append(ttft)
+    return statistics.mean(timings) if timings else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=["Ollama", "LM Studio"], default="Ollama")
+    parser.add_argument("--url", default=None, help="API URL (defaults to the app's default for the service)")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--creativity", choices=["Moderate Freedom", "High Freedom"], default="Moderate Freedom")
+    parser.add_argument("--requests", type=int, default=len(IDEAS))
+    args = parser.parse_args()
+    if args.url is None:
+        args.url = backend.DEFAULT_OLLAMA_URL if args.service == "Ollama" else backend.DEFAULT_LM_STUDIO_URL
+
+    legacy = run("Legacy layout (idea inside the system message)", legacy_messages, args)
+    current = run("Current layout (constant system message + user message)", current_messages, args)
+
+    print("\nMean time to first token after the first request:")
+    print(f"  legacy:  {legacy:8.1f} ms")
+    print(f"  current: {current:8.1f} ms")
+    print(f"  saved:   {legacy - current:8.1f} ms per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""
+A local stand-in for Ollama and LM Studio, for testing the HTTP path without a GPU.
+
+Speaks:
+- Ollama: GET /api/tags, POST /api/chat (streamed NDJSON or one JSON object,
+  with Ollama's token counts and nanosecond timings), POST /api/pull,
+  GET /api/ps (loaded models) and POST /api/generate without a prompt
+  (load a model, or unload it with keep_alive 0)
+- LM Studio (OpenAI-compatible): GET /v1/models, POST /v1/chat/completions
+  (streamed SSE "data:" events or one JSON object, with usage)
+- GET /stub/stats: requests, connections and peak concurrency seen so far
+
+Generation is simulated: each response waits --latency seconds (plus up to
+--jitter more) before the first token, then produces --tokens tokens at
+--token-rate tokens/second. A request for a model that is not loaded first
+waits --load-time seconds; models then stay loaded for their keep_alive
+(Ollama, 5 minutes by default) or until unloaded (LM Studio). Errors can be injected: --error-rate answers that
+share of chat requests with --error-status, --drop-rate closes the connection
+halfway through the response (mid-stream when streaming). Unknown models get
+a 404 like the real servers. Connections are kept alive (HTTP/1.1, chunked
+streams), so client-side connection pooling shows up in the stats.
+
+Usage:
+    python benchmarks/stub_server.py --port 11434                    # fake Ollama on its default port
+    python benchmarks/stub_server.py --port 1234 --token-rate 50 --error-rate 0.05
+
+or in-process (see benchmarks/load.py):
+    server = StubServer(latency=0.2, token_rate=100).start()
+    ... server.url ...
+    server.stop()
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ["llama3:8b", "qwen2.5:7b", "qwen2.5-7b-instruct"]
+WORDS = ["cinematic", "slow", "dolly", "shot", "of", "a", "lighthouse", "at", "dawn", "golden", "light",
+         "waves", "crash", "against", "the", "rocks", "camera", "pushes", "in", "mist", "drifts", "across",
+         "water", "soft", "rim", "lighting", "35mm", "film", "grain", "shallow", "depth", "field"]
+
+
+class StubServer:
+    """Fake Ollama / LM Studio server running on a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=0, models=None, latency=0.05, jitter=0.0, token_rate=200.0,
+                 tokens=64, load_time=0.0, error_rate=0.0, error_status=503, drop_rate=0.0, seed=None,
+                 model_size=5_000_000_000):
+        self.models = list(models or DEFAULT_MODELS)
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.load_time = load_time
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.model_size = model_size
+        self._loaded = {}  # model -> monotonic expiry time (None: until unloaded)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "connections": 0, "in_flight": 0, "max_in_flight": 0,
+                          "errors_injected": 0, "drops_injected": 0, "loads": 0, "unloads": 0, "by_path": {}}
+        self._httpd = _Server((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=f"stub-llm-{self.url}", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, by_path=dict(self._counters["by_path"]))
+
+    # --- Simulation ---
+
+    def _roll(self, rate):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def _text_tokens(self, count):
+        with self._lock:
+            words = [self._random.choice(WORDS) for _ in range(count)]
+        return [words[0].capitalize()] + [f" {word}" for word in words[1:]] if words else []
+
+    def _first_token_delay(self):
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter)
+        return delay
+
+    def _token_delay(self):
+        return 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+
+    @staticmethod
+    def _keep_alive_seconds(keep_alive):
+        """Ollama keep_alive (seconds, or a duration like "5m" / "1h"; negative: forever) in seconds, None for forever."""
+        if keep_alive is None:
+            return 300.0
+        if isinstance(keep_alive, str):
+            units = {"s": 1, "m": 60, "h": 3600}
+            text = keep_alive.strip()
+            keep_alive = float(text[:-1]) * units[text[-1]] if text[-1:] in units else float(text)
+        return None if keep_alive < 0 else float(keep_alive)
+
+    def _load(self, model, keep_alive=-1):
+        """Mark `model` loaded for `keep_alive`; returns the simulated load seconds (0 if it already was)."""
+        now = time.monotonic()
+        seconds = self._keep_alive_seconds(keep_alive)
+        with self._lock:
+            expires = self._loaded.get(model, now)
+            cold = model not in self._loaded or (expires is not None and expires <= now)
+            if cold:
+                self._counters["loads"] += 1
+            # keep_alive 0 unloads the model as soon as it has answered
+            self._loaded[model] = None if seconds is None else now + max(seconds, 0)
+        return self.load_time if cold else 0.0
+
+    def _unload(self, model):
+        with self._lock:
+            if model in self._loaded:
+                del self._loaded[model]
+                self._counters["unloads"] += 1
+
+    def loaded_models(self):
+        """{model: seconds until unloaded (None: never)} of the models loaded now."""
+        now = time.monotonic()
+        with self._lock:
+            return {model: None if expires is None else expires - now
+                    for model, expires in self._loaded.items() if expires is None or expires > now}
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._counters[key] += delta
+            if key == "in_flight":
+                self._counters["max_in_flight"] = max(self._counters["max_in_flight"], self._counters["in_flight"])
+
+    def _count_path(self, path):
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["by_path"][path] = self._counters["by_path"].get(path, 0) + 1
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # load tests open many connections at once
+
+    def handle_error(self, request, client_address):
+        # Clients closing a connection (e.g. after a stream's last event) is routine here
+        if isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class _DroppedConnection(Exception):
+    """Raised inside a handler to simulate the server dying mid-response."""
+
+
+def _make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so the client's connection pool gets exercised
+
+        def setup(self):
+            super().setup()
+            stub._count("connections")
+
+        def log_message(self, format, *args):
+            pass
+
+        # --- Plumbing ---
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            return json.loads(body) if body else {}
+
+        def _send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _start_chunked(self, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def _chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _end_chunked(self):
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def _drop(self):
+            stub._count("drops_injected")
+            self.close_connection = True
+            raise _DroppedConnection()
+
+        # --- Routing ---
+
+        def do_GET(self):
+            stub._count_path(self.path)
+            if self.path == "/api/tags":
+                self._send_json(200, {"models": [{"name": name, "model": name} for name in stub.models]})
+            elif self.path == "/v1/models":
+                self._send_json(200, {"object": "list",
+                                      "data": [{"id": name, "object": "model"} for name in stub.models]})
+            elif self.path == "/api/ps":
+                self._send_json(200, {"models": [
+                    {"name": name, "model": name, "size": stub.model_size, "size_vram": stub.model_size,
+                     "expires_at": None if remaining is None else time.strftime(
+                         "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + remaining))}
+                    for name, remaining in stub.loaded_models().items()
+                ]})
+            elif self.path == "/stub/stats":
+                self._send_json(200, stub.stats())
+            else:
+                self._send_json(404, {"error": f"no route for GET {self.path}"})
+
+        def do_POST(self):
+            stub._count_path(self.path)
+            try:
+                request = self._read_json()
+            except ValueError:
+                self._send_json(400, {"error": "invalid JSON body"})
+                return
+            routes = {"/api/chat": self._ollama_chat, "/v1/chat/completions": self._openai_chat,
+                      "/api/pull": self._ollama_pull, "/api/generate": self._ollama_generate}
+            route = routes.get(self.path)
+            if route is None:
+                self._send_json(404, {"error": f"no route for POST {self.path}"})
+                return
+            stub._count("in_flight")
+            try:
+                route(request)
+            except (_DroppedConnection, BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+            finally:
+                stub._count("in_flight", -1)
+
+        def _check_chat(self, request):
+            """Apply model lookup and error injection; returns False if a response was already sent."""
+            model = request.get("model")
+            if model not in stub.models:
+                self._send_json(404, {"error": f"model '{model}' not found"})
+                return False
+            if stub._roll(stub.error_rate):
+                stub._count("errors_injected")
+                time.sleep(stub._first_token_delay() / 2)
+                self._send_json(stub.error_status, {"error": f"injected error ({stub.error_status})"})
+                return False
+            return True
+
+        # --- Ollama ---
+
+        def _ollama_chat(self, request):
+            if not self._check_chat(request):
+                return
+            tokens = stub._text_tokens(stub.tokens)
+            drop_at = len(tokens) // 2 if stub._roll(stub.drop_rate) else None
+            prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+            started = time.perf_counter()
+            load_time = stub._load(request["model"], request.get("keep_alive"))
+            time.sleep(load_time + stub._first_token_delay())
+            prompt_done = time.perf_counter()
+
+            def final_stats():
+                now = time.perf_counter()
+                return {
+                    "done": True,
+                    "done_reason": "stop",
+                    "total_duration": int((now - started) * 1e9),
+                    "load_duration": int(load_time * 1e9),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int((prompt_done - started - load_time) * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int((now - prompt_done) * 1e9),
+                }
+
+            if request.get("stream", True):
+                self._start_chunked("application/x-ndjson")
+                for i, token in enumerate(tokens):
+                    if i == drop_at:
+                        self._drop()
+                    self._chunk(json.dumps({"model": request["model"], "done": False,
+                                            "message": {"role": "assistant", "content": token}}).encode() + b"\n")
+                    time.sleep(stub._token_delay())
+                self._chunk(json.dumps(dict({"model": request["model"],
+                                             "message": {"role": "assistant", "content": ""}},
+                                            **final_stats())).encode() + b"\n")
+                self._end_chunked()
+            else:
+                time.sleep(stub._token_delay() * len(tokens))
+                if drop_at is not None:
+                    self._drop()
+                self._send_json(200, dict({"model": request["model"],
+                                           "message": {"role": "assistant", "content": "".join(tokens)}},
+                                          **final_stats()))
+
+        def _ollama_generate(self, request):
+            # Only the load / unload form (no prompt) is simulated; chats go through /api/chat
+            model = request.get("model")
+            if model not in stub.models:
+                self._send_json(404, {"error": f"model '{model}' not found"})
+                return
+            if request.get("prompt"):
+                self._send_json(400, {"error": "the stub only simulates /api/generate without a prompt"})
+                return
+            if stub._keep_alive_seconds(request.get("keep_alive")) == 0:
+                stub._unload(model)
+                self._send_json(200, {"model": model, "response": "", "done": True, "done_reason": "unload"})
+                return
+            time.sleep(stub._load(model, request.get("keep_alive")))
+            self._send_json(200, {"model": model, "response": "", "done": True, "done_reason": "load"})
+
+        def _ollama_pull(self, request):
+            total = 4_000_000_000
+            steps = 8
+            self._start_chunked("application/x-ndjson")
+            self._chunk(json.dumps({"status": "pulling manifest"}).encode() + b"\n")
+            for step in range(1, steps + 1):
+                time.sleep(stub._first_token_delay())
+                self._chunk(json.dumps({"status": "pulling", "digest": "sha256:stub", "total": total,
+                                        "completed": total * step // steps}).encode() + b"\n")
+            for status in ("verifying sha256 digest", "writing manifest", "success"):
+                self._chunk(json.dumps({"status": status}).encode() + b"\n")
+            self._end_chunked()
+            name = request.get("name") or request.get("model")
+            if name and name not in stub.models:
+                stub.models.append(name)
+
+        # --- LM Studio (OpenAI-compatible) ---
+
+        def _openai_chat(self, request):
+            if not self._check_chat(request):
+                return
+            tokens = stub._text_tokens(stub.tokens)
+            drop_at = len(tokens) // 2 if stub._roll(stub.drop_rate) else None
+            prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                     "total_tokens": prompt_tokens + len(tokens)}
+            base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request["model"]}
+            time.sleep(stub._load(request["model"]) + stub._first_token_delay())
+
+            if request.get("stream"):
+                self._start_chunked("text/event-stream")
+                for i, token in enumerate(tokens):
+                    if i == drop_at:
+                        self._drop()
+                    event = dict(base, object="chat.completion.chunk",
+                                 choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+                    self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+                    time.sleep(stub._token_delay())
+                event = dict(base, object="chat.completion.chunk",
+                             choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    event["usage"] = usage
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self._end_chunked()
+            else:
+                time.sleep(stub._token_delay() * len(tokens))
+                if drop_at is not None:
+                    self._drop()
+                self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                    {"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                     "finish_reason": "stop"}]))
+
+    return Handler
+
+
+def add_arguments(parser):
+    """The stub's simulation options (shared with benchmarks/load.py)."""
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="Comma-separated model names served")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds of latency")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Tokens per second (0: instant)")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per response")
+    parser.add_argument("--load-time", type=float, default=0.0, help="Simulated load seconds of a model that is not loaded")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of chat requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected errors")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="Share of chat responses whose connection is dropped halfway")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for token choice and error injection")
+
+
+def stub_options(args):
+    """StubServer keyword arguments from parsed add_arguments() options."""
+    return {
+        "models": [m.strip() for m in args.models.split(",") if m.strip()],
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "token_rate": args.token_rate,
+        "tokens": args.tokens,
+        "load_time": args.load_time,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "drop_rate": args.drop_rate,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, **stub_options(args))
+    print(f"Stub LLM server on {server.url} (models: {', '.join(server.models)})")
+    print(f"  Ollama:    {server.url}/api/chat")
+    print(f"  LM Studio: {server.url}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\n{json.dumps(server.stats(), indent=2)}")
+
+
+if __name__ == "__main__":
+    main()
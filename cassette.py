@@ -0,0 +1,213 @@
+"""
+Record / replay of LLM calls ("cassettes") for deterministic offline runs.
+
+While a cassette is active, nodes.call_llm and the backend's generate_prompt /
+get_inspiration (and their streaming variants) look every request up on it
+before going to the network. Requests are matched by the same content key as
+the response cache (service, model, system prompt, user prompt, temperature,
+max_tokens, seed), so a re-run of a workflow or test suite sends nothing to
+the LLM and gets exactly the answers it got when it was recorded.
+
+Modes:
+- record: start an empty cassette and record every call
+- replay: serve calls from the cassette only; a request that was never
+  recorded raises CassetteMissError (no network I/O at all)
+- auto:   replay what is recorded, record what is not (the default)
+
+Enable it with the environment (before ComfyUI / the app starts):
+    WAN_CASSETTE=runs/portrait_graph.jsonl.gz  WAN_CASSETTE_MODE=replay
+or from code with cassette.activate(path, mode), or batch.py --cassette.
+
+The file is JSON Lines (gzip-compressed when the name ends in .gz), appended
+as calls are recorded. System prompts are long and shared by most calls, so
+each distinct one is stored once and calls refer to it by hash.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    from . import response_cache, tracing
+    from .llm_errors import CassetteMissError
+except ImportError:
+    import response_cache
+    import tracing
+    from llm_errors import CassetteMissError
+
+RECORD = "record"
+REPLAY = "replay"
+AUTO = "auto"
+MODES = (RECORD, REPLAY, AUTO)
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def _open(path, mode):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _prompt_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class Cassette:
+    """One cassette file: recorded responses by request key. Thread-safe."""
+
+    def __init__(self, path, mode=AUTO):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r} (expected one of {', '.join(MODES)})")
+        self.path = Path(path)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._responses = {}   # request key -> response text
+        self._prompts = set()  # hashes of system prompts already in the file
+        self._lock = threading.Lock()
+        if mode == RECORD:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with _open(self.path, "w"):
+                pass
+        elif self.path.exists():
+            self._load()
+        elif mode == REPLAY:
+            raise FileNotFoundError(f"Cassette {self.path} does not exist (record it first)")
+
+    def _load(self):
+        with _open(self.path, "r") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write leaves a partial last line; everything before it is fine
+                    print(f"Skipping unreadable line {line_number} of cassette {self.path}")
+                    continue
+                if "prompt" in record:
+                    self._prompts.add(record["prompt"])
+                elif "key" in record:
+                    self._responses[record["key"]] = record["response"]
+
+    def __len__(self):
+        return len(self._responses)
+
+    @staticmethod
+    def key(service, model, system_prompt, user_prompt, temperature, max_tokens=0, seed=None):
+        return response_cache.make_key(service, model, system_prompt, user_prompt, temperature, max_tokens, seed)
+
+    def lookup(self, key, model=None):
+        """
+        The recorded response for `key`, or None if it should be fetched (and
+        recorded). In replay mode a miss raises CassetteMissError instead.
+        """
+        with self._lock:
+            response = None if self.mode == RECORD else self._responses.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+            self.misses += 1
+        if self.mode == REPLAY:
+            raise CassetteMissError(self.path, model or "LLM")
+        return None
+
+    def record(self, key, response, service, model, system_prompt, user_prompt, temperature, max_tokens=0,
+               seed=None):
+        """Append one call to the cassette (the request is kept for reading / diffing the file)."""
+        if self.mode == REPLAY:
+            return
+        prompt_id = _prompt_hash(system_prompt)
+        lines = []
+        with self._lock:
+            if self._responses.get(key) == response:
+                return
+            if prompt_id not in self._prompts:
+                self._prompts.add(prompt_id)
+                lines.append({"prompt": prompt_id, "text": system_prompt})
+            lines.append({
+                "key": key,
+                "service": service,
+                "model": model,
+                "system": prompt_id,
+                "user": user_prompt,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "seed": seed,
+                "response": response,
+                "recorded": time.time(),
+            })
+            try:
+                with _open(self.path, "a") as f:
+                    for line in lines:
+                        f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+            except OSError as e:
+                print(f"Error writing cassette {self.path}: {e}")
+                return
+            self._responses[key] = response
+            self.recorded += 1
+
+    def call(self, fn, service, model, system_prompt, user_prompt, temperature, max_tokens=0, seed=None,
+             stats=None):
+        """
+        fn()'s result for this request: replayed from the cassette when recorded,
+        otherwise fetched with fn() and recorded. `stats`, if a dict, is marked
+        as replayed on a hit.
+        """
+        key = self.key(service, model, system_prompt, user_prompt, temperature, max_tokens, seed)
+        with tracing.span("cassette.lookup", mode=self.mode) as s:
+            response = self.lookup(key, model)
+            s.set(hit=response is not None)
+        if response is not None:
+            if stats is not None:
+                stats.update({"service": service, "model": model, "replayed": True})
+            return response
+        response = fn()
+        if response:
+            self.record(key, response, service, model, system_prompt, user_prompt, temperature, max_tokens, seed)
+        return response
+
+    def summary(self):
+        return f"cassette {self.path} ({self.mode}): {self.hits} replayed, {self.recorded} recorded, {len(self)} total"
+
+
+def activate(path, mode=AUTO):
+    """Make `path` the active cassette for every LLM call in this process. Returns it."""
+    global _active
+    cassette = Cassette(path, mode)
+    with _active_lock:
+        _active = cassette
+    print(f"Using {cassette.summary()}")
+    return cassette
+
+
+def deactivate():
+    """Stop using the active cassette (calls go to the network again). Returns it, or None."""
+    global _active
+    with _active_lock:
+        cassette, _active = _active, None
+    return cassette
+
+
+def get_active():
+    """The active Cassette, or None."""
+    return _active
+
+
+def call(fn, service, model, system_prompt, user_prompt, temperature, max_tokens=0, seed=None, stats=None):
+    """fn() through the active cassette (just fn() when none is active)."""
+    cassette = _active
+    if cassette is None:
+        return fn()
+    return cassette.call(fn, service, model, system_prompt, user_prompt, temperature, max_tokens, seed, stats)
+
+
+if os.environ.get("WAN_CASSETTE"):
+    activate(os.environ["WAN_CASSETTE"], os.environ.get("WAN_CASSETTE_MODE", AUTO))
@@ -0,0 +1,277 @@
+"""
+Multi-endpoint routing for Ollama / LM Studio.
+
+A pool holds every server configured for one service. Requests are routed to
+the healthy endpoint with the fewest requests in flight, preferring endpoints
+whose model list (/api/tags or /v1/models) contains the requested model. When
+an endpoint fails (connection error, timeout, 5xx, model missing) it is put
+on a short cooldown and the request fails over to the next candidate.
+Endpoints whose circuit breaker (see resilience.py) is open are tried last.
+
+Extra endpoints come from the environment (comma-separated base URLs):
+    WAN_OLLAMA_URLS=http://gpu1:11434,http://gpu2:11434
+    WAN_LMSTUDIO_URLS=http://gpu3:1234
+or from configure_endpoints(). The URL the caller passes (the app's API URL
+field, or the nodes' default) is always the first endpoint of its pool.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from . import http_client, resilience
+    from .llm_errors import (CircuitOpenError, LLMConnectionError, LLMResponseError, LLMTimeoutError,
+                             from_requests_error)
+except ImportError:
+    import http_client
+    import resilience
+    from llm_errors import (CircuitOpenError, LLMConnectionError, LLMResponseError, LLMTimeoutError,
+                            from_requests_error)
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+OLLAMA = "ollama"
+LMSTUDIO = "lmstudio"
+
+ENDPOINT_ENV_VARS = {
+    OLLAMA: "WAN_OLLAMA_URLS",
+    LMSTUDIO: "WAN_LMSTUDIO_URLS",
+}
+
+HEALTH_CHECK_INTERVAL = 30  # Seconds between background model-list/health refreshes
+FAILURE_COOLDOWN = 10       # Seconds a failed endpoint is skipped (unless nothing else is up)
+MODEL_LIST_RETRIES = 1      # Listing is idempotent, but a refresh should stay snappy
+
+_extra_urls = {}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def base_url(url):
+    """Reduce an API URL (e.g. .../v1/chat/completions) to the server's base URL."""
+    return http_client.endpoint_key(url)
+
+
+def _normalize_model(service, name):
+    # Ollama treats "llama3" and "llama3:latest" as the same model
+    if service == OLLAMA and name and ":" not in name:
+        return f"{name}:latest"
+    return name
+
+
+def _fetch_models(service, url):
+    path, key, name_field = ("/api/tags", "models", "name") if service == OLLAMA else ("/v1/models", "data", "id")
+    try:
+        resp = http_client.get(f"{url}{path}", timeout=http_client.MODEL_LIST_TIMEOUT)
+        resp.raise_for_status()
+        return [m[name_field] for m in resp.json().get(key, []) if m.get(name_field)]
+    except requests.exceptions.RequestException as e:
+        raise from_requests_error(e, url) from e
+    except (ValueError, AttributeError) as e:
+        raise LLMResponseError(f"Unexpected model list from {url}: {e}", url) from e
+
+
+def list_endpoint_models(service, url):
+    """Model names served by one endpoint (raises an LLMError if it cannot be reached)."""
+    breaker = resilience.get_breaker(url)
+    return resilience.call_with_retries(lambda: breaker.call(lambda: _fetch_models(service, url)),
+                                        retries=MODEL_LIST_RETRIES)
+
+
+def is_failover_error(exc):
+    """True if the request should be retried on another endpoint."""
+    if isinstance(exc, (CircuitOpenError, LLMConnectionError)):
+        return True
+    if isinstance(exc, LLMTimeoutError):
+        # Out of total time: another endpoint will not help
+        return exc.phase != "total"
+    if isinstance(exc, LLMResponseError):
+        return exc.status is not None and (exc.status == 404 or exc.status >= 500)
+    if requests is None:
+        return False
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        # 404: model not present on this host; 5xx: host overloaded or broken
+        return exc.response.status_code == 404 or exc.response.status_code >= 500
+    return False
+
+
+class Endpoint:
+    """One server plus its routing state."""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.failed_at = 0
+        self.models = None  # set of normalized model names, None until first checked
+        self.breaker = resilience.get_breaker(url)
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, healthy={self.healthy}, outstanding={self.outstanding})"
+
+
+class EndpointPool:
+    """Load-balancing, failing-over set of endpoints for one service. Thread-safe."""
+
+    def __init__(self, service, urls, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.service = service
+        self.health_check_interval = health_check_interval
+        self.endpoints = []
+        for url in urls:
+            url = base_url(url)
+            if all(ep.url != url for ep in self.endpoints):
+                self.endpoints.append(Endpoint(url))
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    # --- Health ---
+
+    def check(self, endpoint):
+        """Refresh one endpoint's model list; returns the list, or None if it is down."""
+        try:
+            models = list_endpoint_models(self.service, endpoint.url)
+        except Exception as e:
+            self.mark_failed(endpoint, e)
+            return None
+        self.record_models(endpoint, models)
+        return models
+
+    def record_models(self, endpoint, models):
+        """Store a freshly fetched model list (the endpoint answered, so it is healthy)."""
+        with self._lock:
+            endpoint.models = {_normalize_model(self.service, m) for m in models}
+            endpoint.healthy = True
+
+    def check_all(self):
+        """Health-check every endpoint; returns the union of their models (raises if none is up)."""
+        models, reachable = [], False
+        for endpoint in self.endpoints:
+            found = self.check(endpoint)
+            if found is not None:
+                reachable = True
+                models.extend(m for m in found if m not in models)
+        if not reachable:
+            raise ConnectionError(f"No {self.service} endpoint reachable")
+        return models
+
+    def _ensure_health_checks(self):
+        # A single endpoint has nowhere to fail over to; no need to poll it
+        if len(self.endpoints) < 2 or self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, daemon=True,
+                                                       name=f"{self.service}-health")
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for endpoint in self.endpoints:
+                self.check(endpoint)
+            time.sleep(self.health_check_interval)
+
+    def mark_failed(self, endpoint, exc=None):
+        if isinstance(exc, CircuitOpenError):
+            return  # the breaker already knows the endpoint is down; nothing new to record
+        with self._lock:
+            was_healthy = endpoint.healthy
+            endpoint.healthy = False
+            endpoint.failed_at = time.time()
+        # Log the transition only, not every failed health check of a host that stays down
+        if was_healthy and exc is not None:
+            print(f"Endpoint {endpoint.url} failed: {exc}")
+
+    def mark_ok(self, endpoint):
+        with self._lock:
+            endpoint.healthy = True
+
+    # --- Routing ---
+
+    def candidates(self, model=None):
+        """
+        Endpoints to try, best first: hosts known to serve `model` (or not yet
+        checked), healthy before cooling down, fewest requests in flight first.
+        If no host lists the model, every host is tried so the server's own
+        error (or a stale list) surfaces instead of a silent refusal.
+        """
+        self._ensure_health_checks()
+        wanted = _normalize_model(self.service, model)
+        now = time.time()
+        with self._lock:
+            eligible = [ep for ep in self.endpoints if not wanted or ep.models is None or wanted in ep.models]
+            if not eligible:
+                eligible = list(self.endpoints)
+
+            def rank(item):
+                index, ep = item
+                cooling = (not ep.healthy and now - ep.failed_at < FAILURE_COOLDOWN) or ep.breaker.is_open()
+                return (cooling, ep.outstanding, index)
+
+            return [ep for _, ep in sorted(enumerate(eligible), key=rank)]
+
+    @contextmanager
+    def lease(self, endpoint):
+        """Count a request as in flight on `endpoint` for the duration of the block."""
+        with self._lock:
+            endpoint.outstanding += 1
+        try:
+            yield endpoint
+        finally:
+            with self._lock:
+                endpoint.outstanding -= 1
+
+    def call(self, model, fn):
+        """
+        Run fn(endpoint_url) on the best endpoint, failing over to the next on
+        connection errors, timeouts, 404s, 5xx responses and open breakers.
+        """
+        last_error = None
+        for endpoint in self.candidates(model):
+            with self.lease(endpoint):
+                try:
+                    result = fn(endpoint.url)
+                except Exception as e:
+                    if not is_failover_error(e):
+                        raise
+                    self.mark_failed(endpoint, e)
+                    last_error = e
+                    continue
+            self.mark_ok(endpoint)
+            return result
+        raise last_error
+
+
+def configure_endpoints(service, urls):
+    """Set the extra endpoints for a service (replaces WAN_*_URLS from the environment)."""
+    with _pools_lock:
+        _extra_urls[service] = [u.strip() for u in urls if u and u.strip()]
+        for key in [key for key in _pools if key[0] == service]:
+            del _pools[key]
+
+
+def _configured_urls(service):
+    if service not in _extra_urls:
+        raw = os.environ.get(ENDPOINT_ENV_VARS[service], "")
+        _extra_urls[service] = [u.strip() for u in raw.split(",") if u.strip()]
+    return _extra_urls[service]
+
+
+def get_pool(service, primary_url):
+    """The pool for `service` whose first endpoint is the server behind `primary_url`."""
+    key = (service, base_url(primary_url))
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = EndpointPool(service, [primary_url] + _configured_urls(service))
+            _pools[key] = pool
+        return pool
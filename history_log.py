@@ -0,0 +1,269 @@
+"""
+Append-only, cross-process safe prompt history log (used by the ComfyUI nodes).
+
+Layout inside the log directory:
+- tail.jsonl            active log; every entry is appended with one write()
+- segment-<n>.jsonl     immutable snapshot segments produced by compaction
+- history.lock          advisory lock file
+- last_id, id.lock      last entry id handed out, and the lock that guards it
+- legacy-imported       marker: the legacy JSON history has been imported
+
+Writers take a *shared* lock, so any number of ComfyUI workers can append at
+the same time (O_APPEND single-write appends do not interleave). Compaction
+and reads take the *exclusive* / shared lock respectively, so a reader never
+observes an entry in both a fresh segment and the tail. Compaction runs on a
+background thread once the tail grows past a size threshold.
+
+Entry ids come from next_id(), which every process takes under one lock, so
+workers appending at the same time never hand out the same id.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+TAIL_FILE = "tail.jsonl"
+LOCK_FILE = "history.lock"
+ID_FILE = "last_id"
+ID_LOCK_FILE = "id.lock"
+MIGRATED_MARKER = "legacy-imported"
+SEGMENT_PREFIX = "segment-"
+
+DEFAULT_COMPACT_BYTES = 256 * 1024
+DEFAULT_MAX_SEGMENTS = 8
+
+
+class _FileLock:
+    """Advisory lock on the log's lock file (flock on POSIX, msvcrt on Windows)."""
+
+    def __init__(self, path, exclusive, blocking=True):
+        self.path = path
+        self.exclusive = exclusive
+        self.blocking = blocking
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                mode = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+                if not self.blocking:
+                    mode |= fcntl.LOCK_NB
+                fcntl.flock(self.fd, mode)
+            else:
+                # msvcrt has no shared locks; every holder is exclusive on Windows
+                msvcrt.locking(self.fd, msvcrt.LK_LOCK if self.blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(self.fd)
+            self.fd = None
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _parse_lines(data):
+    """Parse JSONL bytes, skipping blank or torn (partially written) lines."""
+    entries = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+class HistoryLog:
+    """Append-only JSONL history with background compaction into snapshot segments."""
+
+    def __init__(self, log_dir, max_entries=None, compact_bytes=DEFAULT_COMPACT_BYTES,
+                 max_segments=DEFAULT_MAX_SEGMENTS):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.tail_path = self.log_dir / TAIL_FILE
+        self.lock_path = self.log_dir / LOCK_FILE
+        self.id_path = self.log_dir / ID_FILE
+        self.id_lock_path = self.log_dir / ID_LOCK_FILE
+        self.max_entries = max_entries
+        self.compact_bytes = compact_bytes
+        self.max_segments = max_segments
+        self._segment_cache = {}  # segment name -> parsed entries (segments never change)
+        self._compacting = threading.Lock()
+
+    # --- Writing ---
+
+    def append(self, entry):
+        """Append one entry with a single write() under the shared lock."""
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with _FileLock(self.lock_path, exclusive=False):
+            fd = os.open(self.tail_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                tail_size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+
+        if tail_size >= self.compact_bytes:
+            self.compact_in_background()
+
+    def next_id(self):
+        """
+        A new entry id: the current time in milliseconds, bumped past the last
+        id any process sharing the log handed out (entries saved in the same
+        millisecond, or by workers appending at the same time, stay distinct).
+        """
+        with _FileLock(self.id_lock_path, exclusive=True):
+            try:
+                last = int(self.id_path.read_text())
+            except (FileNotFoundError, ValueError):
+                last = 0
+            entry_id = max(int(time.time() * 1000), last + 1)
+            self.id_path.write_text(str(entry_id))
+        return entry_id
+
+    def import_legacy(self, path):
+        """
+        Import a legacy newest-first JSON history file into a snapshot segment
+        once, then rename it to <name>.migrated. The marker is checked and
+        written under the exclusive lock, so workers starting at the same time
+        import it only once (and a file that could not be renamed is not
+        imported again).
+        """
+        path = Path(path)
+        marker = self.log_dir / MIGRATED_MARKER
+        with _FileLock(self.lock_path, exclusive=True):
+            if not path.exists():
+                return
+            if not marker.exists():
+                with open(path, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+                if legacy:
+                    self._write_segment(list(reversed(legacy)))
+                marker.write_text(path.name)
+            path.replace(path.with_name(path.name + ".migrated"))
+
+    # --- Reading ---
+
+    def _segment_paths(self):
+        return sorted(self.log_dir.glob(f"{SEGMENT_PREFIX}*.jsonl"), key=lambda p: int(p.stem[len(SEGMENT_PREFIX):]))
+
+    def _read_segment(self, path):
+        entries = self._segment_cache.get(path.name)
+        if entries is None:
+            with open(path, "rb") as f:
+                entries = _parse_lines(f.read())
+            self._segment_cache[path.name] = entries
+        return entries
+
+    def read_all(self):
+        """All entries, newest first (snapshot segments + tail)."""
+        with _FileLock(self.lock_path, exclusive=False):
+            paths = self._segment_paths()
+            entries = []
+            for path in paths:
+                entries.extend(self._read_segment(path))
+            try:
+                with open(self.tail_path, "rb") as f:
+                    entries.extend(_parse_lines(f.read()))
+            except FileNotFoundError:
+                pass
+
+        live = {path.name for path in paths}
+        for name in list(self._segment_cache):
+            if name not in live:
+                del self._segment_cache[name]
+
+        entries.reverse()
+        if self.max_entries:
+            entries = entries[:self.max_entries]
+        return entries
+
+    # --- Compaction ---
+
+    def _write_segment(self, entries):
+        """Atomically create the next segment (caller holds the exclusive lock)."""
+        paths = self._segment_paths()
+        seq = int(paths[-1].stem[len(SEGMENT_PREFIX):]) + 1 if paths else 1
+        path = self.log_dir / f"{SEGMENT_PREFIX}{seq:08d}.jsonl"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            for entry in entries:
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def compact(self, blocking=True):
+        """
+        Move the tail into a new snapshot segment, then merge segments down
+        (applying max_entries) once there are more than max_segments of them.
+        Returns False if another process holds the lock and blocking is False.
+        """
+        try:
+            lock = _FileLock(self.lock_path, exclusive=True, blocking=blocking)
+            lock.__enter__()
+        except OSError:
+            return False
+
+        try:
+            try:
+                with open(self.tail_path, "rb") as f:
+                    tail_entries = _parse_lines(f.read())
+            except FileNotFoundError:
+                tail_entries = []
+
+            if tail_entries:
+                self._write_segment(tail_entries)
+                # Safe: appenders are excluded while we hold the exclusive lock
+                with open(self.tail_path, "wb"):
+                    pass
+
+            paths = self._segment_paths()
+            if len(paths) > self.max_segments:
+                merged = []
+                for path in paths:
+                    merged.extend(self._read_segment(path))
+                if self.max_entries:
+                    merged = merged[-self.max_entries:]
+                new_path = self._write_segment(merged)
+                for path in paths:
+                    if path != new_path:
+                        path.unlink()
+        finally:
+            lock.__exit__(None, None, None)
+        return True
+
+    def compact_in_background(self):
+        """Start a compaction thread unless one is already running in this process."""
+        if not self._compacting.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.compact(blocking=False)
+            except OSError as e:
+                print(f"History compaction failed: {e}")
+            finally:
+                self._compacting.release()
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,261 @@
+"""
+SQLite-backed prompt history for the desktop app.
+
+Replaces the old whole-file rewrite of wan2_prompt_history.json: inserts and
+deletes touch a single row, queries are paged and filtered through indexed
+columns, and the database runs in WAL mode with separate read and write
+connections, so reads (paging, search) never wait for a write to finish.
+An existing JSON history file is imported once (the import and a marker row
+commit together) and then renamed.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import timedelta
+from pathlib import Path
+
+ENTRY_FIELDS = ("timestamp", "user_idea", "generated_prompt", "service", "model", "creativity_level", "api_url")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp        TEXT NOT NULL,
+    user_idea        TEXT NOT NULL DEFAULT '',
+    generated_prompt TEXT NOT NULL DEFAULT '',
+    service          TEXT NOT NULL DEFAULT '',
+    model            TEXT NOT NULL DEFAULT '',
+    creativity_level TEXT NOT NULL DEFAULT '',
+    api_url          TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_service ON history (service);
+CREATE INDEX IF NOT EXISTS idx_history_model ON history (model);
+CREATE INDEX IF NOT EXISTS idx_history_creativity ON history (creativity_level);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_INSERT = f"INSERT INTO history ({', '.join(ENTRY_FIELDS)}) VALUES ({', '.join('?' * len(ENTRY_FIELDS))})"
+_MIGRATED_KEY = "legacy_json_migrated"
+
+_COLUMNS = "id, " + ", ".join(ENTRY_FIELDS)
+
+
+def _row_to_entry(row):
+    return dict(zip(("id",) + ENTRY_FIELDS, row))
+
+
+class HistoryStore:
+    """
+    Thread-safe wrapper around the history database: one connection for
+    writes and one for reads, each behind its own lock.
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        # In WAL mode this connection reads the last committed state while the writer works
+        self._read_lock = threading.Lock()
+        self._read_conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+
+        if legacy_json_path is not None:
+            self.migrate_json(legacy_json_path)
+
+    # --- Migration ---
+
+    def migrate_json(self, json_path):
+        """
+        One-time import of the legacy JSON history (newest-first list).
+        The rows and a marker are committed in one transaction, and the file is
+        renamed to *.migrated afterwards; a crash in between never imports it twice.
+        """
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+
+        with self._lock:
+            migrated = self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (_MIGRATED_KEY,)).fetchone()
+        if migrated:
+            self._retire_json(json_path)
+            return 0
+
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Error reading legacy history for migration: {e}")
+            return 0
+
+        # Oldest first so autoincrement ids follow chronological order
+        entries = [e for e in reversed(legacy) if isinstance(e, dict) and e.get('timestamp')]
+        with self._lock:
+            with self._conn:  # One transaction: rows and marker commit (or roll back) together
+                self._conn.executemany(_INSERT, [tuple(e.get(field) or "" for field in ENTRY_FIELDS) for e in entries])
+                self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (_MIGRATED_KEY, str(json_path)))
+
+        self._retire_json(json_path)
+        return len(entries)
+
+    @staticmethod
+    def _retire_json(json_path):
+        try:
+            json_path.replace(json_path.with_name(json_path.name + ".migrated"))
+        except OSError as e:
+            print(f"Error renaming migrated history file: {e}")
+
+    # --- Writes ---
+
+    def add(self, entry):
+        """Insert one entry and return its id."""
+        with self._lock, self._conn:
+            cur = self._conn.execute(_INSERT, tuple(entry.get(field) or "" for field in ENTRY_FIELDS))
+        return cur.lastrowid
+
+    def add_many(self, entries):
+        """Insert several entries (oldest first) in a single transaction; returns their ids."""
+        ids = []
+        # Rolled back as a whole if any insert fails, so the next write does not commit a partial batch
+        with self._lock, self._conn:
+            for entry in entries:
+                cur = self._conn.execute(_INSERT, tuple(entry.get(field) or "" for field in ENTRY_FIELDS))
+                ids.append(cur.lastrowid)
+        return ids
+
+    def delete(self, entry_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM history WHERE id = ?", (entry_id,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM history")
+
+    def trim(self, max_entries):
+        """Keep only the newest `max_entries` rows; returns the ids that were removed."""
+        with self._lock, self._conn:
+            stale_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM history ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET ?",
+                (max_entries,),
+            )]
+            if stale_ids:
+                self._conn.executemany("DELETE FROM history WHERE id = ?", [(i,) for i in stale_ids])
+        return stale_ids
+
+    # --- Reads ---
+
+    @staticmethod
+    def _where(service=None, model=None, creativity_level=None, start_date=None, end_date=None):
+        clauses, params = [], []
+        if service:
+            clauses.append("service = ?")
+            params.append(service)
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if creativity_level:
+            clauses.append("creativity_level = ?")
+            params.append(creativity_level)
+        if start_date:
+            clauses.append("timestamp >= ?")
+            params.append(start_date.isoformat())
+        if end_date:
+            clauses.append("timestamp < ?")
+            params.append((end_date + timedelta(days=1)).isoformat())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def query(self, limit=None, offset=0, **filters):
+        """Newest-first page of entries matching the metadata/date filters."""
+        where, params = self._where(**filters)
+        sql = f"SELECT {_COLUMNS} FROM history{where} ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self._read_lock:
+            return self._read_conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def get(self, entry_id):
+        with self._read_lock:
+            row = self._read_conn.execute(f"SELECT {_COLUMNS} FROM history WHERE id = ?", (entry_id,)).fetchone()
+        return _row_to_entry(row) if row else None
+
+    def get_many(self, entry_ids):
+        """Fetch entries by id, returned in the order the ids were given."""
+        found = {}
+        ids = list(entry_ids)
+        with self._read_lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._read_conn.execute(
+                    f"SELECT {_COLUMNS} FROM history WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = _row_to_entry(row)
+        return [found[i] for i in ids if i in found]
+
+    def filter_ids(self, entry_ids, **filters):
+        """Keep only the ids whose entries match the metadata/date filters (order preserved)."""
+        where, params = self._where(**filters)
+        where = where.replace(" WHERE ", " AND ", 1)
+        ids = list(entry_ids)
+        keep = set()
+        with self._read_lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._read_conn.execute(
+                    f"SELECT id FROM history WHERE id IN ({', '.join('?' * len(chunk))}){where}", chunk + params
+                ).fetchall()
+                keep.update(row[0] for row in rows)
+        return [i for i in ids if i in keep]
+
+    def iter_search_fields(self, batch_size=5000):
+        """Yield (id, user_idea, generated_prompt) for every entry, for building a search index."""
+        last_id = 0
+        while True:
+            with self._read_lock:
+                rows = self._read_conn.execute(
+                    "SELECT id, user_idea, generated_prompt FROM history WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def id_at(self, index):
+        """Id of the entry at a newest-first position (for index-based callers)."""
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT id FROM history ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?", (index,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def distinct(self, column):
+        """Distinct non-empty values of an indexed metadata column."""
+        if column not in ("service", "model", "creativity_level"):
+            raise ValueError(f"Not a metadata column: {column}")
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                f"SELECT DISTINCT {column} FROM history WHERE {column} != '' ORDER BY {column}"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._read_lock:
+            self._read_conn.close()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,140 @@
+"""
+Shared HTTP client layer for the Ollama / LM Studio APIs.
+
+Both the desktop app (backend.py) and the ComfyUI nodes (nodes.py) route
+their HTTP traffic through here. One keep-alive requests.Session is kept per
+endpoint (scheme://host:port), each with its own connection pool, so repeated
+generations against the same server reuse TCP connections instead of paying
+a fresh handshake on every prompt.
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+    HTTPAdapter = None
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5 # Seconds - a local server that does not accept within this is down
+DEFAULT_TIMEOUT = 120       # Seconds between bytes (read timeout) - chat completions can be slow on big models
+DEFAULT_DEADLINE = 300      # Seconds - total budget for one generation, retries and failover included
+MODEL_LIST_TIMEOUT = 5      # Seconds - listing models should be near-instant
+
+_config = {
+    "pool_size": int(os.environ.get("WAN_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)),
+    "connect_timeout": float(os.environ.get("WAN_HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+    "timeout": float(os.environ.get("WAN_HTTP_TIMEOUT", DEFAULT_TIMEOUT)),
+    "deadline": float(os.environ.get("WAN_HTTP_DEADLINE", DEFAULT_DEADLINE)),
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def configure(pool_size=None, timeout=None, connect_timeout=None, deadline=None):
+    """
+    Adjust pool size, default read/connect timeouts and the total deadline.
+    Changing the pool size drops existing sessions so new pools pick it up.
+    """
+    with _sessions_lock:
+        if pool_size is not None and int(pool_size) != _config["pool_size"]:
+            _config["pool_size"] = int(pool_size)
+            for session in _sessions.values():
+                session.close()
+            _sessions.clear()
+        if timeout is not None:
+            _config["timeout"] = float(timeout)
+        if connect_timeout is not None:
+            _config["connect_timeout"] = float(connect_timeout)
+        if deadline is not None:
+            _config["deadline"] = float(deadline)
+
+
+def deadline():
+    """Total seconds allowed for one generation, retries and failover included."""
+    return _config["deadline"]
+
+
+def read_timeout():
+    """Default seconds to wait between bytes of a response."""
+    return _config["timeout"]
+
+
+def connect_timeout():
+    """Default seconds to wait for a connection to be accepted."""
+    return _config["connect_timeout"]
+
+
+def pool_size():
+    """Keep-alive connections kept per endpoint."""
+    return _config["pool_size"]
+
+
+def is_available():
+    """True if the 'requests' package is installed."""
+    return requests is not None
+
+
+def endpoint_key(url):
+    """Normalize a URL to its endpoint (scheme://host:port) used to pick a pool."""
+    parts = urlsplit(url)
+    return f"{parts.scheme or 'http'}://{parts.netloc}".lower()
+
+
+def get_session(url):
+    """Return the pooled keep-alive session for the endpoint serving `url`."""
+    if requests is None:
+        raise ImportError("'requests' package not installed. Run: pip install requests")
+
+    key = endpoint_key(url)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            pool_size = _config["pool_size"]
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Connection": "keep-alive"})
+            _sessions[key] = session
+        return session
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send a request through the endpoint's pooled session.
+    timeout may be a number or a (connect, read) pair; by default connects
+    give up after connect_timeout and reads after timeout.
+    """
+    if timeout is None:
+        timeout = (_config["connect_timeout"], _config["timeout"])
+    return get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+
+def get(url, timeout=None, **kwargs):
+    return request("GET", url, timeout=timeout, **kwargs)
+
+
+def post(url, timeout=None, **kwargs):
+    return request("POST", url, timeout=timeout, **kwargs)
+
+
+def close_all():
+    """Close every pooled session (e.g. on application shutdown)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
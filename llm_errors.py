@@ -0,0 +1,139 @@
+"""
+Typed errors for LLM backend calls.
+
+backend / async_backend raise these instead of returning "API Error: ..."
+strings, so callers can tell a failure from a prompt (and never save one as
+the other). Every error carries the URL it concerns; str(error) is a message
+suitable for showing to the user.
+"""
+
+
+class LLMError(Exception):
+    """Base class for every LLM backend failure."""
+
+    def __init__(self, message, url=None):
+        super().__init__(message)
+        self.url = url
+
+
+class InvalidServiceError(LLMError, ValueError):
+    """The service name is neither 'LM Studio' nor 'Ollama'."""
+
+
+class LLMConnectionError(LLMError):
+    """
+    The server could not be reached, or dropped the connection.
+    phase is "connect" when the request never reached the server (always safe to retry).
+    """
+
+    def __init__(self, message, url=None, phase="connect"):
+        super().__init__(message, url)
+        self.phase = phase
+
+
+class LLMTimeoutError(LLMError):
+    """A connect, read, total-deadline or queue-wait timeout (phase: "connect" / "read" / "total" / "queue")."""
+
+    def __init__(self, message, url=None, phase="read"):
+        super().__init__(message, url)
+        self.phase = phase
+
+
+class LLMResponseError(LLMError):
+    """The server answered with an error status or a response we could not parse."""
+
+    def __init__(self, message, url=None, status=None, body=None):
+        super().__init__(message, url)
+        self.status = status
+        self.body = body
+
+
+class QueueTimeoutError(LLMTimeoutError):
+    """The call waited too long for a free slot in its backend's queue (see scheduler.py) and was never sent."""
+
+    def __init__(self, service, waited, queued):
+        super().__init__(f"The {service} server is busy: waited {waited:.0f}s behind {queued} other request(s).",
+                         phase="queue")
+        self.service = service
+        self.waited = waited
+
+
+class CircuitOpenError(LLMError):
+    """Fast failure: the endpoint's circuit breaker is open after repeated failures."""
+
+    def __init__(self, url, retry_after):
+        super().__init__(f"The server at {url} keeps failing; skipping it for another {retry_after:.0f}s.", url)
+        self.retry_after = retry_after
+
+
+class StreamInterruptedError(LLMConnectionError):
+    """A streaming response broke off after some tokens had already arrived (never retried)."""
+
+    def __init__(self, message, url=None):
+        super().__init__(message, url, phase="read")
+
+
+class CassetteMissError(LLMError):
+    """Replay mode: the request is not on the cassette, and replay never touches the network."""
+
+    def __init__(self, cassette_path, model):
+        super().__init__(f"No recorded response for this {model} request in cassette {cassette_path}. "
+                         f"Record it first (WAN_CASSETTE_MODE=auto or record).")
+        self.cassette_path = cassette_path
+
+
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+
+def is_endpoint_failure(exc):
+    """True if `exc` says the endpoint itself is unhealthy (counts toward its circuit breaker)."""
+    if isinstance(exc, (LLMConnectionError, LLMTimeoutError)):
+        # Running out of the caller's total budget (or queueing) says nothing about the server
+        return getattr(exc, "phase", None) not in ("total", "queue")
+    return isinstance(exc, LLMResponseError) and exc.status is not None and exc.status >= 500
+
+
+def is_retryable(exc, idempotent):
+    """
+    Whether a failed call may be retried. Requests that never reached the
+    server are always safe; anything else only for idempotent calls.
+    """
+    if isinstance(exc, (CircuitOpenError, StreamInterruptedError)):
+        return False
+    if isinstance(exc, (LLMConnectionError, LLMTimeoutError)) and exc.phase == "connect":
+        return True
+    if not idempotent:
+        return False
+    if isinstance(exc, LLMResponseError):
+        return exc.status in RETRYABLE_STATUSES
+    return isinstance(exc, (LLMConnectionError, LLMTimeoutError)) and exc.phase not in ("total", "queue")
+
+
+def from_requests_error(exc, url):
+    """Translate a requests exception into the matching LLMError."""
+    import requests
+
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return LLMTimeoutError(f"Timed out connecting to {url}.", url, phase="connect")
+    if isinstance(exc, requests.exceptions.Timeout):
+        return LLMTimeoutError(f"The server at {url} stopped responding (read timeout).", url, phase="read")
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        response = exc.response
+        return LLMResponseError(f"The server at {url} returned {response.status_code}: {response.text[:500]}",
+                                url, status=response.status_code, body=response.text)
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        # A refused/unresolvable connection never sent the request
+        phase = "connect" if _is_connect_failure(exc) else "read"
+        return LLMConnectionError(
+            f"Could not connect to the server at {url}. Please ensure it is running and the URL is correct.\n\nDetails: {exc}",
+            url, phase=phase,
+        )
+    return LLMConnectionError(f"Request to {url} failed: {exc}", url, phase="read")
+
+
+def _is_connect_failure(exc):
+    text = str(exc)
+    return any(marker in text for marker in (
+        "NewConnectionError", "Failed to establish a new connection", "Name or service not known",
+        "nodename nor servname", "getaddrinfo failed", "Connection refused",
+    ))
@@ -0,0 +1,424 @@
+"""
+Metrics for LLM calls, per service and model.
+
+Records request, error, cache hit and coalesced-call counts, latency / time-to-first-token / model-load
+histograms, and prompt + completion token throughput. Per service, it also
+records the request queue (scheduler.py): time spent waiting for a slot,
+queue depth and calls in flight. Ollama reports the
+token counts and durations itself (prompt_eval_count, eval_duration, ...);
+OpenAI-style servers (LM Studio) only report token counts under "usage".
+
+The registry can be exported as:
+- a Prometheus textfile (for node_exporter's textfile collector)
+- a JSON snapshot (averages and percentiles of recent calls)
+
+Once an export directory is set (set_export_dir, or WAN_METRICS_DIR), both
+files are rewritten at most every EXPORT_INTERVAL seconds while calls are
+recorded, and once more at interpreter exit.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+LOAD_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RECENT_SAMPLES = 1024        # Latencies kept per series for the JSON percentiles
+EXPORT_INTERVAL = 1.0        # Seconds between automatic file exports
+PROMETHEUS_FILE = "llm_metrics.prom"
+JSON_FILE = "llm_metrics.json"
+PREFIX = "wan_llm"
+
+NS = 1e9  # Ollama durations are in nanoseconds
+
+
+def service_label(service):
+    """One label per service whatever the caller calls it ("LM Studio" / "lmstudio")."""
+    return str(service).lower().replace(" ", "")
+
+
+def response_stats(data):
+    """
+    Token counts and durations from a chat response (or a stream's final chunk).
+    Returns a dict with any of prompt_tokens, prompt_seconds, completion_tokens,
+    completion_seconds, load_seconds.
+    """
+    stats = {}
+    if not isinstance(data, dict):
+        return stats
+    if "eval_count" in data or "prompt_eval_count" in data:
+        # Ollama
+        for key, field, scale in (("prompt_tokens", "prompt_eval_count", 1),
+                                  ("prompt_seconds", "prompt_eval_duration", NS),
+                                  ("completion_tokens", "eval_count", 1),
+                                  ("completion_seconds", "eval_duration", NS),
+                                  ("load_seconds", "load_duration", NS)):
+            if data.get(field) is not None:
+                stats[key] = data[field] / scale if scale != 1 else data[field]
+    elif isinstance(data.get("usage"), dict):
+        # OpenAI-compatible (LM Studio)
+        usage = data["usage"]
+        if usage.get("prompt_tokens") is not None:
+            stats["prompt_tokens"] = usage["prompt_tokens"]
+        if usage.get("completion_tokens") is not None:
+            stats["completion_tokens"] = usage["completion_tokens"]
+    return stats
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return round(sorted_values[min(rank, len(sorted_values)) - 1], 6)
+
+
+def _rate(tokens, seconds):
+    return round(tokens / seconds, 2) if seconds else None
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) plus a window of recent samples."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else None,
+            "p50": _percentile(recent, 50),
+            "p90": _percentile(recent, 90),
+            "p99": _percentile(recent, 99),
+            "max": round(recent[-1], 6) if recent else None,
+        }
+
+
+class Series:
+    """Everything recorded for one (service, model) pair."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = {}  # error type -> count
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.ttft = Histogram(TTFT_BUCKETS)
+        self.load = Histogram(LOAD_BUCKETS)
+        self.prompt_tokens = 0
+        self.prompt_seconds = 0.0
+        self.completion_tokens = 0
+        self.completion_seconds = 0.0
+        # Tokens of the calls that also reported a duration (the only ones a rate can use)
+        self.timed_prompt_tokens = 0
+        self.timed_completion_tokens = 0
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "errors": dict(self.errors),
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "latency_seconds": self.latency.summary(),
+            "time_to_first_token_seconds": self.ttft.summary(),
+            "model_load_seconds": self.load.summary(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "prompt_tokens_per_second": _rate(self.timed_prompt_tokens, self.prompt_seconds),
+            "completion_tokens_per_second": _rate(self.timed_completion_tokens, self.completion_seconds),
+        }
+
+
+class QueueSeries:
+    """The request queue of one service."""
+
+    def __init__(self):
+        self.wait = Histogram(QUEUE_WAIT_BUCKETS)
+        self.waits_by_priority = {}  # priority name -> calls admitted
+        self.depth = 0
+        self.in_flight = 0
+        self.limit = 0
+
+    def snapshot(self):
+        return {
+            "wait_seconds": self.wait.summary(),
+            "admitted_by_priority": dict(self.waits_by_priority),
+            "depth": self.depth,
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe store of per-(service, model) LLM call metrics."""
+
+    def __init__(self):
+        self._series = {}
+        self._queues = {}  # service label -> QueueSeries
+        self._lock = threading.Lock()
+        self._export_dir = None
+        self._last_export = 0.0
+        self._dirty = False
+
+    def _get(self, service, model):
+        key = (service_label(service), model or "")
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = Series()
+        return series
+
+    def record(self, service, model, latency, error=None, ttft=None, prompt_tokens=None, prompt_seconds=None,
+               completion_tokens=None, completion_seconds=None, load_seconds=None):
+        """
+        Record one finished LLM call. `error` is the exception (or its type name)
+        if it failed. Returns this call's stats as a dict (e.g. for a node's output).
+        """
+        call = {"service": service_label(service), "model": model, "latency_seconds": round(latency, 4)}
+        with self._lock:
+            series = self._get(service, model)
+            series.requests += 1
+            series.latency.observe(latency)
+            if error is not None:
+                error_type = error if isinstance(error, str) else type(error).__name__
+                series.errors[error_type] = series.errors.get(error_type, 0) + 1
+                call["error"] = error_type
+            if ttft is not None:
+                series.ttft.observe(ttft)
+                call["time_to_first_token_seconds"] = round(ttft, 4)
+            if load_seconds is not None:
+                series.load.observe(load_seconds)
+                call["model_load_seconds"] = round(load_seconds, 4)
+            if prompt_tokens is not None:
+                series.prompt_tokens += prompt_tokens
+                call["prompt_tokens"] = prompt_tokens
+                # Throughput only counts calls that report both tokens and time
+                if prompt_seconds:
+                    series.prompt_seconds += prompt_seconds
+                    series.timed_prompt_tokens += prompt_tokens
+                    call["prompt_tokens_per_second"] = _rate(prompt_tokens, prompt_seconds)
+            if completion_tokens is not None:
+                series.completion_tokens += completion_tokens
+                call["completion_tokens"] = completion_tokens
+                if completion_seconds:
+                    series.completion_seconds += completion_seconds
+                    series.timed_completion_tokens += completion_tokens
+                    call["completion_tokens_per_second"] = _rate(completion_tokens, completion_seconds)
+            self._dirty = True
+        self._maybe_export()
+        return call
+
+    def record_cache_hit(self, service, model):
+        with self._lock:
+            self._get(service, model).cache_hits += 1
+            self._dirty = True
+        self._maybe_export()
+
+    def record_coalesced(self, service, model):
+        """Record a call answered by an identical call already in flight (singleflight.py)."""
+        with self._lock:
+            self._get(service, model).coalesced += 1
+            self._dirty = True
+        self._maybe_export()
+
+    def _get_queue(self, service):
+        label = service_label(service)
+        queue = self._queues.get(label)
+        if queue is None:
+            queue = self._queues[label] = QueueSeries()
+        return queue
+
+    def record_queue_wait(self, service, seconds, priority):
+        """Record the time one call waited in `service`'s queue before it was sent."""
+        with self._lock:
+            queue = self._get_queue(service)
+            queue.wait.observe(seconds)
+            queue.waits_by_priority[priority] = queue.waits_by_priority.get(priority, 0) + 1
+            self._dirty = True
+        self._maybe_export()
+
+    def set_queue_state(self, service, depth, in_flight, limit):
+        """Current queue depth, calls in flight and in-flight limit of `service`."""
+        with self._lock:
+            queue = self._get_queue(service)
+            queue.depth, queue.in_flight, queue.limit = depth, in_flight, limit
+            self._dirty = True
+        self._maybe_export()
+
+    def snapshot(self, service=None, model=None):
+        """JSON-ready view of every series (or only those matching service / model)."""
+        with self._lock:
+            series = [
+                {"service": key[0], "model": key[1], **s.snapshot()}
+                for key, s in sorted(self._series.items())
+                if (service is None or key[0] == service_label(service)) and (model is None or key[1] == model)
+            ]
+            queues = [
+                {"service": label, **q.snapshot()}
+                for label, q in sorted(self._queues.items())
+                if service is None or label == service_label(service)
+            ]
+        return {"generated_at": time.time(), "series": series, "queues": queues}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        with self._lock:
+            items = sorted(self._series.items())
+
+            def labels(key, **extra):
+                pairs = {"service": key[0], "model": key[1], **extra}
+                return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + "}"
+
+            for name, help_text, attr in (
+                ("requests_total", "LLM calls made.", "requests"),
+                ("cache_hits_total", "LLM calls answered from the response cache.", "cache_hits"),
+                ("coalesced_total", "LLM calls that shared the response of an identical call in flight.", "coalesced"),
+                ("prompt_tokens_total", "Prompt tokens processed.", "prompt_tokens"),
+                ("prompt_eval_seconds_total", "Seconds spent evaluating prompts (where reported).", "prompt_seconds"),
+                ("completion_tokens_total", "Completion tokens generated.", "completion_tokens"),
+                ("completion_seconds_total", "Seconds spent generating completions (where reported).",
+                 "completion_seconds"),
+            ):
+                header(name, "counter", help_text)
+                for key, series in items:
+                    lines.append(f"{PREFIX}_{name}{labels(key)} {_number(getattr(series, attr))}")
+
+            header("errors_total", "counter", "Failed LLM calls by error type.")
+            for key, series in items:
+                for error_type, count in sorted(series.errors.items()):
+                    lines.append(f"{PREFIX}_errors_total{labels(key, error=error_type)} {count}")
+
+            for name, help_text, attr in (
+                ("request_duration_seconds", "LLM call latency.", "latency"),
+                ("time_to_first_token_seconds", "Time until the first streamed token.", "ttft"),
+                ("model_load_seconds", "Time the server spent loading the model.", "load"),
+            ):
+                header(name, "histogram", help_text)
+                for key, series in items:
+                    histogram = getattr(series, attr)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{PREFIX}_{name}_bucket{labels(key, le=_number(bound))} {count}")
+                    lines.append(f"{PREFIX}_{name}_bucket{labels(key, le='+Inf')} {histogram.count}")
+                    lines.append(f"{PREFIX}_{name}_sum{labels(key)} {_number(histogram.sum)}")
+                    lines.append(f"{PREFIX}_{name}_count{labels(key)} {histogram.count}")
+
+            queues = sorted(self._queues.items())
+
+            def queue_labels(label, **extra):
+                pairs = {"service": label, **extra}
+                return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + "}"
+
+            for name, help_text, attr in (
+                ("queue_depth", "LLM calls waiting for a slot.", "depth"),
+                ("in_flight", "LLM calls being served.", "in_flight"),
+                ("queue_limit", "Maximum LLM calls in flight.", "limit"),
+            ):
+                header(name, "gauge", help_text)
+                for label, queue in queues:
+                    lines.append(f"{PREFIX}_{name}{queue_labels(label)} {getattr(queue, attr)}")
+
+            header("queue_wait_seconds", "histogram", "Time LLM calls waited for a slot before being sent.")
+            for label, queue in queues:
+                histogram = queue.wait
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{PREFIX}_queue_wait_seconds_bucket{queue_labels(label, le=_number(bound))} {count}")
+                lines.append(f"{PREFIX}_queue_wait_seconds_bucket{queue_labels(label, le='+Inf')} {histogram.count}")
+                lines.append(f"{PREFIX}_queue_wait_seconds_sum{queue_labels(label)} {_number(histogram.sum)}")
+                lines.append(f"{PREFIX}_queue_wait_seconds_count{queue_labels(label)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._queues.clear()
+            self._dirty = True
+
+    # --- Export ---
+
+    def set_export_dir(self, path):
+        """Write llm_metrics.prom / llm_metrics.json into `path` as calls are recorded (None: stop)."""
+        with self._lock:
+            self._export_dir = Path(path) if path else None
+
+    def export(self, directory=None):
+        """Write both files now (to `directory`, or the export directory). Returns the paths written."""
+        directory = Path(directory) if directory else self._export_dir
+        if directory is None:
+            return []
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._dirty = False
+            self._last_export = time.monotonic()
+        paths = []
+        for name, text in ((PROMETHEUS_FILE, self.to_prometheus()), (JSON_FILE, self.to_json())):
+            path = directory / name
+            # Atomic replace: a scraper never reads a half-written file
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
+
+    def _maybe_export(self, force=False):
+        with self._lock:
+            due = (self._export_dir is not None and self._dirty
+                   and (force or time.monotonic() - self._last_export >= EXPORT_INTERVAL))
+        if due:
+            try:
+                self.export()
+            except OSError as e:
+                print(f"Error writing LLM metrics: {e}")
+
+    def flush(self):
+        """Export pending changes regardless of EXPORT_INTERVAL."""
+        self._maybe_export(force=True)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry shared by the app backend and the ComfyUI nodes
+REGISTRY = MetricsRegistry()
+record = REGISTRY.record
+record_cache_hit = REGISTRY.record_cache_hit
+record_coalesced = REGISTRY.record_coalesced
+record_queue_wait = REGISTRY.record_queue_wait
+set_queue_state = REGISTRY.set_queue_state
+snapshot = REGISTRY.snapshot
+set_export_dir = REGISTRY.set_export_dir
+if os.environ.get("WAN_METRICS_DIR"):
+    REGISTRY.set_export_dir(os.environ["WAN_METRICS_DIR"])
+atexit.register(REGISTRY.flush)
@@ -0,0 +1,120 @@
+"""
+Stale-while-revalidate model discovery for the ComfyUI nodes.
+
+INPUT_TYPES is called on the UI thread (and while ComfyUI boots), so it must
+never wait on a dead endpoint. The last known model list is served
+immediately; when it is older than the TTL a single background refresh probes
+every backend concurrently and swaps in the new list. The list is persisted
+to disk so a restart starts from what was seen last time.
+
+Each probe reports its own backend. A probe that fails (endpoint down,
+timeout) keeps that backend's previous models instead of wiping them.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_TTL = 30
+
+
+class ModelDiscovery:
+    """Background-refreshed, disk-persisted model list. Thread-safe."""
+
+    def __init__(self, probes, cache_path=None, ttl=DEFAULT_TTL):
+        """
+        probes: mapping of backend name -> callable returning that backend's
+        model labels (raising if the backend cannot be reached).
+        """
+        self.probes = dict(probes)
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = {}       # backend name -> models from its last successful probe
+        self._timestamp = 0
+        self._loaded = False     # True once a list was loaded from disk or probed
+        self._refreshing = None  # threading.Event while a refresh is running
+        self._load()
+
+    # --- Persistence ---
+
+    def _load(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._results = {name: list(models) for name, models in data.get("models", {}).items()}
+            self._timestamp = float(data.get("timestamp", 0))
+            self._loaded = True
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            print(f"Error reading model cache: {e}")
+
+    def _save(self, results, timestamp):
+        if self.cache_path is None:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"timestamp": timestamp, "models": results}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Error writing model cache: {e}")
+
+    # --- Public API ---
+
+    def has_results(self):
+        """True once any list is known (loaded from disk or probed)."""
+        with self._lock:
+            return self._loaded
+
+    def models(self):
+        """Last known models (sorted, de-duplicated); starts a refresh if they are stale."""
+        with self._lock:
+            models = sorted({m for backend in self._results.values() for m in backend})
+            stale = time.time() - self._timestamp >= self.ttl
+        if stale:
+            self.refresh()
+        return models
+
+    def refresh(self, wait=False, timeout=None):
+        """
+        Start a background refresh unless one is already running, and return
+        its completion event. With wait=True, block until it finishes (or timeout).
+        """
+        with self._lock:
+            done = self._refreshing
+            if done is None:
+                done = self._refreshing = threading.Event()
+                threading.Thread(target=self._run, args=(done,), daemon=True, name="model-discovery").start()
+        if wait:
+            done.wait(timeout)
+        return done
+
+    def _run(self, done):
+        try:
+            results = {}
+            with ThreadPoolExecutor(max_workers=max(1, len(self.probes))) as pool:
+                futures = {name: pool.submit(probe) for name, probe in self.probes.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = list(future.result())
+                except Exception:
+                    print(f"  {name}: not running or not accessible")
+
+            with self._lock:
+                self._results.update(results)
+                self._timestamp = time.time()
+                self._loaded = True
+                snapshot = {name: list(models) for name, models in self._results.items()}
+                timestamp = self._timestamp
+            print(f"✅ Found {len({m for models in snapshot.values() for m in models})} models total")
+            self._save(snapshot, timestamp)
+        finally:
+            with self._lock:
+                self._refreshing = None
+            done.set()
@@ -11,8 +11,11 @@ Using locally running LLMs via Ollama or LM Studio HTTP APIs.
 """
 
 import json
+import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -22,11 +25,32 @@ try:
 except ImportError:
     requests = None
 
-# Optional SDK imports (will use HTTP as primary method)
+# Shared pooled HTTP client (relative import when loaded as a ComfyUI package)
 try:
-    import lmstudio as lms
+    from . import http_client
 except ImportError:
-    lms = None
+    import http_client
+
+try:
+    from . import (cassette, endpoint_pool, history_log, metrics, model_discovery, residency, response_cache, scheduler,
+                   search_index, singleflight, tracing)
+except ImportError:
+    import cassette
+    import endpoint_pool
+    import history_log
+    import metrics
+    import model_discovery
+    import residency
+    import response_cache
+    import scheduler
+    import search_index
+    import singleflight
+    import tracing
+
+# Optional LM Studio SDK - imported lazily by get_lms() (HTTP is the primary method)
+_lms = None
+_lms_checked = False
+_lms_lock = threading.Lock()
 
 # ============================================================================
 # CONSTANTS
@@ -62,88 +86,106 @@ CREATIVITY_CONFIGS = {
     }
 }
 
-# History file path
+# History: append-only log directory (legacy JSON file is imported once)
 HISTORY_FILE = Path(__file__).parent / "prompt_history.json"
+HISTORY_LOG_DIR = Path(__file__).parent / "prompt_history"
+HISTORY_MAX_ENTRIES = 1000
+
+# LLM response cache (memory LRU + on-disk tier next to the package)
+LLM_CACHE_DIR = Path(os.environ.get("WAN_LLM_CACHE_DIR", Path(__file__).parent / "llm_cache"))
+_response_cache = response_cache.ResponseCache(LLM_CACHE_DIR)
+
+# LLM call metrics: llm_metrics.prom (Prometheus textfile) + llm_metrics.json, refreshed as calls complete
+METRICS_DIR = Path(os.environ.get("WAN_METRICS_DIR", Path(__file__).parent / "metrics"))
+metrics.set_export_dir(METRICS_DIR)
 
 # ============================================================================
-# MODEL CACHE
+# MODEL DISCOVERY
 # ============================================================================
 
-_model_cache = {"models": [], "timestamp": 0}
+# Last known model list, served immediately and refreshed in the background
+MODEL_CACHE_FILE = Path(__file__).parent / "model_cache.json"
 _CACHE_TTL = 30
+# Only when no list is known at all (first run) does INPUT_TYPES wait, and only this long
+MODEL_COLD_START_WAIT = 3
 
-def fetch_available_models(force_refresh=False):
-    """Fetch available models from LM Studio and Ollama using HTTP APIs."""
-    global _model_cache
-    
-    if not requests:
-        return ["Manual Entry Required (install 'requests' package)"]
-    
-    current_time = time.time()
-    if not force_refresh and _model_cache["models"] and (current_time - _model_cache["timestamp"]) < _CACHE_TTL:
-        return _model_cache["models"]
-    
-    print("🔄 Refreshing model list...")
+def get_lms():
+    """Import the optional LM Studio SDK on first use; None if it is not installed."""
+    global _lms, _lms_checked
+    with _lms_lock:
+        if not _lms_checked:
+            try:
+                import lmstudio
+                _lms = lmstudio
+            except ImportError:
+                _lms = None
+            _lms_checked = True
+    return _lms
+
+def _probe_lmstudio():
+    """LM Studio models: downloaded models via the SDK, else loaded models via HTTP."""
     models = []
-    
-    # --- LM Studio (SDK for downloaded models) ---
-    lmstudio_found = 0
+    lms = get_lms()
     if lms:
         try:
-            downloaded = lms.list_downloaded_models("llm")
-            for m in downloaded:
+            for m in lms.list_downloaded_models("llm"):
                 model_key = getattr(m, 'model_key', None) or getattr(m, 'display_name', None) or str(m)
                 if model_key:
                     models.append(f"[LM Studio] {model_key}")
-                    lmstudio_found += 1
-            print(f"  LM Studio SDK: found {lmstudio_found} downloaded models")
+            print(f"  LM Studio SDK: found {len(models)} downloaded models")
         except Exception as e:
             print(f"  LM Studio SDK error: {e}")
     
-    # Fallback: LM Studio HTTP API (loaded models)
-    if lmstudio_found == 0:
-        try:
-            resp = requests.get(f"{LMSTUDIO_BASE_URL}/models", timeout=2)
-            if resp.status_code == 200:
-                data = resp.json()
-                for m in data.get('data', []):
-                    model_id = m.get('id', '')
-                    if model_id:
-                        models.append(f"[LM Studio] {model_id}")
-                        lmstudio_found += 1
-                if lmstudio_found > 0:
-                    print(f"  LM Studio HTTP: found {lmstudio_found} loaded models")
-        except:
-            print("  LM Studio: not running or not accessible")
-    
-    # --- Ollama (HTTP API - like web app) ---
-    ollama_found = 0
-    try:
-        resp = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=2)
-        if resp.status_code == 200:
-            data = resp.json()
-            for m in data.get('models', []):
-                name = m.get('name', '')
-                if name:
-                    models.append(f"[Ollama] {name}")
-                    ollama_found += 1
-            print(f"  Ollama HTTP: found {ollama_found} models")
-    except:
-        print("  Ollama: not running or not accessible")
-    
     if not models:
-        print("⚠️  No models found. Make sure Ollama or LM Studio is running.")
-        models = ["No models found - start Ollama or LM Studio"]
-    else:
-        models = sorted(list(set(models)))
+        resp = http_client.get(f"{LMSTUDIO_BASE_URL}/models", timeout=2)
+        resp.raise_for_status()
+        for m in resp.json().get('data', []):
+            model_id = m.get('id', '')
+            if model_id:
+                models.append(f"[LM Studio] {model_id}")
+        print(f"  LM Studio HTTP: found {len(models)} loaded models")
+    return models
+
+def _probe_ollama():
+    # Union of every Ollama endpoint in the pool (doubles as their health check)
+    pool = endpoint_pool.get_pool(endpoint_pool.OLLAMA, OLLAMA_BASE_URL)
+    models = [f"[Ollama] {name}" for name in pool.check_all()]
+    print(f"  Ollama HTTP: found {len(models)} models")
+    return models
+
+_model_discovery = model_discovery.ModelDiscovery(
+    {"LM Studio": _probe_lmstudio, "Ollama": _probe_ollama},
+    cache_path=MODEL_CACHE_FILE,
+    ttl=_CACHE_TTL,
+)
+
+@tracing.traced("fetch_available_models")
+def fetch_available_models(force_refresh=False):
+    """
+    Available models from LM Studio and Ollama.
+    Returns the last known list without blocking; a stale list is refreshed in
+    the background (all backends probed concurrently). force_refresh waits for
+    a fresh probe.
+    """
+    if not requests:
+        return ["Manual Entry Required (install 'requests' package)"]
     
-    _model_cache["models"] = models
-    _model_cache["timestamp"] = current_time
+    if force_refresh:
+        _model_discovery.refresh(wait=True)
+    elif not _model_discovery.has_results():
+        _model_discovery.refresh(wait=True, timeout=MODEL_COLD_START_WAIT)
     
-    print(f"✅ Found {len(models)} models total")
+    models = _model_discovery.models()
+    if not models:
+        return ["No models found - start Ollama or LM Studio"]
     return models
 
+# Start probing while ComfyUI finishes loading, so the first INPUT_TYPES call finds a fresh list
+if requests:
+    _model_discovery.refresh()
+
 
+@tracing.traced("parse_model_selection")
 def parse_model_selection(model_select):
     """Parse model selection and return (service, model_name, base_url)."""
     if model_select.startswith("[LM Studio]"):
@@ -157,13 +199,88 @@ def parse_model_selection(model_select):
         return "lmstudio", model_select, LMSTUDIO_BASE_URL
 
 
-def call_llm(service, model_name, system_prompt, user_prompt, temperature, max_tokens=500, unload_after=False):
+def call_llm(service, model_name, system_prompt, user_prompt, temperature, max_tokens=500, unload_after=False, seed=None,
+             stats=None, priority=None):
     """
     Call LLM using appropriate method:
     - LM Studio: SDK (lmstudio package)
     - Ollama: HTTP API (like the web app)
     
     If unload_after=True, unloads model from GPU after generation.
+    If a seed is given the request is deterministic, so the response is served
+    from / stored in the response cache.
+    If `stats` is a dict it is filled with this call's metrics (latency, tokens/sec, ...).
+    With a cassette active (see cassette.py) calls are recorded / replayed.
+    Identical calls already in flight are joined instead of sent again (see singleflight.py).
+    Requests wait for a free slot in the backend's queue (see scheduler.py) at
+    `priority` (default: the calling thread's, scheduler.priority()).
+    """
+    if priority is not None:
+        with scheduler.priority(priority):
+            return call_llm(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed, stats)
+    # The same request to another server is a different call
+    endpoint = OLLAMA_BASE_URL if service == "ollama" else LMSTUDIO_BASE_URL
+    key = (endpoint, response_cache.make_key(service, model_name, system_prompt, user_prompt, temperature, max_tokens, seed))
+    result, shared = singleflight.do(key, lambda: cassette.call(
+        lambda: _cached_call(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed, stats),
+        service, model_name, system_prompt, user_prompt, temperature, max_tokens, seed, stats,
+    ))
+    if shared:
+        print(f"⚡ Joined an identical request to {model_name} already in flight")
+        metrics.record_coalesced(service, model_name)
+        if stats is not None:
+            stats.update({"service": service, "model": model_name, "coalesced": True})
+    return result
+
+
+def _cached_call(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed, stats):
+    """call_llm behind the cassette: the response cache (seeded requests only), then the backend."""
+    if seed is None:
+        return _measured_call(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed, stats)
+    
+    cache_key = response_cache.make_key(service, model_name, system_prompt, user_prompt, temperature, max_tokens, seed)
+    with tracing.span("response_cache.get") as s:
+        cached = _response_cache.get(cache_key)
+        s.set(hit=cached is not None)
+    if cached is not None:
+        print(f"⚡ Using cached response for {model_name} (seed {seed})")
+        metrics.record_cache_hit(service, model_name)
+        if stats is not None:
+            stats.update({"service": service, "model": model_name, "cached": True})
+        return cached
+    
+    result = _measured_call(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed, stats)
+    if result:
+        with tracing.span("response_cache.put"):
+            _response_cache.put(cache_key, result)
+    return result
+
+
+def _measured_call(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed, stats):
+    """_call_llm_backend in a slot of the backend's queue, recorded in the metrics registry."""
+    endpoints = 1
+    if service == "ollama":
+        endpoints = len(endpoint_pool.get_pool(endpoint_pool.OLLAMA, OLLAMA_BASE_URL).endpoints)
+    with scheduler.slot(service, endpoints, timeout=http_client.deadline()) as waited:
+        start = time.perf_counter()
+        try:
+            with tracing.span("call_llm", service=service, model=model_name):
+                result, server_stats = _call_llm_backend(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed)
+        except Exception as e:
+            # The backend wraps errors in a generic Exception; the original type is more useful
+            metrics.record(service, model_name, time.perf_counter() - start, error=e.__context__ or e)
+            raise
+    call = metrics.record(service, model_name, time.perf_counter() - start, **server_stats)
+    call["queue_wait_seconds"] = round(waited, 4)
+    if stats is not None:
+        stats.update(call)
+    return result
+
+
+def _call_llm_backend(service, model_name, system_prompt, user_prompt, temperature, max_tokens, unload_after, seed):
+    """
+    Send the request to the backend (no caching).
+    Returns (text, stats) where stats holds the token counts / timings the server reported.
     """
     
     if service == "ollama":
@@ -171,7 +288,6 @@ def call_llm(service, model_name, system_prompt, user_prompt, temperature, max_t
         if not requests:
             raise ImportError("'requests' package not installed. Run: pip install requests")
         
-        url = f"{OLLAMA_BASE_URL}/api/chat"
         payload = {
             "model": model_name,
             "messages": [
@@ -180,64 +296,182 @@ def call_llm(service, model_name, system_prompt, user_prompt, temperature, max_t
             ],
             "stream": False,
             "options": {"temperature": temperature},
-            "keep_alive": 0 if unload_after else "5m"  # 0 = unload immediately, "5m" = keep for 5 minutes
         }
+        if seed is not None:
+            # Ollama expects a signed 64-bit int; ComfyUI seeds go up to 2**64 - 1
+            payload["options"]["seed"] = seed & 0x7FFFFFFFFFFFFFFF
+        
+        def send(endpoint_url):
+            # Configured connect / read timeouts (WAN_HTTP_CONNECT_TIMEOUT, WAN_HTTP_TIMEOUT)
+            resp = http_client.post(f"{endpoint_url}/api/chat", json=payload)
+            resp.raise_for_status()
+            return resp
         
+        manager = _residency("ollama")
+        resident_name = _ollama_model_name(model_name)
+        cold = not manager.is_loaded(resident_name)
         try:
-            resp = requests.post(url, json=payload, timeout=120)
-            if resp.status_code != 200:
-                raise Exception(f"Ollama API error: {resp.status_code} {resp.text}")
-            data = resp.json()
-            result = data.get('message', {}).get('content', '').strip()
+            # Least busy Ollama endpoint that has the model; fails over to the others
+            pool = endpoint_pool.get_pool(endpoint_pool.OLLAMA, OLLAMA_BASE_URL)
+            # Unloads least recently used models first if this one needs the room
+            with manager.use(resident_name, unload_after) as keep_alive:
+                payload["keep_alive"] = keep_alive  # 0 = unload immediately
+                with tracing.span("http", cat="io", service="ollama") as s:
+                    resp = pool.call(model_name, send)
+                    s.set(status=resp.status_code, bytes=len(resp.content))
+            if cold and not unload_after:
+                # Learn its size in VRAM (and what else is loaded) now that it is loaded
+                sync_ollama_residency()
+            with tracing.span("parse_response"):
+                data = resp.json()
+                result = data.get('message', {}).get('content', '').strip()
             
             if unload_after:
                 print(f"✅ Ollama model {model_name} will unload from GPU (keep_alive=0)")
             
-            return result
+            server_stats = metrics.response_stats(data)
+            if "prompt_seconds" in server_stats:
+                # Not streamed: the first token was ready once the model was loaded and the prompt evaluated
+                server_stats["ttft"] = server_stats.get("load_seconds", 0) + server_stats["prompt_seconds"]
+            return result, server_stats
         except requests.exceptions.ConnectionError:
             raise Exception(f"Cannot connect to Ollama at {OLLAMA_BASE_URL}. Make sure Ollama is running.")
+        except requests.exceptions.HTTPError as e:
+            raise Exception(f"Ollama API error: {e.response.status_code} {e.response.text}")
         except Exception as e:
             raise Exception(f"Ollama error: {e}")
     
     elif service == "lmstudio":
         # LM Studio: Use SDK
+        lms = get_lms()
         if not lms:
             raise ImportError("LM Studio SDK not installed. Run: pip install lmstudio")
         
+        manager = _residency("lmstudio")
         model = None
         try:
-            # Get model (uses any loaded model if model_name not specific)
-            model = lms.llm(model_name) if model_name else lms.llm()
-            
-            # Create chat with system prompt
-            chat = lms.Chat(system_prompt)
-            chat.add_user_message(user_prompt)
-            
-            # Generate response with config
-            config = lms.LlmPredictionConfig(
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            result = model.respond(chat, config=config)
-            content = result.content.strip()
-            
-            # Unload model if requested
-            if unload_after and model:
-                try:
-                    model.unload()
-                    print(f"✅ LM Studio model {model_name} unloaded from GPU")
-                except Exception as unload_err:
-                    print(f"⚠️ Could not unload LM Studio model: {unload_err}")
+            with manager.use(model_name, unload_after):
+                # Model handle, cached between calls (uses any loaded model if model_name not specific)
+                model, cold = manager.handle(model_name, lambda: lms.llm(model_name) if model_name else lms.llm())
+                if cold:
+                    manager.set_size(model_name, _lms_size(model))
+                
+                # Create chat with system prompt
+                chat = lms.Chat(system_prompt)
+                chat.add_user_message(user_prompt)
+                
+                # Generate response with config
+                config = lms.LlmPredictionConfig(
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+                with tracing.span("lmstudio.respond", cat="io"):
+                    result = model.respond(chat, config=config)
+                content = result.content.strip()
+                server_stats = _lms_stats(result)
+                
+                # Unload model if requested
+                if unload_after and model:
+                    try:
+                        model.unload()
+                        print(f"✅ LM Studio model {model_name} unloaded from GPU")
+                    except Exception as unload_err:
+                        print(f"⚠️ Could not unload LM Studio model: {unload_err}")
             
-            return content
+            return content, server_stats
             
         except Exception as e:
+            # The cached handle may be stale (model unloaded in LM Studio); resolve it again next time
+            manager.forget(model_name)
             raise Exception(f"LM Studio SDK error: {e}")
     
     else:
         raise ValueError(f"Unknown service: {service}")
 
 
+def _residency(service):
+    """The residency manager (see residency.py) of a service."""
+    return residency.get_manager(service, lambda model_name, handle: unload_model_now(service, model_name, handle))
+
+
+def _ollama_model_name(model_name):
+    """Ollama's full name for a model ("llama3" -> "llama3:latest"), as /api/ps reports it."""
+    return model_name if ":" in model_name else f"{model_name}:latest"
+
+
+def sync_ollama_residency():
+    """Update the Ollama residency manager with the models (and VRAM sizes) every endpoint reports in /api/ps."""
+    loaded = {}
+    for endpoint in endpoint_pool.get_pool(endpoint_pool.OLLAMA, OLLAMA_BASE_URL).endpoints:
+        try:
+            resp = http_client.get(f"{endpoint.url}/api/ps", timeout=http_client.MODEL_LIST_TIMEOUT)
+            resp.raise_for_status()
+            for m in resp.json().get("models", []):
+                name = m.get("name") or m.get("model")
+                size = m.get("size_vram") or m.get("size") or 0
+                if name:
+                    loaded[name] = max(loaded.get(name) or 0, size) or None
+        except Exception as e:
+            # A partial view would make the manager forget models that are still loaded
+            print(f"⚠️ Could not list loaded Ollama models at {endpoint.url}: {e}")
+            return
+    _residency("ollama").sync(loaded)
+
+
+def _lms_size(model):
+    """VRAM size in bytes of an LM Studio model handle, if the SDK reports it (fields vary by SDK version)."""
+    try:
+        return getattr(model.get_info(), "size_bytes", None)
+    except Exception:
+        return None
+
+
+def unload_model_now(service, model_name, handle=None):
+    """
+    Free a model's GPU memory now (Ollama: an empty request with keep_alive=0;
+    LM Studio: SDK unload, through `handle` or the cached one if there is one).
+    """
+    cached = _residency(service).forget(_ollama_model_name(model_name) if service == "ollama" else model_name)
+    handle = handle or cached
+    if service == "ollama":
+        # Any endpoint of the pool may have served it
+        for endpoint in endpoint_pool.get_pool(endpoint_pool.OLLAMA, OLLAMA_BASE_URL).endpoints:
+            try:
+                http_client.post(f"{endpoint.url}/api/generate", json={"model": model_name, "keep_alive": 0},
+                                 timeout=http_client.MODEL_LIST_TIMEOUT).raise_for_status()
+                print(f"✅ Ollama model {model_name} unloaded from GPU at {endpoint.url}")
+            except Exception as e:
+                print(f"⚠️ Could not unload Ollama model {model_name} at {endpoint.url}: {e}")
+    elif service == "lmstudio":
+        lms = get_lms()
+        if lms:
+            try:
+                (handle or lms.llm(model_name)).unload()
+                print(f"✅ LM Studio model {model_name} unloaded from GPU")
+            except Exception as e:
+                print(f"⚠️ Could not unload LM Studio model: {e}")
+
+
+def _lms_stats(result):
+    """Token counts / timings from an LM Studio SDK prediction result (fields vary by SDK version)."""
+    prediction = getattr(result, "stats", None)
+    stats = {}
+    prompt_tokens = getattr(prediction, "prompt_tokens_count", None)
+    completion_tokens = getattr(prediction, "predicted_tokens_count", None)
+    tokens_per_second = getattr(prediction, "tokens_per_second", None)
+    ttft = getattr(prediction, "time_to_first_token_sec", None)
+    if prompt_tokens is not None:
+        stats["prompt_tokens"] = prompt_tokens
+    if completion_tokens is not None:
+        stats["completion_tokens"] = completion_tokens
+        if tokens_per_second:
+            stats["completion_seconds"] = completion_tokens / tokens_per_second
+    if ttft is not None:
+        stats["ttft"] = ttft
+    return stats
+
+
+@tracing.traced("build_system_prompt")
 def build_system_prompt(target_model, creativity_mode):
     """Build the system prompt based on target model and creativity mode."""
     base_prompt = VIDEO_MODEL_PROMPTS.get(target_model, VIDEO_MODEL_PROMPTS['flux'])
@@ -245,35 +479,105 @@ def build_system_prompt(target_model, creativity_mode):
     return f"{base_prompt} {creativity['suffix']}"
 
 
+@tracing.traced("parse_ideas")
+def parse_ideas(generated_text, count=5):
+    """Pick the numbered ideas ("1." / "1)") out of an InspireMeNode response."""
+    ideas = [""] * count
+    lines = [l.strip() for l in generated_text.split('\n') if l.strip()]
+    for line in lines:
+        for i in range(1, count + 1):
+            if line.startswith(f'{i}.') or line.startswith(f'{i})'):
+                ideas[i-1] = line[2:].strip()
+                break
+    return ideas
+
+
+@tracing.traced("parse_segments")
+def parse_segments(generated_text, count=6):
+    """Split a VideoSequenceNode response into its "SEGMENT n:" (or "n.") prompts."""
+    segments = [""] * count
+    for i in range(1, count + 1):
+        patterns = [
+            rf'SEGMENT\s*{i}\s*[:\-]\s*(.*?)(?=SEGMENT\s*{i+1}|$)',
+            rf'{i}\.\s*(.*?)(?={i+1}\.|$)',
+        ]
+        for pattern in patterns:
+            match = re.search(pattern, generated_text, re.IGNORECASE | re.DOTALL)
+            if match:
+                segments[i-1] = match.group(1).strip()
+                break
+    return segments
+
+
+def request_fingerprint(request, seed):
+    """Content hash of a call_llm request + seed (used as cache key and for IS_CHANGED)."""
+    return response_cache.make_key(
+        request["service"], request["model_name"], request["system_prompt"],
+        request["user_prompt"], request["temperature"], request["max_tokens"], seed
+    )
+
+
 # ============================================================================
 # HISTORY FUNCTIONS
 # ============================================================================
 
-def load_history():
-    if HISTORY_FILE.exists():
-        try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            pass
-    return []
+_history_log = None
+_history_index = search_index.SearchIndex()
+
+def get_history_log():
+    """Open the shared history log, importing the legacy prompt_history.json on first use."""
+    global _history_log
+    if _history_log is None:
+        log = history_log.HistoryLog(HISTORY_LOG_DIR, max_entries=HISTORY_MAX_ENTRIES)
+        if HISTORY_FILE.exists():
+            try:
+                # Under the log's lock: workers starting together import it once
+                log.import_legacy(HISTORY_FILE)
+            except Exception as e:
+                print(f"Error importing legacy history: {e}")
+        _history_log = log
+    return _history_log
 
-def save_history(history_list):
+def load_history():
+    """All history entries, newest first (snapshot segments + tail)."""
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history_list, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error saving history: {e}")
+        return get_history_log().read_all()
+    except OSError as e:
+        print(f"Error loading history: {e}")
+        return []
 
+@tracing.traced("history.append")
 def add_to_history(entry):
-    history = load_history()
-    entry['id'] = int(time.time() * 1000)
     entry['timestamp'] = datetime.now().isoformat()
-    history.insert(0, entry)
-    history = history[:100]
-    save_history(history)
+    try:
+        log = get_history_log()
+        # Unique across every worker appending to the log (see HistoryLog.next_id)
+        entry['id'] = log.next_id()
+        log.append(entry)
+    except OSError as e:
+        print(f"Error saving history: {e}")
+        return None
+    _history_index.add(entry['id'], entry.get('input', ''), entry.get('output', ''))
     return entry['id']
 
+@tracing.traced("history.search")
+def search_history(search_term, history):
+    """
+    Newest entry whose input/output matches search_term.
+    The search index is synced incrementally with `history` (entries appended by
+    other workers are added, entries dropped by retention are removed).
+    """
+    by_id = {h['id']: h for h in history if 'id' in h}
+    indexed = _history_index.doc_ids()
+    for entry_id in indexed - by_id.keys():
+        _history_index.remove(entry_id)
+    for entry_id, h in by_id.items():
+        if entry_id not in indexed:
+            _history_index.add(entry_id, h.get('input', ''), h.get('output', ''))
+
+    matches = _history_index.search(search_term, limit=1)
+    return by_id[matches[0]] if matches else None
+
 
 # ============================================================================
 # NODE CLASSES
@@ -318,6 +622,25 @@ class WanPromptCrafterNode:
     FUNCTION = "generate_prompt"
     CATEGORY = "AI Prompt Crafter"
     
+    @classmethod
+    def build_request(cls, model_select, target_model, creativity_mode, input_text, max_tokens=500):
+        """Assemble the call_llm arguments for these inputs."""
+        service, model_name, base_url = parse_model_selection(model_select)
+        return {
+            "service": service,
+            "model_name": model_name,
+            "system_prompt": build_system_prompt(target_model, creativity_mode),
+            "user_prompt": input_text,
+            "temperature": CREATIVITY_CONFIGS[creativity_mode]['temperature'],
+            "max_tokens": max_tokens,
+        }
+    
+    @classmethod
+    def IS_CHANGED(cls, model_select, target_model, creativity_mode, input_text, seed, max_tokens=500, **kwargs):
+        # Same request + seed gives the same (cached) output, so ComfyUI can skip re-running
+        return request_fingerprint(cls.build_request(model_select, target_model, creativity_mode, input_text, max_tokens), seed)
+    
+    @tracing.traced("WanPromptCrafterNode")
     def generate_prompt(self, model_select, target_model, creativity_mode, input_text, seed,
                         negative_prompt="", max_tokens=500, unload_model=False, save_to_history=True):
         
@@ -331,42 +654,176 @@ class WanPromptCrafterNode:
             raise ValueError("No valid model selected. Make sure Ollama or LM Studio is running.")
         
         # Build prompt and call LLM
-        system_prompt = build_system_prompt(target_model, creativity_mode)
-        temperature = CREATIVITY_CONFIGS[creativity_mode]['temperature']
-        
-        generated_text = call_llm(
-            service=service,
-            model_name=model_name,
-            system_prompt=system_prompt,
-            user_prompt=input_text,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            unload_after=unload_model
-        )
-        
-        # Context for debugging
-        full_context = json.dumps({
+        request = self.build_request(model_select, target_model, creativity_mode, input_text, max_tokens)
+        call_stats = {}
+        generated_text = call_llm(**request, unload_after=unload_model, seed=seed, stats=call_stats)
+        
+        full_context = self.build_context(input_text, generated_text, negative_prompt, target_model, creativity_mode,
+                                          service, model_name, call_stats)
+        if save_to_history:
+            self.save_history(input_text, generated_text, negative_prompt, target_model, creativity_mode,
+                              service, model_name)
+        
+        return (generated_text, negative_prompt, full_context)
+    
+    @staticmethod
+    def build_context(input_text, generated_text, negative_prompt, target_model, creativity_mode, service, model_name, call_stats):
+        """full_context output: the call for debugging, with its metrics and the running totals for the model."""
+        totals = metrics.snapshot(service, model_name)["series"]
+        return json.dumps({
             "input": input_text,
             "output": generated_text,
             "negative": negative_prompt,
             "target_model": target_model,
             "creativity_mode": creativity_mode,
             "llm_service": service,
-            "llm_model": model_name
+            "llm_model": model_name,
+            "metrics": {
+                "call": call_stats,
+                "totals": totals[0] if totals else {},
+            }
         }, indent=2)
+    
+    @staticmethod
+    def save_history(input_text, generated_text, negative_prompt, target_model, creativity_mode, service, model_name):
+        add_to_history({
+            "input": input_text,
+            "output": generated_text,
+            "negative_prompt": negative_prompt,
+            "service": service,
+            "model": model_name,
+            "target_model": target_model,
+            "creativity": creativity_mode
+        })
+
+
+class WanPromptCrafterBatchNode:
+    """
+    Prompt Crafter for a whole shot list in one execution.
+    Every input is a list (ComfyUI INPUT_IS_LIST); shorter lists are broadcast
+    by repeating their last value, and with one_per_line each input_text is
+    also split into one scene per line. The scenes are sent to call_llm
+    concurrently at batch priority - the backend queues (scheduler.py) cap the
+    calls in flight and let interactive nodes go first - and the prompts come
+    back as lists in input order.
+    """
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = WanPromptCrafterNode.INPUT_TYPES()
+        inputs["required"]["input_text"] = ("STRING", {
+            "default": "",
+            "multiline": True,
+            "placeholder": "One scene per line (or connect a list of strings)..."
+        })
+        inputs["optional"]["one_per_line"] = ("BOOLEAN", {"default": True, "label_on": "Split Lines", "label_off": "Whole Text"})
+        inputs["optional"]["max_concurrency"] = ("INT", {"default": 0, "min": 0, "max": 64,
+                                                          "tooltip": "Cap on calls in flight for this node (0 = backend limits only)"})
+        return inputs
+    
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING")
+    RETURN_NAMES = ("positive_prompts", "negative_prompts", "full_contexts", "all_prompts")
+    OUTPUT_IS_LIST = (True, True, True, False)
+    FUNCTION = "generate_prompts"
+    CATEGORY = "AI Prompt Crafter"
+    
+    @staticmethod
+    def expand(model_select, target_model, creativity_mode, input_text, seed, negative_prompt=None, max_tokens=None,
+               one_per_line=None):
+        """One dict of scalar inputs per scene, in order (lists broadcast by their last value)."""
+        def at(values, i, default=None):
+            if not values:
+                return default
+            return values[min(i, len(values) - 1)]
         
-        if save_to_history:
-            add_to_history({
-                "input": input_text,
-                "output": generated_text,
-                "negative_prompt": negative_prompt,
-                "service": service,
-                "model": model_name,
-                "target_model": target_model,
-                "creativity": creativity_mode
-            })
+        items = []
+        for i, text in enumerate(input_text):
+            texts = [line.strip() for line in text.splitlines() if line.strip()] if at(one_per_line, i, True) else [text]
+            for scene in texts:
+                items.append({
+                    "model_select": at(model_select, i),
+                    "target_model": at(target_model, i),
+                    "creativity_mode": at(creativity_mode, i),
+                    "input_text": scene,
+                    "seed": at(seed, i, 0),
+                    "negative_prompt": at(negative_prompt, i, ""),
+                    "max_tokens": at(max_tokens, i, 500),
+                })
+        return items
+    
+    @classmethod
+    def IS_CHANGED(cls, model_select, target_model, creativity_mode, input_text, seed, negative_prompt=None,
+                   max_tokens=None, one_per_line=None, **kwargs):
+        items = cls.expand(model_select, target_model, creativity_mode, input_text, seed, negative_prompt, max_tokens, one_per_line)
+        return [
+            request_fingerprint(WanPromptCrafterNode.build_request(
+                item["model_select"], item["target_model"], item["creativity_mode"], item["input_text"], item["max_tokens"]
+            ), item["seed"])
+            for item in items
+        ]
+    
+    @tracing.traced("WanPromptCrafterBatchNode")
+    def generate_prompts(self, model_select, target_model, creativity_mode, input_text, seed, negative_prompt=None,
+                         max_tokens=None, unload_model=None, save_to_history=None, one_per_line=None, max_concurrency=None):
+        items = self.expand(model_select, target_model, creativity_mode, input_text, seed, negative_prompt, max_tokens, one_per_line)
+        unload = bool(unload_model and unload_model[0])
+        save = save_to_history[0] if save_to_history else True
+        limit = max_concurrency[0] if max_concurrency else 0
+        if not items:
+            return ([], [], [], "")
         
-        return (generated_text, negative_prompt, full_context)
+        for item in items:
+            item["service"], item["model_name"], _ = parse_model_selection(item["model_select"])
+            if not item["model_name"] or item["model_name"].startswith("No models"):
+                raise ValueError("No valid model selected. Make sure Ollama or LM Studio is running.")
+        
+        node_slots = threading.BoundedSemaphore(limit) if limit else None
+        
+        def run(item):
+            request = WanPromptCrafterNode.build_request(item["model_select"], item["target_model"], item["creativity_mode"],
+                                                         item["input_text"], item["max_tokens"])
+            call_stats = {}
+            if node_slots is None:
+                return call_llm(**request, seed=item["seed"], stats=call_stats, priority=scheduler.BATCH), call_stats
+            with node_slots:
+                return call_llm(**request, seed=item["seed"], stats=call_stats, priority=scheduler.BATCH), call_stats
+        
+        # The backend queues do the throttling; a thread per scene just waits its turn
+        workers = max(1, min(len(items), limit or len(items), 64))
+        print(f"🎬 Crafting {len(items)} prompts ({workers} workers)")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prompt-batch") as executor:
+            futures = [executor.submit(run, item) for item in items]
+            outcomes = []
+            for future in futures:
+                try:
+                    outcomes.append((future.result(), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        
+        failed = [(i, e) for i, (_, e) in enumerate(outcomes) if e is not None]
+        if failed:
+            # Finished scenes are in the response cache, so re-queueing only pays for these
+            details = "; ".join(f"#{i + 1} ({items[i]['input_text'][:40]!r}): {e}" for i, e in failed[:5])
+            raise Exception(f"{len(failed)} of {len(items)} prompts failed: {details}")
+        
+        positives, negatives, contexts = [], [], []
+        for item, ((generated_text, call_stats), _) in zip(items, outcomes):
+            positives.append(generated_text)
+            negatives.append(item["negative_prompt"])
+            contexts.append(WanPromptCrafterNode.build_context(
+                item["input_text"], generated_text, item["negative_prompt"], item["target_model"],
+                item["creativity_mode"], item["service"], item["model_name"], call_stats))
+            if save:
+                WanPromptCrafterNode.save_history(item["input_text"], generated_text, item["negative_prompt"],
+                                                  item["target_model"], item["creativity_mode"], item["service"], item["model_name"])
+        
+        if unload:
+            # Unloading after every scene would reload the model for the next one; do it once at the end
+            for service, model_name in dict.fromkeys((item["service"], item["model_name"]) for item in items):
+                unload_model_now(service, model_name)
+        
+        return (positives, negatives, contexts, "\n\n".join(positives))
 
 
 class InspireMeNode:
@@ -402,16 +859,11 @@ class InspireMeNode:
     FUNCTION = "inspire"
     CATEGORY = "AI Prompt Crafter"
     
-    def inspire(self, model_select, keywords, target_model, num_ideas, seed, style_hint="any", unload_model=False):
-        
-        if not keywords.strip():
-            return ("Enter some keywords.", "", "", "", "", "")
-        
+    @classmethod
+    def build_request(cls, model_select, keywords, target_model, num_ideas, style_hint="any"):
+        """Assemble the call_llm arguments for these inputs."""
         service, model_name, base_url = parse_model_selection(model_select)
         
-        if not model_name or model_name.startswith("No models"):
-            raise ValueError("No valid model selected.")
-        
         target_desc = {'wan2.2': 'video', 'flux': 'image', 'qwen': 'image'}.get(target_model, 'image')
         style_instruction = f" Each idea should have a {style_hint} feel." if style_hint != "any" else ""
         
@@ -431,24 +883,34 @@ Example:
 2. Abstract colors morphing into a face.
 3. Timelapse of flowers blooming."""
 
-        generated_text = call_llm(
-            service=service,
-            model_name=model_name,
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            temperature=0.85,
-            max_tokens=500,
-            unload_after=unload_model
-        )
-        
-        # Parse ideas
-        ideas = ["", "", "", "", ""]
-        lines = [l.strip() for l in generated_text.split('\n') if l.strip()]
-        for line in lines:
-            for i in range(1, 6):
-                if line.startswith(f'{i}.') or line.startswith(f'{i})'):
-                    ideas[i-1] = line[2:].strip()
-                    break
+        return {
+            "service": service,
+            "model_name": model_name,
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "temperature": 0.85,
+            "max_tokens": 500,
+        }
+    
+    @classmethod
+    def IS_CHANGED(cls, model_select, keywords, target_model, num_ideas, seed, style_hint="any", **kwargs):
+        return request_fingerprint(cls.build_request(model_select, keywords, target_model, num_ideas, style_hint), seed)
+    
+    @tracing.traced("InspireMeNode")
+    def inspire(self, model_select, keywords, target_model, num_ideas, seed, style_hint="any", unload_model=False):
+        
+        if not keywords.strip():
+            return ("Enter some keywords.", "", "", "", "", "")
+        
+        service, model_name, base_url = parse_model_selection(model_select)
+        
+        if not model_name or model_name.startswith("No models"):
+            raise ValueError("No valid model selected.")
+        
+        request = self.build_request(model_select, keywords, target_model, num_ideas, style_hint)
+        generated_text = call_llm(**request, unload_after=unload_model, seed=seed)
+        
+        ideas = parse_ideas(generated_text)
         
         return (generated_text, ideas[0], ideas[1], ideas[2], ideas[3], ideas[4])
 
@@ -488,17 +950,12 @@ class VideoSequenceNode:
     FUNCTION = "generate_sequence"
     CATEGORY = "AI Prompt Crafter"
     
-    def generate_sequence(self, model_select, concept, num_segments, segment_duration,
-                          transition_style, seed, creativity_mode="balanced", camera_style="mixed", unload_model=False):
-        
-        if not concept.strip():
-            return ("Enter a video concept.", "", "", "", "", "", "")
-        
+    @classmethod
+    def build_request(cls, model_select, concept, num_segments, segment_duration,
+                      transition_style, creativity_mode="balanced", camera_style="mixed"):
+        """Assemble the call_llm arguments for these inputs."""
         service, model_name, base_url = parse_model_selection(model_select)
         
-        if not model_name or model_name.startswith("No models"):
-            raise ValueError("No valid model selected.")
-        
         num_segs = int(num_segments)
         duration = segment_duration.replace("sec", " seconds")
         
@@ -530,28 +987,38 @@ Camera: {camera_instructions[camera_style]}
 For each segment include: subject, action, camera, lighting, key visuals.
 Format: SEGMENT 1: [prompt]"""
 
-        generated_text = call_llm(
-            service=service,
-            model_name=model_name,
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            temperature=temperature,
-            max_tokens=1500,
-            unload_after=unload_model
-        )
-        
-        # Parse segments
-        segments = ["", "", "", "", "", ""]
-        for i in range(1, 7):
-            patterns = [
-                rf'SEGMENT\s*{i}\s*[:\-]\s*(.*?)(?=SEGMENT\s*{i+1}|$)',
-                rf'{i}\.\s*(.*?)(?={i+1}\.|$)',
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, generated_text, re.IGNORECASE | re.DOTALL)
-                if match:
-                    segments[i-1] = match.group(1).strip()
-                    break
+        return {
+            "service": service,
+            "model_name": model_name,
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "temperature": temperature,
+            "max_tokens": 1500,
+        }
+    
+    @classmethod
+    def IS_CHANGED(cls, model_select, concept, num_segments, segment_duration, transition_style, seed,
+                   creativity_mode="balanced", camera_style="mixed", **kwargs):
+        return request_fingerprint(cls.build_request(model_select, concept, num_segments, segment_duration,
+                                                     transition_style, creativity_mode, camera_style), seed)
+    
+    @tracing.traced("VideoSequenceNode")
+    def generate_sequence(self, model_select, concept, num_segments, segment_duration,
+                          transition_style, seed, creativity_mode="balanced", camera_style="mixed", unload_model=False):
+        
+        if not concept.strip():
+            return ("Enter a video concept.", "", "", "", "", "", "")
+        
+        service, model_name, base_url = parse_model_selection(model_select)
+        
+        if not model_name or model_name.startswith("No models"):
+            raise ValueError("No valid model selected.")
+        
+        request = self.build_request(model_select, concept, num_segments, segment_duration,
+                                     transition_style, creativity_mode, camera_style)
+        generated_text = call_llm(**request, unload_after=unload_model, seed=seed)
+        
+        segments = parse_segments(generated_text)
         
         return (generated_text, segments[0], segments[1], segments[2], segments[3], segments[4], segments[5])
 
@@ -566,7 +1033,7 @@ class PromptHistoryLoadNode:
                 "load_by": (["latest", "index", "search"], {"default": "latest"}),
             },
             "optional": {
-                "index": ("INT", {"default": 0, "min": 0, "max": 99}),
+                "index": ("INT", {"default": 0, "min": 0, "max": HISTORY_MAX_ENTRIES - 1}),
                 "search_term": ("STRING", {"default": ""}),
             }
         }
@@ -587,10 +1054,7 @@ class PromptHistoryLoadNode:
         elif load_by == "index" and index < len(history):
             entry = history[index]
         elif load_by == "search":
-            for h in history:
-                if search_term.lower() in f"{h.get('input', '')} {h.get('output', '')}".lower():
-                    entry = h
-                    break
+            entry = search_history(search_term, history) if search_term.strip() else history[0]
         
         if entry:
             return (
@@ -701,6 +1165,7 @@ class NegativePromptGeneratorNode:
 
 NODE_CLASS_MAPPINGS = {
     "WanPromptCrafterNode": WanPromptCrafterNode,
+    "WanPromptCrafterBatchNode": WanPromptCrafterBatchNode,
     "InspireMeNode": InspireMeNode,
     "VideoSequenceNode": VideoSequenceNode,
     "PromptHistoryLoadNode": PromptHistoryLoadNode,
@@ -711,6 +1176,7 @@ NODE_CLASS_MAPPINGS = {
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "WanPromptCrafterNode": "🎬 Prompt Crafter",
+    "WanPromptCrafterBatchNode": "🎬 Prompt Crafter (Batch)",
     "InspireMeNode": "✨ Inspire Me",
     "VideoSequenceNode": "🎞️ Video Sequence",
     "PromptHistoryLoadNode": "📂 Load History",
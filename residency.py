@@ -0,0 +1,225 @@
+"""
+Which models each LLM backend has loaded, and which to unload to make room.
+
+Without it every call either keeps its model for Ollama's default 5 minutes or
+unloads it right away (unload_after), so a workflow alternating between two
+LLMs either pays a reload on every switch or lets models pile up until the
+GPU runs out of memory. A ResidencyManager per backend instead:
+- remembers the models it has loaded, least recently used first, with their
+  size in VRAM once the server reports it (Ollama: /api/ps; LM Studio: the
+  SDK's model info)
+- before a call loads a new model, unloads the least recently used models
+  (never one a call is still using) until at most MAX_LOADED_MODELS are
+  loaded and their sizes fit VRAM_BUDGET
+- gives every Ollama request the keep_alive to send: KEEP_ALIVE, long enough
+  to outlive the pauses of a workflow, as the manager unloads what is not needed
+- caches LM Studio model handles, so calls stop resolving lms.llm(name) each time
+
+The managers only see the models this process loaded; sync() replaces that
+view with what the server reports (models loaded by others, or expired).
+
+Limits come from WAN_MAX_LOADED_MODELS (default 2), WAN_VRAM_BUDGET_GB
+(default 0: no byte budget) and WAN_KEEP_ALIVE (default "30m"), or configure().
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+KEEP_ALIVE = os.environ.get("WAN_KEEP_ALIVE", "30m")
+MAX_LOADED_MODELS = int(os.environ.get("WAN_MAX_LOADED_MODELS", 2))
+VRAM_BUDGET = int(float(os.environ.get("WAN_VRAM_BUDGET_GB", 0)) * 1024 ** 3)  # Bytes; 0 = no budget
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+class _Resident:
+    """One loaded (or loading) model."""
+
+    __slots__ = ("size", "in_use", "last_used", "handle")
+
+    def __init__(self):
+        self.size = None  # Bytes in VRAM, once known
+        self.in_use = 0
+        self.last_used = time.time()
+        self.handle = None  # LM Studio SDK model handle
+
+
+class ResidencyManager:
+    """
+    The models loaded on one backend, least recently used first. Thread-safe.
+    `unload(model, handle)` frees a model on the server (handle: its cached
+    LM Studio handle, or None).
+    """
+
+    def __init__(self, service, unload, max_models=None, budget_bytes=None):
+        self.service = service
+        self._unload = unload
+        self.max_models = MAX_LOADED_MODELS if max_models is None else max_models
+        self.budget_bytes = VRAM_BUDGET if budget_bytes is None else budget_bytes
+        self.loads = 0
+        self.evictions = 0
+        self._models = OrderedDict()  # model -> _Resident, least recently used first
+        self._lock = threading.Lock()
+
+    def _over_budget(self):
+        if self.max_models and len(self._models) > self.max_models:
+            return True
+        if self.budget_bytes:
+            return sum(r.size or 0 for r in self._models.values()) > self.budget_bytes
+        return False
+
+    def _pick_victims(self, keep):
+        """Drop least recently used idle models until within budget; returns [(model, handle)] to unload."""
+        victims = []
+        for model, resident in list(self._models.items()):
+            if not self._over_budget():
+                break
+            if model == keep or resident.in_use:
+                continue
+            del self._models[model]
+            victims.append((model, resident.handle))
+        return victims
+
+    def _evict(self, victims):
+        for model, handle in victims:
+            self.evictions += 1
+            print(f"♻️ Unloading {self.service} model {model} to make room (least recently used)")
+            try:
+                self._unload(model, handle)
+            except Exception as e:
+                print(f"⚠️ Could not unload {self.service} model {model}: {e}")
+
+    @contextmanager
+    def use(self, model, unload_after=False):
+        """
+        Hold `model` in use for the block, unloading other models first if it
+        needs the room. Yields the keep_alive to request (0 with unload_after,
+        which also forgets the model afterwards).
+        """
+        with self._lock:
+            resident = self._models.get(model)
+            if resident is None:
+                resident = self._models[model] = _Resident()
+                self.loads += 1
+            resident.in_use += 1
+            self._models.move_to_end(model)
+            victims = self._pick_victims(model)
+        self._evict(victims)
+        try:
+            yield 0 if unload_after else KEEP_ALIVE
+        finally:
+            with self._lock:
+                resident.in_use -= 1
+                resident.last_used = time.time()
+                if unload_after and not resident.in_use and self._models.get(model) is resident:
+                    del self._models[model]
+
+    def is_loaded(self, model):
+        with self._lock:
+            return model in self._models
+
+    def handle(self, model, load):
+        """
+        The cached LM Studio handle of `model`, or load()'s (cached for the next
+        call). Returns (handle, loaded): loaded is True if load() was called.
+        """
+        with self._lock:
+            resident = self._models.get(model)
+            if resident is not None and resident.handle is not None:
+                return resident.handle, False
+        handle = load()
+        with self._lock:
+            resident = self._models.get(model)
+            if resident is not None:
+                resident.handle = handle
+        return handle, True
+
+    def set_size(self, model, size):
+        """Record `model`'s size in VRAM (bytes); unloads others if the budget is now exceeded."""
+        with self._lock:
+            resident = self._models.get(model)
+            if resident is None or not size:
+                return
+            resident.size = int(size)
+            victims = self._pick_victims(model)
+        self._evict(victims)
+
+    def forget(self, model):
+        """Drop `model` (unloaded elsewhere, or its handle went stale). Returns its cached handle, or None."""
+        with self._lock:
+            resident = self._models.pop(model, None)
+        return resident.handle if resident is not None else None
+
+    def sync(self, loaded):
+        """
+        Match the server: `loaded` maps the models it has loaded to their size
+        in bytes (or None). Models it no longer has are dropped unless a call
+        is using them; models loaded by others are added (as least recently
+        used), and unloaded first if the budget is exceeded.
+        """
+        with self._lock:
+            for model in [m for m, r in self._models.items() if m not in loaded and not r.in_use]:
+                del self._models[model]
+            for model, size in loaded.items():
+                resident = self._models.get(model)
+                if resident is None:
+                    resident = self._models[model] = _Resident()
+                    self._models.move_to_end(model, last=False)
+                if size:
+                    resident.size = int(size)
+            victims = self._pick_victims(None)
+        self._evict(victims)
+
+    def loaded(self):
+        """Models believed loaded, least recently used first."""
+        with self._lock:
+            return list(self._models)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "service": self.service,
+                "loaded": [{"model": model, "size": r.size, "in_use": r.in_use, "last_used": r.last_used}
+                           for model, r in self._models.items()],
+                "max_models": self.max_models,
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+def get_manager(service, unload):
+    """The manager of `service`; `unload(model, handle)` is used when it is created."""
+    manager = _managers.get(service)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(service)
+            if manager is None:
+                manager = _managers[service] = ResidencyManager(service, unload)
+    return manager
+
+
+def configure(max_models=None, vram_budget_gb=None, keep_alive=None):
+    """Change the limits of every backend (existing managers included) and the keep_alive sent to Ollama."""
+    global MAX_LOADED_MODELS, VRAM_BUDGET, KEEP_ALIVE
+    if max_models is not None:
+        MAX_LOADED_MODELS = int(max_models)
+    if vram_budget_gb is not None:
+        VRAM_BUDGET = int(float(vram_budget_gb) * 1024 ** 3)
+    if keep_alive is not None:
+        KEEP_ALIVE = keep_alive
+    with _managers_lock:
+        for manager in _managers.values():
+            manager.max_models = MAX_LOADED_MODELS
+            manager.budget_bytes = VRAM_BUDGET
+
+
+def stats():
+    """Loaded models, loads and evictions of every backend."""
+    with _managers_lock:
+        managers = list(_managers.values())
+    return [manager.stats() for manager in managers]
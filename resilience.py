@@ -0,0 +1,200 @@
+"""
+Deadlines, retries and per-endpoint circuit breakers for LLM calls.
+
+- Deadline: a total time budget for one call (including retries and
+  failover); every attempt's connect/read timeouts are clamped to what is left.
+- call_with_retries: bounded retries with full-jitter exponential backoff,
+  only for failures llm_errors.is_retryable() allows (requests that never
+  reached the server, or idempotent calls that hit a timeout / 429 / 5xx).
+- CircuitBreaker: one per endpoint (scheme://host:port). After
+  FAILURE_THRESHOLD consecutive failures it opens and calls fail fast with
+  CircuitOpenError; after RESET_TIMEOUT it half-opens and lets a single probe
+  through - success closes it, failure opens it again.
+"""
+
+import os
+import random
+import threading
+import time
+
+try:
+    from . import http_client
+    from .llm_errors import CircuitOpenError, LLMTimeoutError, is_endpoint_failure, is_retryable
+except ImportError:
+    import http_client
+    from llm_errors import CircuitOpenError, LLMTimeoutError, is_endpoint_failure, is_retryable
+
+FAILURE_THRESHOLD = int(os.environ.get("WAN_BREAKER_THRESHOLD", 5))  # Consecutive failures that open a breaker
+RESET_TIMEOUT = float(os.environ.get("WAN_BREAKER_RESET", 10))       # Seconds before an open breaker half-opens
+MAX_RETRIES = 2             # Retries after the first attempt
+BACKOFF_BASE = 0.5          # Seconds; attempt n waits up to BACKOFF_BASE * 2**n
+BACKOFF_CAP = 8.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class Deadline:
+    """Total time budget for one call. seconds=None means no limit."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, url=None):
+        """Raise LLMTimeoutError(phase="total") once the budget is spent."""
+        if self.expired():
+            raise LLMTimeoutError(f"No answer from {url or 'the server'} within {self.seconds:g} seconds.",
+                                  url, phase="total")
+
+    def timeout(self, connect=None, read=None, url=None):
+        """The (connect, read) timeout pair for the next attempt, clamped to the time left."""
+        self.check(url)
+        connect = http_client.connect_timeout() if connect is None else connect
+        read = http_client.read_timeout() if read is None else read
+        remaining = self.remaining()
+        if remaining is None:
+            return connect, read
+        return min(connect, remaining), min(read, remaining)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open failure tracker for one endpoint. Thread-safe."""
+
+    def __init__(self, url, failure_threshold=None, reset_timeout=None):
+        self.url = url
+        self.failure_threshold = failure_threshold or FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or RESET_TIMEOUT
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """Seconds until an open breaker half-opens (0 if calls are allowed now)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def is_open(self):
+        return self.retry_after() > 0
+
+    def before_call(self):
+        """Admit a call, or raise CircuitOpenError while the endpoint is considered down."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            wait = self.opened_at + self.reset_timeout - now
+            if wait > 0:
+                raise CircuitOpenError(self.url, wait)
+            # Half-open: one probe at a time. A probe that never reports back
+            # (e.g. its caller was cancelled) is replaced after another reset_timeout.
+            if (self.state == HALF_OPEN and self._probe_started is not None
+                    and now - self._probe_started < self.reset_timeout):
+                raise CircuitOpenError(self.url, self._probe_started + self.reset_timeout - now)
+            self.state = HALF_OPEN
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"Endpoint {self.url} recovered")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state == CLOSED:
+                    print(f"Endpoint {self.url} failed {self.failures} times in a row; "
+                          f"failing fast for {self.reset_timeout:g}s")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_started = None
+
+    def record_result(self, exc=None):
+        """Record a finished call. Only endpoint failures (unreachable, timeout, 5xx) count against it."""
+        if exc is not None and is_endpoint_failure(exc):
+            self.record_failure()
+        else:
+            # The server answered (maybe with a 4xx or a bad payload), so it is up
+            self.record_success()
+
+    def call(self, fn):
+        """Run fn() through the breaker."""
+        self.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record_result(e)
+            raise
+        self.record_result()
+        return result
+
+
+def get_breaker(url):
+    """The circuit breaker of the endpoint serving `url`."""
+    key = http_client.endpoint_key(url)
+    breaker = _breakers.get(key)
+    if breaker is not None:
+        return breaker
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key)
+        return breaker
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_delay(exc, attempt, idempotent, retries, deadline):
+    """
+    Seconds to wait before retrying after `exc`, or None if the call must not
+    be retried (not retryable, out of attempts, or the wait would overrun the deadline).
+    """
+    if attempt >= retries or not is_retryable(exc, idempotent):
+        return None
+    if getattr(exc, "url", None) and get_breaker(exc.url).is_open():
+        return None  # this failure opened the endpoint's breaker; a retry would only fail fast
+    delay = backoff_delay(attempt)
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is not None and remaining <= delay:
+        return None
+    return delay
+
+
+def call_with_retries(fn, idempotent=True, retries=MAX_RETRIES, deadline=None, cancel_token=None):
+    """
+    Call fn(), retrying retryable LLMErrors with jittered backoff.
+    The last error is re-raised once retries, or the deadline, run out.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            delay = retry_delay(e, attempt, idempotent, retries, deadline)
+            if delay is None or (cancel_token is not None and cancel_token.cancelled):
+                raise
+        attempt += 1
+        time.sleep(delay)
@@ -0,0 +1,150 @@
+"""
+Content-addressed cache for LLM responses.
+
+Responses are keyed by a hash of everything that determines the output
+(service, model, system prompt, user prompt, temperature, max_tokens, seed).
+Two tiers:
+- an in-memory LRU for the current process
+- an on-disk tier (one small JSON file per key) with size-based eviction of
+  the least recently used files, so results survive ComfyUI restarts
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_DISK_BYTES = 64 * 1024 * 1024  # 64 MB
+
+
+def make_key(service, model, system_prompt, user_prompt, temperature, max_tokens, seed):
+    """Stable SHA-256 key for one LLM request."""
+    material = json.dumps(
+        [service, model, system_prompt, user_prompt, float(temperature), int(max_tokens), seed],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) response cache. Thread-safe."""
+
+    def __init__(self, cache_dir, max_memory_entries=DEFAULT_MEMORY_ENTRIES, max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._disk_index = None  # key -> [size, last_access], built lazily
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    # --- Disk tier helpers ---
+
+    def _path_for(self, key):
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _load_disk_index(self):
+        """Scan the cache directory once to learn sizes and access times."""
+        self._disk_index = {}
+        self._disk_bytes = 0
+        if not self.cache_dir.exists():
+            return
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            self._disk_index[path.stem] = [stat.st_size, stat.st_mtime]
+            self._disk_bytes += stat.st_size
+
+    def _evict_disk(self):
+        """Drop least recently used files until the disk tier fits its budget."""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        for key, (size, _) in sorted(self._disk_index.items(), key=lambda kv: kv[1][1]):
+            try:
+                self._path_for(key).unlink()
+            except OSError:
+                pass
+            self._disk_bytes -= size
+            del self._disk_index[key]
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    # --- Public API ---
+
+    def get(self, key):
+        """Return the cached response for `key`, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self._disk_index is None:
+                self._load_disk_index()
+            if key not in self._disk_index:
+                return None
+
+            path = self._path_for(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)["response"]
+                now = time.time()
+                os.utime(path, (now, now))
+                self._disk_index[key][1] = now
+            except (OSError, ValueError, KeyError):
+                self._disk_bytes -= self._disk_index.pop(key)[0]
+                return None
+
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        """Store a response in both tiers."""
+        with self._lock:
+            self._remember(key, value)
+
+            if self._disk_index is None:
+                self._load_disk_index()
+            path = self._path_for(key)
+            data = json.dumps({"response": value, "created": time.time()}, ensure_ascii=False).encode("utf-8")
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error writing response cache: {e}")
+                return
+
+            old = self._disk_index.get(key)
+            if old:
+                self._disk_bytes -= old[0]
+            self._disk_index[key] = [len(data), time.time()]
+            self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def clear(self):
+        """Empty both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._disk_index is None:
+                self._load_disk_index()
+            for key in list(self._disk_index):
+                try:
+                    self._path_for(key).unlink()
+                except OSError:
+                    pass
+            self._disk_index = {}
+            self._disk_bytes = 0
@@ -0,0 +1,206 @@
+"""
+Process-wide scheduling of LLM calls, one queue per backend.
+
+Every LLM call made by the ComfyUI nodes (call_llm) or the app backend
+(generate_prompt / get_inspiration and their streams) takes a slot from its
+backend's queue first. At most max_in_flight calls per backend run at once -
+MAX_IN_FLIGHT per endpoint, times the endpoints in the backend's pool - and
+the rest wait in the queue instead of piling onto the server until its read
+timeouts fire. A burst therefore gets slower, not broken.
+
+Waiting calls are admitted by priority, then in arrival order:
+- INTERACTIVE: someone is waiting on the result (the default)
+- NORMAL
+- BATCH: batch jobs (the batch node, batch.py) - they yield to the others
+
+Set the priority of the calls a thread makes with
+    with scheduler.priority(scheduler.BATCH):
+        ...
+
+Queue depth, calls in flight and the time calls spent waiting are reported by
+stats() and exported with the LLM metrics (wan_llm_queue_* in metrics.py).
+
+Per-endpoint limits come from WAN_OLLAMA_CONCURRENCY (default 4, Ollama's own
+default OLLAMA_NUM_PARALLEL) and WAN_LMSTUDIO_CONCURRENCY (default 2), or configure().
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from . import endpoint_pool, metrics
+    from .llm_errors import QueueTimeoutError
+except ImportError:
+    import endpoint_pool
+    import metrics
+    from llm_errors import QueueTimeoutError
+
+INTERACTIVE = 0
+NORMAL = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BATCH: "batch"}
+DEFAULT_PRIORITY = INTERACTIVE
+
+# Calls in flight per endpoint of each backend
+MAX_IN_FLIGHT = {
+    endpoint_pool.OLLAMA: int(os.environ.get("WAN_OLLAMA_CONCURRENCY", 4)),
+    endpoint_pool.LMSTUDIO: int(os.environ.get("WAN_LMSTUDIO_CONCURRENCY", 2)),
+}
+
+_queues = {}
+_queues_lock = threading.Lock()
+_local = threading.local()
+
+
+class BackendQueue:
+    """Priority-ordered admission to one backend, with a cap on calls in flight. Thread-safe."""
+
+    def __init__(self, service, max_in_flight, endpoints=1):
+        self.service = service
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.endpoints = endpoints
+        self.in_flight = 0
+        self.admitted = 0
+        self.timeouts = 0
+        self.max_depth = 0
+        self._waiting = []  # heap of [priority, seq] - the list object is the waiter's ticket
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def depth(self):
+        with self._cond:
+            return len(self._waiting)
+
+    def set_limit(self, max_in_flight):
+        with self._cond:
+            self.max_in_flight = max(1, int(max_in_flight))
+            self._cond.notify_all()
+        self._report()
+
+    def acquire(self, priority=None, timeout=None):
+        """
+        Wait for a slot. Returns the seconds spent waiting; raises
+        QueueTimeoutError if no slot freed up within `timeout` seconds.
+        """
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        ticket = [priority, next(self._seq)]
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self.max_depth = max(self.max_depth, len(self._waiting))
+            try:
+                while not (self._waiting[0] is ticket and self.in_flight < self.max_in_flight):
+                    remaining = None if timeout is None else timeout - (time.monotonic() - started)
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise QueueTimeoutError(self.service, time.monotonic() - started, len(self._waiting))
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()  # the next waiter may be at the head now
+                raise
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            self.admitted += 1
+            # Several slots may be free; let the new head check too
+            self._cond.notify_all()
+        waited = time.monotonic() - started
+        metrics.record_queue_wait(self.service, waited, PRIORITY_NAMES.get(priority, str(priority)))
+        self._report()
+        return waited
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+        self._report()
+
+    @contextmanager
+    def slot(self, priority=None, timeout=None):
+        """Hold a slot for the duration of the block; yields the seconds spent waiting for it."""
+        waited = self.acquire(priority, timeout)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def _report(self):
+        with self._cond:
+            depth, in_flight, limit = len(self._waiting), self.in_flight, self.max_in_flight
+        metrics.set_queue_state(self.service, depth, in_flight, limit)
+
+    def stats(self):
+        with self._cond:
+            waiting = {}
+            for priority, _ in self._waiting:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                waiting[name] = waiting.get(name, 0) + 1
+            return {
+                "service": self.service,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiting),
+                "queued_by_priority": waiting,
+                "max_queued": self.max_depth,
+                "admitted": self.admitted,
+                "timeouts": self.timeouts,
+            }
+
+
+def get_queue(service, endpoints=1):
+    """The queue of `service` (an endpoint_pool service name), sized for `endpoints` endpoints."""
+    endpoints = max(1, endpoints)
+    queue = _queues.get(service)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(service)
+            if queue is None:
+                queue = _queues[service] = BackendQueue(service, MAX_IN_FLIGHT.get(service, 1) * endpoints, endpoints)
+                return queue
+    if endpoints > queue.endpoints:
+        # More endpoints joined the pool since the queue was made
+        queue.endpoints = endpoints
+        queue.set_limit(MAX_IN_FLIGHT.get(service, 1) * endpoints)
+    return queue
+
+
+def slot(service, endpoints=1, priority=None, timeout=None):
+    """Context manager holding one of `service`'s slots; yields the seconds waited for it."""
+    return get_queue(service, endpoints).slot(priority, timeout)
+
+
+def configure(service, max_in_flight_per_endpoint):
+    """Change a backend's per-endpoint limit (existing queues are resized)."""
+    MAX_IN_FLIGHT[service] = int(max_in_flight_per_endpoint)
+    queue = _queues.get(service)
+    if queue is not None:
+        queue.set_limit(MAX_IN_FLIGHT[service] * queue.endpoints)
+
+
+@contextmanager
+def priority(level):
+    """Run LLM calls made by this thread inside the block at `level` (INTERACTIVE / NORMAL / BATCH)."""
+    previous = getattr(_local, "priority", None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    """The priority calls from this thread are queued at."""
+    level = getattr(_local, "priority", None)
+    return DEFAULT_PRIORITY if level is None else level
+
+
+def stats():
+    """Queue depth, calls in flight and totals of every backend queue."""
+    with _queues_lock:
+        queues = list(_queues.values())
+    return [queue.stats() for queue in queues]
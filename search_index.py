@@ -0,0 +1,165 @@
+"""
+Incrementally maintained in-memory search index for prompt history.
+
+Two layers:
+- an inverted index from each word to the set of documents containing it
+- a trigram index over the *vocabulary* (distinct words), used to find every
+  word that contains a query term as a substring, or - for typo tolerance -
+  every word that shares most of its trigrams with the term
+
+Indexing trigrams of words instead of whole documents keeps memory
+proportional to the vocabulary rather than to the total text size.
+Documents are added/removed one at a time; nothing is ever rebuilt.
+Exact searches keep the old "substring of user idea or prompt" semantics:
+candidates from the index are verified against the stored text.
+"""
+
+import re
+import threading
+from collections import defaultdict
+
+_WORD_RE = re.compile(r"\w+")
+
+# Minimum share of a term's trigrams a word must contain to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+
+def _words(text):
+    return set(_WORD_RE.findall(text))
+
+
+def _grams(word, padded=True):
+    """Character trigrams of a word ('  ' padding lets short words and prefixes match)."""
+    if padded:
+        word = f" {word} "
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class SearchIndex:
+    """Word-level inverted index with a trigram index over the vocabulary. Thread-safe."""
+
+    def __init__(self):
+        self._texts = {}                    # doc_id -> lowercased searchable text
+        self._doc_words = {}                # doc_id -> set of words
+        self._postings = defaultdict(set)   # word -> doc_ids
+        self._gram_words = defaultdict(set) # trigram -> words
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._texts
+
+    # --- Maintenance ---
+
+    def add(self, doc_id, *fields):
+        """Index (or re-index) a document made of one or more text fields."""
+        # \0 between fields so a query can never match across two fields
+        text = "\0".join(f.lower() for f in fields if f)
+        words = _words(text)
+        with self._lock:
+            if doc_id in self._texts:
+                self._remove_locked(doc_id)
+            self._texts[doc_id] = text
+            self._doc_words[doc_id] = words
+            for word in words:
+                postings = self._postings[word]
+                if not postings:
+                    for gram in _grams(word):
+                        self._gram_words[gram].add(word)
+                postings.add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id):
+        self._texts.pop(doc_id, None)
+        for word in self._doc_words.pop(doc_id, ()):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.discard(doc_id)
+            if not postings:
+                # Word left the vocabulary
+                del self._postings[word]
+                for gram in _grams(word):
+                    words = self._gram_words.get(gram)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self._gram_words[gram]
+
+    def clear(self):
+        with self._lock:
+            self._texts.clear()
+            self._doc_words.clear()
+            self._postings.clear()
+            self._gram_words.clear()
+
+    def doc_ids(self):
+        with self._lock:
+            return set(self._texts)
+
+    # --- Lookup ---
+
+    def _words_containing(self, term):
+        """Vocabulary words that contain `term` as a substring."""
+        if len(term) < 3:
+            return [w for w in self._postings if term in w]
+        gram_sets = sorted((self._gram_words.get(g, set()) for g in _grams(term, padded=False)), key=len)
+        candidates = set(gram_sets[0])
+        for gram_set in gram_sets[1:]:
+            candidates &= gram_set
+            if not candidates:
+                break
+        return [w for w in candidates if term in w]
+
+    def _words_similar(self, term):
+        """Vocabulary words sharing at least FUZZY_THRESHOLD of the term's trigrams (typo tolerance)."""
+        term_grams = _grams(term)
+        counts = defaultdict(int)
+        for gram in term_grams:
+            for word in self._gram_words.get(gram, ()):
+                counts[word] += 1
+        needed = max(1, int(len(term_grams) * FUZZY_THRESHOLD + 0.5))
+        return [w for w, n in counts.items() if n >= needed]
+
+    def _docs_for(self, terms, word_lookup):
+        docs = None
+        for term in sorted(terms, key=len, reverse=True):  # longest (most selective) first
+            term_docs = set()
+            for word in word_lookup(term):
+                term_docs |= self._postings[word]
+            docs = term_docs if docs is None else docs & term_docs
+            if not docs:
+                return set()
+        return docs or set()
+
+    def search(self, query, fuzzy=True, limit=None):
+        """
+        Return matching doc ids, highest (newest) first.
+        Exact substring matches are returned when there are any; otherwise, if
+        `fuzzy` is set, documents whose words approximately match every term.
+        """
+        query = query.lower().strip()
+        if not query:
+            return []
+        terms = _words(query)
+
+        with self._lock:
+            if not terms:
+                # Pure punctuation query - nothing to look up, fall back to a scan
+                matches = {d for d, text in self._texts.items() if query in text}
+            else:
+                matches = self._docs_for(terms, self._words_containing)
+                if not (len(terms) == 1 and query in terms):
+                    # Multi-word or punctuated queries: confirm the exact substring
+                    texts = self._texts
+                    matches = {d for d in matches if query in texts[d]}
+                if not matches and fuzzy:
+                    matches = self._docs_for(terms, self._words_similar)
+
+        result = sorted(matches, reverse=True)
+        return result[:limit] if limit is not None else result
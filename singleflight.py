@@ -0,0 +1,108 @@
+"""
+Single-flight coalescing of identical in-flight LLM requests.
+
+When ComfyUI re-queues the same graph, or several nodes share one upstream
+text, identical requests are sent at the same time and the GPU generates the
+same answer several times over. Through do(), the first caller with a given
+request key (the leader) makes the call; callers arriving with the same key
+while it is in flight wait for it and get its result - or its exception -
+instead of sending their own request.
+
+Nothing is kept once the call returns: remembering finished responses is the
+response cache's job (response_cache.py). Callers key requests on the
+server they go to plus the response cache's content key (service, model,
+prompts, temperature, max_tokens, seed), so only the same payload sent to the
+same server is coalesced.
+
+Set WAN_COALESCE=0 to send every request.
+"""
+
+import os
+import threading
+
+try:
+    from . import tracing
+except ImportError:
+    import tracing
+
+ENABLED = os.environ.get("WAN_COALESCE", "1") != "0"
+
+
+class _Call:
+    """One in-flight call and its outcome."""
+
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """In-flight calls by key. Thread-safe."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.led = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        fn()'s result, shared with every caller that asks for the same key
+        while it runs. Returns (result, shared): shared is True when this caller
+        waited for another's call instead of running fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.led += 1
+            else:
+                call.followers += 1
+                self.coalesced += 1
+
+        if not leader:
+            with tracing.span("singleflight.wait"):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Callers from now on make a new call (and may hit the response cache)
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "calls": self.led, "coalesced": self.coalesced}
+
+
+# Process-wide instance shared by the app backend and the ComfyUI nodes
+_calls = SingleFlight()
+
+
+def do(key, fn):
+    """fn() coalesced with identical in-flight calls (just fn() with WAN_COALESCE=0). Returns (result, shared)."""
+    if not ENABLED:
+        return fn(), False
+    return _calls.do(key, fn)
+
+
+def stats():
+    return _calls.stats()
@@ -0,0 +1,123 @@
+"""
+Bounded background executor with cancellation for the desktop app.
+
+Each task runs on a small shared thread pool and gets a CancellationToken.
+Tasks are submitted to a named slot ("generate", "models", ...); submitting a
+new task to a slot cancels the one already there. Cancelling a token fires its
+callbacks (backend registers one that closes the in-flight HTTP response, so
+the server actually stops generating), and the superseded task's result is
+dropped instead of being delivered to the UI.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class CancellationToken:
+    """Thread-safe cancel flag with callbacks that run when it is cancelled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in cancel callback: {e}")
+
+    def add_callback(self, callback):
+        """Run `callback` on cancel (immediately if already cancelled)."""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class TaskExecutor:
+    """
+    Thread pool where each slot runs at most one live task.
+    `dispatch` hands completion callbacks to the UI thread (e.g. lambda fn: tk.after(0, fn)).
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, dispatch=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="app-task")
+        self._dispatch = dispatch or (lambda fn: fn())
+        self._current = {}  # slot -> CancellationToken of the live task
+        self._lock = threading.Lock()
+
+    def submit(self, slot, fn, *args, on_done=None, on_error=None, **kwargs):
+        """
+        Run fn(*args, cancel_token=token, **kwargs) in the background, cancelling
+        the slot's previous task. on_done(result) / on_error(exc) are dispatched
+        only if the task was not cancelled or superseded by then.
+        """
+        token = CancellationToken()
+        with self._lock:
+            previous = self._current.get(slot)
+            self._current[slot] = token
+        if previous is not None:
+            previous.cancel()
+
+        def run():
+            if token.cancelled:
+                return
+            try:
+                result = fn(*args, cancel_token=token, **kwargs)
+            except Exception as e:
+                if token.cancelled:
+                    return
+                if on_error is None:
+                    print(f"Background task '{slot}' failed: {e}")
+                    self._dispatch(lambda: self._finish(slot, token, None, None))
+                else:
+                    self._dispatch(lambda error=e: self._finish(slot, token, on_error, error))
+                return
+            self._dispatch(lambda: self._finish(slot, token, on_done, result))
+
+        self._pool.submit(run)
+        return token
+
+    def _finish(self, slot, token, callback, value):
+        # Checked again on the UI thread: the task may have been superseded after it returned
+        if token.cancelled:
+            return
+        with self._lock:
+            if self._current.get(slot) is token:
+                del self._current[slot]
+        if callback is not None:
+            callback(value)
+
+    def cancel(self, slot):
+        with self._lock:
+            token = self._current.pop(slot, None)
+        if token is not None:
+            token.cancel()
+
+    def shutdown(self):
+        """Cancel every live task and stop accepting new ones (does not wait)."""
+        with self._lock:
+            tokens = list(self._current.values())
+            self._current.clear()
+        for token in tokens:
+            token.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,177 @@
+"""
+Tests for async_backend (run with: python -m unittest discover tests).
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+# Keep the tests' call metrics out of the real history folder
+os.environ.setdefault("WAN_METRICS_DIR", tempfile.mkdtemp(prefix="wan_test_metrics_"))
+
+import async_backend
+import endpoint_pool
+import stub_server
+from async_http import AsyncHTTPClient
+from llm_errors import LLMTimeoutError
+
+MODEL = "llama3:8b"
+
+
+class SilentServer:
+    """Accepts connections and never answers them."""
+
+    def __init__(self):
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen()
+        self._connections = []
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._socket.getsockname()[1]}"
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            self._connections.append(connection)
+
+    def close(self):
+        self._socket.close()
+        for connection in self._connections:
+            connection.close()
+
+
+class PullTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.server = SilentServer()
+        self.addCleanup(self.server.close)
+
+    def pull(self, timeout):
+        async def run():
+            client = AsyncHTTPClient(read_timeout=0.5)
+            try:
+                return await async_backend.pull_ollama_model("llama3", self.server.url, timeout=timeout, client=client)
+            finally:
+                await client.aclose()
+        return asyncio.run(run())
+
+    def test_read_timeout_without_total_timeout(self):
+        success, message = self.pull(timeout=None)
+        self.assertFalse(success)
+        self.assertIn("read timeout", message)
+
+    def test_total_timeout(self):
+        success, message = self.pull(timeout=0.2)
+        self.assertFalse(success)
+        self.assertIn("timed out after 0.2 seconds", message)
+
+
+class GeneratePromptTest(unittest.TestCase):
+    def start_stub(self, **options):
+        stub = stub_server.StubServer(latency=0.01, token_rate=2000, tokens=16, **options).start()
+        self.addCleanup(stub.stop)
+        return stub
+
+    def generate(self, url, timeout=None):
+        async def run():
+            client = AsyncHTTPClient()
+            try:
+                return await async_backend.generate_prompt("Ollama", url, MODEL, "Moderate Freedom", "a fox",
+                                                           timeout=timeout, client=client)
+            finally:
+                await client.aclose()
+        return asyncio.run(run())
+
+    def test_success(self):
+        stub = self.start_stub()
+        self.assertTrue(self.generate(stub.url))
+        self.assertEqual(stub.stats()["by_path"].get("/api/chat"), 1)
+
+    def test_failover_to_the_next_endpoint(self):
+        failing = self.start_stub(error_rate=1.0, error_status=503)
+        healthy = self.start_stub()
+        endpoint_pool.configure_endpoints(endpoint_pool.OLLAMA, [healthy.url])
+        self.addCleanup(endpoint_pool.configure_endpoints, endpoint_pool.OLLAMA, [])
+
+        self.assertTrue(self.generate(failing.url))
+        self.assertGreaterEqual(failing.stats()["errors_injected"], 1)
+        self.assertEqual(healthy.stats()["by_path"].get("/api/chat"), 1)
+
+    def test_total_timeout(self):
+        server = SilentServer()
+        self.addCleanup(server.close)
+        started = time.monotonic()
+        with self.assertRaises(LLMTimeoutError):
+            self.generate(server.url, timeout=0.5)
+        self.assertLess(time.monotonic() - started, 2.5)
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        # Slow enough that the stream is still running when it is cancelled
+        self.stub = stub_server.StubServer(latency=0.01, token_rate=20, tokens=200).start()
+        self.addCleanup(self.stub.stop)
+
+    def test_finished_streams_reuse_the_connection(self):
+        stub = stub_server.StubServer(latency=0.01, token_rate=2000, tokens=16).start()
+        self.addCleanup(stub.stop)
+
+        async def run():
+            client = AsyncHTTPClient()
+            try:
+                for idea in ("a fox", "a lighthouse", "a market"):
+                    tokens = [t async for t in async_backend.stream_prompt("Ollama", stub.url, MODEL,
+                                                                           "Moderate Freedom", idea, client=client)]
+                    self.assertTrue(tokens)
+            finally:
+                await client.aclose()
+        asyncio.run(run())
+        self.assertEqual(stub.stats()["connections"], 1)
+
+    def test_cancel_closes_the_stream(self):
+        async def run():
+            client = AsyncHTTPClient()
+            received = []
+
+            async def consume():
+                async for token in async_backend.stream_prompt("Ollama", self.stub.url, MODEL, "Moderate Freedom",
+                                                               "a fox", client=client):
+                    received.append(token)
+
+            task = asyncio.create_task(consume())
+            while len(received) < 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # A connection abandoned mid-stream is closed, not pooled
+            self.assertFalse(any(client._idle.values()))
+            await client.aclose()
+            return received
+
+        received = asyncio.run(run())
+        self.assertLess(len(received), 200)
+        # The server sees the disconnect and stops generating
+        deadline = time.monotonic() + 2
+        while self.stub.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.stub.stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
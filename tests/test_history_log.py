@@ -0,0 +1,58 @@
+"""
+Tests for history_log (run with: python -m unittest discover tests).
+"""
+
+import json
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import history_log
+
+
+def _start_worker(log_dir, legacy_path, appends):
+    """One ComfyUI worker: open the log (importing the legacy file) and append entries."""
+    log = history_log.HistoryLog(log_dir)
+    log.import_legacy(legacy_path)
+    ids = []
+    for i in range(appends):
+        entry_id = log.next_id()
+        log.append({"id": entry_id, "input": f"worker entry {i}"})
+        ids.append(entry_id)
+    return ids
+
+
+class HistoryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.log_dir = self.dir / "log"
+        self.legacy = self.dir / "prompt_history.json"
+        self.legacy.write_text(json.dumps([{"id": 2, "input": "newer"}, {"id": 1, "input": "older"}]))
+
+    def test_concurrent_workers_import_once_and_get_unique_ids(self):
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(_start_worker, str(self.log_dir), str(self.legacy), 50) for _ in range(4)]
+            ids = [entry_id for future in futures for entry_id in future.result()]
+
+        self.assertEqual(len(ids), len(set(ids)))
+        entries = history_log.HistoryLog(self.log_dir).read_all()
+        self.assertEqual([e["input"] for e in entries if e["id"] in (1, 2)], ["newer", "older"])
+        self.assertEqual(len(entries), 2 + len(ids))
+        self.assertFalse(self.legacy.exists())
+        self.assertTrue(self.legacy.with_name(self.legacy.name + ".migrated").exists())
+
+    def test_file_left_behind_is_not_imported_again(self):
+        log = history_log.HistoryLog(self.log_dir)
+        log.import_legacy(self.legacy)
+        # The rename was undone (e.g. restored from a backup, or it failed on Windows)
+        self.legacy.with_name(self.legacy.name + ".migrated").replace(self.legacy)
+        log.import_legacy(self.legacy)
+        self.assertEqual(len(log.read_all()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
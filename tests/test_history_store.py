@@ -0,0 +1,39 @@
+"""
+Tests for history_store (run with: python -m unittest discover tests).
+"""
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import history_store
+
+ENTRY = {"user_idea": "a fox", "generated_prompt": "A fox crossing a frozen river", "timestamp": "2026-01-01T00:00:00"}
+
+
+class FailingEntry(dict):
+    """An entry whose insert fails (as a full disk would)."""
+
+    def get(self, key, default=None):
+        raise sqlite3.OperationalError("disk I/O error")
+
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = history_store.HistoryStore(Path(tempfile.mkdtemp()) / "history.db")
+        self.addCleanup(self.store.close)
+
+    def test_failed_batch_is_rolled_back(self):
+        with self.assertRaises(sqlite3.Error):
+            self.store.add_many([ENTRY, ENTRY, FailingEntry()])
+        # The next batch must not commit the rows inserted before the failure
+        self.store.add_many([ENTRY])
+        self.assertEqual(self.store.count(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
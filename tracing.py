@@ -0,0 +1,194 @@
+"""
+Lightweight span tracing with Chrome trace_event export.
+
+Off by default. When disabled, span() returns a shared no-op object and
+traced() functions call straight through, so instrumented code pays one
+flag check. Enable it with the WAN_TRACE environment variable (a path the
+trace is written to at exit) or tracing.enable(path), then open the file in
+chrome://tracing or https://ui.perfetto.dev.
+
+    with tracing.span("http", url=url) as s:
+        ...
+        s.set(status=200)
+
+    @tracing.traced("build_system_prompt")
+    def build_system_prompt(...): ...
+
+Each span becomes a complete ("X") event on its thread's track; spans nest
+by time, so a whole ComfyUI run or GUI session shows where every stage's
+time went.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+MAX_EVENTS = 500_000  # Beyond this new spans are dropped (and counted) to bound memory
+
+_enabled = False
+_events = []
+_dropped = 0
+_thread_names = {}
+_epoch_ns = time.perf_counter_ns()
+_trace_path = None
+_exit_hook_registered = False
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args):
+        """Attach extra arguments (shown in the trace viewer) to the span."""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        _record(self.name, self.cat, self.start, end, self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _record(name, cat, start_ns, end_ns, args):
+    global _dropped
+    if len(_events) >= MAX_EVENTS:
+        _dropped += 1
+        return
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    event = {
+        "name": name,
+        "cat": cat,
+        "ph": "X",
+        "ts": (start_ns - _epoch_ns) / 1000,
+        "dur": (end_ns - start_ns) / 1000,
+        "pid": _pid,
+        "tid": tid,
+    }
+    if args:
+        event["args"] = {k: v if isinstance(v, (int, float, bool, type(None))) else str(v) for k, v in args.items()}
+    _events.append(event)  # list.append is atomic; no lock on the hot path
+
+
+def span(name, cat="wan", **args):
+    """Context manager timing one stage (a no-op unless tracing is enabled)."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, cat, args)
+
+
+def traced(name=None, cat="wan"):
+    """Decorator: run the function inside a span named `name` (default: its qualified name)."""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(label, cat, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+    return decorate
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(path=None):
+    """Start recording spans. With a path, the trace is also written there at interpreter exit."""
+    global _enabled, _trace_path, _exit_hook_registered
+    with _lock:
+        if path:
+            _trace_path = str(path)
+            if not _exit_hook_registered:
+                _exit_hook_registered = True
+                atexit.register(_dump_at_exit)
+        _enabled = True
+
+
+def disable():
+    """Stop recording (already recorded spans are kept until clear() or dump())."""
+    global _enabled
+    _enabled = False
+
+
+def clear():
+    global _dropped
+    with _lock:
+        _events.clear()
+        _dropped = 0
+
+
+def trace_events():
+    """The recorded events plus thread-name metadata, in trace_event format."""
+    metadata = [
+        {"name": "process_name", "ph": "M", "pid": _pid, "tid": 0, "args": {"name": "Wan Prompt Crafter"}}
+    ] + [
+        {"name": "thread_name", "ph": "M", "pid": _pid, "tid": tid, "args": {"name": name}}
+        for tid, name in list(_thread_names.items())
+    ]
+    return metadata + list(_events)
+
+
+def dump(path=None):
+    """Write the trace as Chrome trace_event JSON (to `path`, or the enable() path). Returns the path."""
+    path = path or _trace_path
+    if not path:
+        raise ValueError("No trace path given (pass one, or enable(path) / set WAN_TRACE)")
+    with _lock:
+        document = {
+            "traceEvents": trace_events(),
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_events": _dropped},
+        }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(document, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _dump_at_exit():
+    if _events:
+        try:
+            print(f"Trace written to {dump()}")
+        except OSError as e:
+            print(f"Error writing trace: {e}")
+
+
+if os.environ.get("WAN_TRACE"):
+    enable(os.environ["WAN_TRACE"])
@@ -0,0 +1,102 @@
+"""
+Write-behind queue: callers enqueue items and return immediately; a single
+background worker writes them in batches.
+
+Items that arrive within `flush_interval` of each other are coalesced into one
+batch (up to `max_batch` items), so a burst of saves becomes one transaction.
+flush() blocks until everything queued so far has been written, and close()
+flushes and stops the worker - call it on shutdown so nothing is lost.
+"""
+
+import threading
+import time
+from collections import deque
+
+DEFAULT_FLUSH_INTERVAL = 0.25  # Seconds to wait for more items before writing a batch
+DEFAULT_MAX_BATCH = 100
+
+
+class WriteBehindQueue:
+    """Batches items for `write_batch(items)` on a background thread. Thread-safe."""
+
+    def __init__(self, write_batch, flush_interval=DEFAULT_FLUSH_INTERVAL, max_batch=DEFAULT_MAX_BATCH,
+                 name="write-behind"):
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._enqueued = 0   # total items ever queued
+        self._written = 0    # total items handed to write_batch (successfully or not)
+        self._closed = False
+        self._flush_now = False
+        self._worker = threading.Thread(target=self._run, daemon=True, name=name)
+        self._worker.start()
+
+    def put(self, item):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self._items.append(item)
+            self._enqueued += 1
+            self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return self._enqueued - self._written
+
+    def flush(self, timeout=None):
+        """Write everything queued so far without waiting out the coalescing delay. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._enqueued
+            self._flush_now = True
+            self._cond.notify_all()
+            while self._written < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Flush, then stop the worker. Further put() calls raise."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None  # closed and drained
+
+            # Coalesce: give a burst of puts a moment to land in the same batch
+            deadline = time.monotonic() + self.flush_interval
+            while (len(self._items) < self.max_batch and not self._closed and not self._flush_now):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._items.popleft() for _ in range(min(self.max_batch, len(self._items)))]
+            if not self._items:
+                self._flush_now = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                print(f"Error writing batch of {len(batch)} item(s): {e}")
+            finally:
+                with self._cond:
+                    self._written += len(batch)
+                    self._cond.notify_all()